@@ -0,0 +1,57 @@
+"""Benchmarks the vectorized vincenty_batch against a loop over vincenty.
+
+Run from the root folder of the project:
+
+$ python benchmarks/bench_distances.py
+"""
+import sys
+from pathlib import Path
+from timeit import default_timer
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from src.calculate.distances import vincenty, vincenty_batch
+from synthetic import random_chicago_coords
+
+
+def compare_rowwise(n):
+    """Times n rowwise distances with a loop and with vincenty_batch
+
+    Parameters
+    ----------
+    n : int
+        Number of coordinate pairs
+
+    Returns
+    -------
+    dict
+        Runtimes in seconds, speedup and maximum absolute
+        difference in meters between both approaches
+    """
+    coords1 = random_chicago_coords(n, seed=0)
+    coords2 = random_chicago_coords(n, seed=1)
+
+    start = default_timer()
+    loop = np.array([vincenty(c1, c2) for c1, c2 in zip(coords1, coords2)])
+    time_loop = default_timer() - start
+
+    start = default_timer()
+    batch = vincenty_batch(coords1, coords2)
+    time_batch = default_timer() - start
+    return {
+        'n': n,
+        'loop_s': time_loop,
+        'batch_s': time_batch,
+        'speedup': time_loop / time_batch,
+        'max_abs_diff_m': np.abs(loop - batch).max()
+    }
+
+
+if __name__ == '__main__':
+    print('{:>10} {:>10} {:>10} {:>10} {:>15}'.format(
+        'n', 'loop_s', 'batch_s', 'speedup', 'max_abs_diff_m'))
+    for n in [10**3, 10**4, 10**5, 10**6]:
+        res = compare_rowwise(n)
+        print('{n:>10,} {loop_s:>10.3f} {batch_s:>10.3f} {speedup:>10.1f} '
+              '{max_abs_diff_m:>15.2e}'.format(**res))
@@ -0,0 +1,406 @@
+"""Benchmarks the hot paths of the data preparation and the matching
+of the datasets on synthetic data (see synthetic.py).
+
+The results are stored as JSON files in benchmarks/results, named by date,
+commit and scale. Each run is compared with the latest earlier run of the
+same scale and slower benchmarks are reported, such that regressions can
+be tracked across changes.
+
+Run from the root folder of the project:
+
+$ python benchmarks/run_benchmarks.py --points 100000 --blocks 10000
+
+Only run some of the benchmarks, e.g.:
+
+$ python benchmarks/run_benchmarks.py --only assign_blocks contiguity
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from timeit import default_timer
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from src.calculate.block_index import BlockIndex
+from src.calculate.contiguity import add_ring_dummies, build_adjacency
+from src.calculate.distances import vincenty, vincenty_batch
+from src.calculate.nearest_route import RouteIndex
+from src.prepare_data.crime_database import (CRIMES_BLOCKS_INDEXES,
+                                             load_relevant_crimes, write_table)
+from src.prepare_data.crime_loader import load_crimes_csv
+from src.prepare_data.panel import (build_block_month_panel,
+                                    count_crimes_per_block_month)
+from src.prepare_data.school_years import (SCHOOL_YEARS, assign_school_years,
+                                           school_year_range, tag_school_times)
+from synthetic import (random_chicago_coords, synthetic_blocks,
+                       synthetic_routes, write_crimes_csv)
+
+RESULTS_PATH = Path(__file__).resolve().parent / 'results'
+
+# Number of coordinate pairs for the loop over vincenty, which is
+# too slow to run on all points
+N_VINCENTY_LOOP = 10000
+
+
+def prepare_data(tmp_dir, n_points, n_blocks, n_routes):
+    """Creates the synthetic data for all benchmarks
+
+    Parameters
+    ----------
+    tmp_dir : pathlib.Path
+        Folder for the crimes .csv file and the database
+
+    n_points : int
+        Number of crimes and of coordinate pairs
+
+    n_blocks : int
+        Approximate number of census blocks
+
+    n_routes : int
+        Number of Safe Passage routes
+
+    Returns
+    -------
+    dict
+        Synthetic data
+    """
+    data = {
+        'tmp_dir': tmp_dir,
+        'csv_path': tmp_dir / 'crimes.csv',
+        'sqldb_path': tmp_dir / 'crimes.db',
+        'coords1': random_chicago_coords(n_points, seed=0),
+        'coords2': random_chicago_coords(n_points, seed=1),
+        'blocks': synthetic_blocks(
+            n_blocks, seed=0, school_years=SCHOOL_YEARS),
+        'routes': synthetic_routes(n_routes, seed=0),
+        'sy_range': school_year_range()
+    }
+    write_crimes_csv(data['csv_path'], n_points, seed=0)
+    load_crimes_csv(data['csv_path'], data['sqldb_path'], verbose=False)
+    data['block_index'] = BlockIndex(data['blocks'])
+    data['crimes'] = load_relevant_crimes(
+        '2006-01-01', '2016-06-30', sqldb_path=str(data['sqldb_path']))
+    data['crimes']['tract_bloc'] = data['block_index'].query_points(
+        data['crimes']['Longitude'].values,
+        data['crimes']['Latitude'].values,
+        verbose=False)
+    data['crimes']['school_year'] = assign_school_years(
+        data['crimes']['Date'], data['sy_range'])
+    data['crimes'] = data['crimes'].dropna(
+        subset=['tract_bloc', 'school_year'])
+    return data
+
+
+def bench_vincenty_loop(data):
+    """Loop over vincenty for the first N_VINCENTY_LOOP pairs"""
+    coords = zip(data['coords1'][:N_VINCENTY_LOOP],
+                 data['coords2'][:N_VINCENTY_LOOP])
+    return [vincenty(c1, c2) for c1, c2 in coords]
+
+
+def bench_vincenty_batch(data):
+    """Vectorized distances of all coordinate pairs"""
+    return vincenty_batch(data['coords1'], data['coords2'])
+
+
+def bench_load_crimes_csv(data):
+    """Bulk load of the crimes .csv file into a new database"""
+    return load_crimes_csv(
+        data['csv_path'], data['tmp_dir'] / 'crimes_bench.db', verbose=False)
+
+
+def bench_load_relevant_crimes(data):
+    """Violent and property crimes of the analysis period"""
+    return load_relevant_crimes(
+        '2006-01-01', '2016-06-30', sqldb_path=str(data['sqldb_path']))
+
+
+def bench_school_times(data):
+    """School year, school hours and weekday of all crimes"""
+    return tag_school_times(data['crimes']['Date'], data['sy_range'])
+
+
+def bench_write_crimes_blocks(data):
+    """Blocks and school years of all crimes as new table"""
+    return write_table(
+        data['crimes'][['ID', 'tract_bloc', 'school_year']],
+        'crimes_blocks',
+        sqldb_path=data['sqldb_path'],
+        primary_key_cols=['ID'],
+        without_rowid=True,
+        indexes=CRIMES_BLOCKS_INDEXES,
+        verbose=False)
+
+
+def bench_block_index(data):
+    """Spatial index of all blocks"""
+    return BlockIndex(data['blocks'])
+
+
+def bench_assign_blocks(data):
+    """Point-in-polygon matching of points to blocks"""
+    return data['block_index'].query_points(
+        data['coords1'][:, 1], data['coords1'][:, 0], verbose=False)
+
+
+def bench_join_routes(data):
+    """Spatial join of routes and blocks"""
+    return data['block_index'].join(data['routes'], how='left')
+
+
+def bench_nearest_route(data):
+    """Distance of all crimes to the nearest route of their school year"""
+    route_index = RouteIndex(data['routes'])
+    return route_index.query(data['crimes']['Longitude'].values,
+                             data['crimes']['Latitude'].values,
+                             data['crimes']['school_year'].values)
+
+
+def bench_contiguity(data):
+    """Adjacency of all blocks and rings around treated blocks"""
+    adjacency = build_adjacency(data['block_index'])
+    return add_ring_dummies(data['blocks'], adjacency,
+                            data['block_index'].ids)
+
+
+def bench_panel(data):
+    """Crime counts per block and month of all school years"""
+    counts = count_crimes_per_block_month(data['crimes'])
+    return build_block_month_panel(data['blocks'], counts, data['sy_range'])
+
+
+# Name and function of all benchmarks. Each function gets the
+# synthetic data of prepare_data.
+BENCHMARKS = [
+    ('vincenty_loop', bench_vincenty_loop),
+    ('vincenty_batch', bench_vincenty_batch),
+    ('load_crimes_csv', bench_load_crimes_csv),
+    ('load_relevant_crimes', bench_load_relevant_crimes),
+    ('school_times', bench_school_times),
+    ('write_crimes_blocks', bench_write_crimes_blocks),
+    ('block_index', bench_block_index),
+    ('assign_blocks', bench_assign_blocks),
+    ('join_routes', bench_join_routes),
+    ('nearest_route', bench_nearest_route),
+    ('contiguity', bench_contiguity),
+    ('panel', bench_panel),
+]
+
+
+def time_benchmark(func, data, repeat=3):
+    """Runs a benchmark multiple times
+
+    Parameters
+    ----------
+    func : function
+
+    data : dict
+        See prepare_data
+
+    repeat : int, optional (default=3)
+        Number of runs
+
+    Returns
+    -------
+    dict
+        Best and mean runtime in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = default_timer()
+        func(data)
+        times.append(default_timer() - start)
+    return {'best_s': min(times), 'mean_s': float(np.mean(times))}
+
+
+def git_commit():
+    """Current commit of the project
+
+    Returns
+    -------
+    str
+        Abbreviated hash, 'unknown' if git is not available
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=str(RESULTS_PATH.parent),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(scale, names=None, repeat=3):
+    """Runs benchmarks on synthetic data of the given scale
+
+    Parameters
+    ----------
+    scale : dict
+        Keys 'points', 'blocks' and 'routes', see prepare_data
+
+    names : list of str, optional (default=None)
+        Names of benchmarks to run, defaults to all in BENCHMARKS
+
+    repeat : int, optional (default=3)
+        Number of runs of each benchmark
+
+    Returns
+    -------
+    dict
+        Results with metadata of the run
+    """
+    benchmarks = [(name, func) for name, func in BENCHMARKS
+                  if names is None or name in names]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print('Prepare synthetic data')
+        data = prepare_data(
+            Path(tmp_dir), scale['points'], scale['blocks'], scale['routes'])
+        for name, func in benchmarks:
+            results[name] = time_benchmark(func, data, repeat=repeat)
+            print('{:<25} {:>10.3f} s'.format(name, results[name]['best_s']))
+    return {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.node(),
+        'scale': scale,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def save_results(run, results_path=RESULTS_PATH):
+    """Saves the results of a run as JSON file
+
+    Parameters
+    ----------
+    run : dict
+        See run_benchmarks
+
+    results_path : pathlib.Path, optional (default=RESULTS_PATH)
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the new file
+    """
+    results_path.mkdir(parents=True, exist_ok=True)
+    file_name = '{}_{}_{}.json'.format(run['date'].replace(':', ''),
+                                       run['commit'], run['scale']['points'])
+    path = results_path / file_name
+    with path.open('w') as f:
+        json.dump(run, f, indent=1)
+    return path
+
+
+def latest_run(scale, results_path=RESULTS_PATH):
+    """Loads the latest stored run with the same scale
+
+    Parameters
+    ----------
+    scale : dict
+        See run_benchmarks
+
+    results_path : pathlib.Path, optional (default=RESULTS_PATH)
+
+    Returns
+    -------
+    dict or None
+        None if no run with the same scale exists
+    """
+    runs = []
+    for path in results_path.glob('*.json'):
+        with path.open() as f:
+            run = json.load(f)
+        if run['scale'] == scale:
+            runs.append(run)
+    if not runs:
+        return None
+    return max(runs, key=lambda run: run['date'])
+
+
+def compare_runs(run, previous, threshold=1.2):
+    """Prints the runtimes of two runs next to each other
+
+    Parameters
+    ----------
+    run, previous : dict
+        See run_benchmarks
+
+    threshold : float, optional (default=1.2)
+        Benchmarks which are slower by more than this factor
+        are marked as regressions
+
+    Returns
+    -------
+    list of str
+        Names of the benchmarks with a regression
+    """
+    print('Comparison with commit {} ({})'.format(previous['commit'],
+                                                  previous['date']))
+    print('{:<25} {:>10} {:>10} {:>8}'.format('benchmark', 'before_s',
+                                              'now_s', 'ratio'))
+    regressions = []
+    for name, result in run['results'].items():
+        if name not in previous['results']:
+            continue
+        before = previous['results'][name]['best_s']
+        ratio = result['best_s'] / before
+        marker = ''
+        if ratio > threshold:
+            regressions.append(name)
+            marker = ' <- slower'
+        print('{:<25} {:>10.3f} {:>10.3f} {:>8.2f}{}'.format(
+            name, before, result['best_s'], ratio, marker))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the hot paths on synthetic data.')
+    parser.add_argument(
+        '--points',
+        type=int,
+        default=100000,
+        help='Number of crimes and coordinate pairs')
+    parser.add_argument(
+        '--blocks',
+        type=int,
+        default=10000,
+        help='Approximate number of census blocks')
+    parser.add_argument(
+        '--routes', type=int, default=500, help='Number of routes')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Runs of each benchmark')
+    parser.add_argument(
+        '--only',
+        nargs='+',
+        choices=[name for name, _ in BENCHMARKS],
+        help='Benchmarks to run, defaults to all')
+    parser.add_argument(
+        '--no-save', action='store_true', help='Do not store the results')
+    args = parser.parse_args()
+
+    scale = {
+        'points': args.points,
+        'blocks': args.blocks,
+        'routes': args.routes
+    }
+    previous = latest_run(scale)
+    run = run_benchmarks(scale, names=args.only, repeat=args.repeat)
+    if not args.no_save:
+        print('Results saved to {}'.format(save_results(run)))
+    if previous is not None:
+        regressions = compare_runs(run, previous)
+        if regressions:
+            sys.exit(1)
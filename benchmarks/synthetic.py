@@ -0,0 +1,248 @@
+"""Generates synthetic data which resembles the data of the project:
+crimes in the format of the raw .csv file, census blocks and
+Safe Passage routes, all within the bounding box of Chicago.
+
+Sizes are configurable, such that the benchmarks can be run
+from small (e.g. 10k crimes) to large scale (e.g. 10M crimes)."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString, Polygon
+
+# Bounding box of Chicago as (min lon, min lat, max lon, max lat)
+CHICAGO_BOUNDS = (-87.94, 41.64, -87.52, 42.03)
+
+# Range of the identifiers of the census blocks of Chicago
+# (6-digit tract and 4-digit block number, e.g. 8361002000)
+MIN_BLOCK_ID = 1010001000
+MAX_BLOCK_ID = 8439999999
+
+# FBI codes of the synthetic crimes. Includes codes which are neither
+# violent nor property crimes, such that loading them requires a filter.
+FBI_CODES = ['01A', '02', '03', '04A', '04B', '05', '06', '07', '09', '08B',
+             '14', '26']
+
+# Columns of the raw crimes .csv file
+CSV_COLUMNS = [
+    'ID', 'Case Number', 'Date', 'Block', 'IUCR', 'Primary Type',
+    'Description', 'Location Description', 'Arrest', 'Domestic', 'Beat',
+    'District', 'Ward', 'Community Area', 'FBI Code', 'X Coordinate',
+    'Y Coordinate', 'Year', 'Updated On', 'Latitude', 'Longitude', 'Location'
+]
+
+
+def random_chicago_coords(n, seed=0):
+    """Draws uniformly distributed coordinates within the
+    bounding box of Chicago
+
+    Parameters
+    ----------
+    n : int
+        Number of coordinates
+
+    seed : int, optional (default=0)
+        Seed of the random number generator
+
+    Returns
+    -------
+    np.ndarray of floats, shape (n, 2)
+        Coordinates as (latitude, longitude)
+    """
+    rs = np.random.RandomState(seed)
+    min_lon, min_lat, max_lon, max_lat = CHICAGO_BOUNDS
+    return np.column_stack([
+        rs.uniform(min_lat, max_lat, size=n),
+        rs.uniform(min_lon, max_lon, size=n)
+    ])
+
+
+def synthetic_blocks(n_blocks, seed=0, school_years=None):
+    """Creates census blocks as a distorted grid over Chicago
+
+    The corners of the grid cells are moved randomly, but neighbouring
+    blocks share their corners. Therefore, the blocks cover the bounding
+    box without gaps and overlaps, like real census blocks.
+
+    Parameters
+    ----------
+    n_blocks : int
+        Approximate number of blocks, the grid has the next larger
+        square number of cells
+
+    seed : int, optional (default=0)
+        Seed of the random number generator
+
+    school_years : list of str, optional (default=None)
+        If given, each block is repeated once per school year with
+        the column 'school_year' and a random treatment dummy 'treated'
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        Columns 'tract_bloc' (random unique integers between
+        MIN_BLOCK_ID and MAX_BLOCK_ID) and 'geometry',
+        plus 'school_year' and 'treated' if school_years is given
+    """
+    rs = np.random.RandomState(seed)
+    n_side = int(np.ceil(np.sqrt(n_blocks)))
+    min_lon, min_lat, max_lon, max_lat = CHICAGO_BOUNDS
+    lon = np.linspace(min_lon, max_lon, n_side + 1)
+    lat = np.linspace(min_lat, max_lat, n_side + 1)
+    corner_lon, corner_lat = np.meshgrid(lon, lat, indexing='ij')
+    # Moving the inner corners by less than half a cell keeps
+    # all blocks simple polygons
+    step_lon, step_lat = lon[1] - lon[0], lat[1] - lat[0]
+    inner = (slice(1, -1), slice(1, -1))
+    shift = rs.uniform(-.3, .3, size=(2, n_side - 1, n_side - 1))
+    corner_lon[inner] += shift[0] * step_lon
+    corner_lat[inner] += shift[1] * step_lat
+
+    geometries = [
+        Polygon([(corner_lon[i, j], corner_lat[i, j]),
+                 (corner_lon[i + 1, j], corner_lat[i + 1, j]),
+                 (corner_lon[i + 1, j + 1], corner_lat[i + 1, j + 1]),
+                 (corner_lon[i, j + 1], corner_lat[i, j + 1])])
+        for i in range(n_side) for j in range(n_side)
+    ]
+    # Unique identifiers in random order with gaps, spread over the
+    # range of the 10-digit identifiers of the real blocks (tract and
+    # block number), which exceeds the range of int32
+    n_geometries = len(geometries)
+    gap = (MAX_BLOCK_ID - MIN_BLOCK_ID) // n_geometries
+    ids = (MIN_BLOCK_ID +
+           rs.permutation(n_geometries).astype('int64') * gap +
+           rs.randint(0, gap, size=n_geometries, dtype='int64'))
+    blocks = gpd.GeoDataFrame({'tract_bloc': ids, 'geometry': geometries})
+    if school_years is None:
+        return blocks
+
+    blocks = pd.concat([blocks] * len(school_years), ignore_index=True)
+    blocks['school_year'] = np.repeat(school_years, len(geometries))
+    blocks['treated'] = (rs.uniform(size=blocks.shape[0]) < .02).astype(
+        'int64')
+    return gpd.GeoDataFrame(blocks, geometry='geometry')
+
+
+def synthetic_routes(n_routes, seed=0, n_segments=20,
+                     school_years=('SY1314', 'SY1415', 'SY1516')):
+    """Creates Safe Passage routes as random walks through Chicago
+
+    Parameters
+    ----------
+    n_routes : int
+        Number of routes
+
+    seed : int, optional (default=0)
+        Seed of the random number generator
+
+    n_segments : int, optional (default=20)
+        Number of segments of each route, each roughly 100 meters long
+
+    school_years : iterable of str, optional
+        (default=('SY1314', 'SY1415', 'SY1516'))
+        School years which are assigned randomly to the routes
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        Columns 'route_number', 'school_year' and 'geometry'
+    """
+    rs = np.random.RandomState(seed)
+    starts = random_chicago_coords(n_routes, seed=seed)[:, ::-1]
+    # Streets run from north to south or from east to west
+    steps = np.where(
+        rs.uniform(size=(n_routes, n_segments, 1)) < .5, [[.0012, 0]],
+        [[0, .0009]]) * rs.choice([-1, 1], size=(n_routes, n_segments, 1))
+    points = starts[:, None, :] + np.concatenate(
+        [np.zeros((n_routes, 1, 2)), np.cumsum(steps, axis=1)], axis=1)
+    return gpd.GeoDataFrame({
+        'route_number': np.arange(n_routes),
+        'school_year': rs.choice(list(school_years), size=n_routes),
+        'geometry': [LineString(p) for p in points]
+    })
+
+
+def synthetic_crimes(n, seed=0, min_date='2001-01-01', max_date='2018-06-30'):
+    """Creates crimes in the format of the raw crimes .csv file
+
+    Parameters
+    ----------
+    n : int
+        Number of crimes
+
+    seed : int, optional (default=0)
+        Seed of the random number generator
+
+    min_date, max_date : str, format = "YYYY-MM-DD", optional
+        (default='2001-01-01' and '2018-06-30')
+        Range of the dates of the crimes
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns CSV_COLUMNS with dates formatted as in the .csv file
+        ('MM/DD/YYYY HH:MM:SS AM'). About 1% of the coordinates
+        are missing.
+    """
+    rs = np.random.RandomState(seed)
+    start = pd.Timestamp(min_date).value // 10**9
+    end = pd.Timestamp(max_date).value // 10**9
+    dates = pd.to_datetime(rs.randint(start, end, size=n), unit='s')
+    coords = random_chicago_coords(n, seed=seed)
+    coords[rs.uniform(size=n) < .01] = np.nan
+    crimes = pd.DataFrame({
+        'ID': rs.choice(20 * n, size=n, replace=False) + 1,
+        'Case Number': 'HX0',
+        'Date': dates.strftime('%m/%d/%Y %I:%M:%S %p'),
+        'Block': '012XX W MADISON ST',
+        'IUCR': '0486',
+        'Primary Type': 'BATTERY',
+        'Description': 'DOMESTIC BATTERY SIMPLE',
+        'Location Description': 'STREET',
+        'Arrest': rs.uniform(size=n) < .2,
+        'Domestic': rs.uniform(size=n) < .15,
+        'Beat': rs.randint(111, 2535, size=n),
+        'District': rs.randint(1, 26, size=n).astype('float64'),
+        'Ward': rs.randint(1, 51, size=n).astype('float64'),
+        'Community Area': rs.randint(1, 78, size=n).astype('float64'),
+        'FBI Code': rs.choice(FBI_CODES, size=n),
+        'X Coordinate': 1160000.,
+        'Y Coordinate': 1890000.,
+        'Year': dates.year,
+        'Updated On': '02/10/2018 03:50:01 PM',
+        'Latitude': coords[:, 0],
+        'Longitude': coords[:, 1],
+        'Location': ''
+    })
+    return crimes[CSV_COLUMNS]
+
+
+def write_crimes_csv(path, n, seed=0, chunksize=1000000):
+    """Writes synthetic crimes into a .csv file in the format
+    of the raw crimes file
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+
+    n : int
+        Number of crimes
+
+    seed : int, optional (default=0)
+        Seed of the random number generator
+
+    chunksize : int, optional (default=1000000)
+        Number of crimes which are generated at once
+
+    Returns
+    -------
+    Nothing
+    """
+    for i, start in enumerate(range(0, n, chunksize)):
+        crimes = synthetic_crimes(min(chunksize, n - start), seed=seed + i)
+        # IDs have to be unique over all chunks
+        crimes['ID'] += 20 * start
+        crimes.to_csv(
+            str(path), mode='w' if i == 0 else 'a', header=(i == 0),
+            index=False)
+    return
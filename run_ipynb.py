@@ -3,28 +3,181 @@ can be passed as arguments to the script and can be provided relative to the
 folder which contains all notebooks (e.g. "notebooks").
 Notebooks are run with their enclosing folder as working directory.
 
+The order of execution is derived from the artifacts (files in data/,
+models/, ... and tables of the crimes database) which each notebook reads
+and writes, see NOTEBOOK_ARTIFACTS.
+Notebooks which do not depend on each other are run concurrently.
+A notebook is skipped if its code, the code of the imported modules of
+src and all of its inputs are unchanged since its last successful run
+and its outputs still exist unchanged.
+
 Example
 -------
 If you want to run all Jupyter notebooks in "notebooks/0_prepare_data", run:
 
 $ python run_ipynb.py 0_prepare_data
+
+To run the notebooks of multiple folders with up to 4 notebooks at the same
+time and to rerun all notebooks, even unchanged ones:
+
+$ python run_ipynb.py 1_prepare_data 3_match_datasets --workers 4 --force
 """
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 import nbformat
 from nbconvert.preprocessors import CellExecutionError, ExecutePreprocessor
 
+from src.instrument import LOG_ENV, format_summary, measure, read_log
+
+# Artifacts which are read (inputs) and written (outputs) by each notebook,
+# relative to the project root. Folders count as one artifact. A table of
+# an SQLite database is given as '<path>:<table>', such that notebooks
+# which write different tables of the same database do not invalidate
+# each other.
+# Notebooks which are not listed here are run after all notebooks before
+# them and are never skipped.
+NOTEBOOK_ARTIFACTS = {
+    '0_download_data/0.0-binste-download-data.ipynb': {
+        'inputs': [],
+        'outputs': ['data/raw/Crimes_-_2001_to_present.csv'],
+    },
+    '1_prepare_data/0.0-binste-foia-sp.ipynb': {
+        'inputs': [
+            'data/raw/Safe_Passage_Schools_By_Implementation_Year_8.12.16.xlsx'
+        ],
+        'outputs': ['data/processed/foia_sp.pkl'],
+    },
+    '1_prepare_data/1.0-binste-routes.ipynb': {
+        'inputs': [
+            'data/raw/routes', 'data/raw/school_names.xlsx',
+            'data/processed/foia_sp.pkl'
+        ],
+        'outputs': ['data/processed/routes.pkl'],
+    },
+    '1_prepare_data/2.0-binste-school-locations.ipynb': {
+        'inputs': ['data/raw/school_locations', 'data/processed/routes.pkl'],
+        'outputs': ['data/interim/schools.pkl'],
+    },
+    '1_prepare_data/3.0-binste-blocks.ipynb': {
+        'inputs': ['data/raw/Boundaries - Census Blocks - 2010'],
+        'outputs': ['data/interim/blocks.pkl'],
+    },
+    # With update=True, the notebook also updates the table crimes_blocks
+    # for the changed crimes. The table is only declared as an output of
+    # 3_match_datasets/2.0, which rebuilds it, such that rebuilding it
+    # does not rerun this notebook.
+    '2_set_up_crime_database/0.0-binste-set-up-crime-database.ipynb': {
+        'inputs': [
+            'data/raw/Crimes_-_2001_to_present.csv',
+            'data/processed/routes.pkl', 'data/processed/blocks.pkl',
+            'data/processed/block_index.pkl'
+        ],
+        'outputs': ['data/processed/crimes.db:crimes'],
+    },
+    '3_match_datasets/0.0-binste-blocks-routes.ipynb': {
+        'inputs': ['data/interim/blocks.pkl', 'data/processed/routes.pkl'],
+        'outputs': [
+            'data/processed/blocks.pkl', 'data/processed/block_index.pkl'
+        ],
+    },
+    '3_match_datasets/1.0-binste-schools-foia.ipynb': {
+        'inputs': ['data/interim/schools.pkl', 'data/processed/foia_sp.pkl'],
+        'outputs': ['data/interim/schools_foia.pkl'],
+    },
+    '3_match_datasets/1.1-binste-schools-blocks.ipynb': {
+        'inputs': [
+            'data/interim/schools_foia.pkl', 'data/processed/blocks.pkl'
+        ],
+        'outputs': ['data/processed/schools_blocks.pkl'],
+    },
+    # Adds the table crimes_blocks to the crimes database
+    '3_match_datasets/2.0-binste-crimes-blocks.ipynb': {
+        'inputs': [
+            'data/processed/crimes.db:crimes', 'data/processed/blocks.pkl',
+            'data/processed/routes.pkl'
+        ],
+        'outputs': ['data/processed/crimes.db:crimes_blocks'],
+    },
+    '4_combine_for_analysis/0.0-binste-create-estimation-dataset.ipynb': {
+        'inputs': [
+            'data/processed/crimes.db:crimes',
+            'data/processed/crimes.db:crimes_blocks',
+            'data/processed/routes.pkl', 'data/processed/schools_blocks.pkl',
+            'data/processed/blocks.pkl', 'data/processed/block_index.pkl'
+        ],
+        'outputs': [
+            'data/processed/est_df', 'data/processed/est_df_reduced',
+            'data/processed/block_adjacency.npz',
+            'data/processed/figures/violent_hourly_counts.pkl',
+            'data/processed/figures/violent_yearly_counts.pkl',
+            'data/processed/figures/yearly_violent_FBI.pkl',
+            'data/processed/figures/blocks_with_dummies.pkl',
+            'data/processed/figures/blocks_fig_3.pkl'
+        ],
+    },
+    '5_analysis/0.0-binste-estimation-poisson.ipynb': {
+        'inputs': [
+            'data/processed/est_df', 'data/processed/est_df_reduced',
+            'data/processed/blocks.pkl', 'data/processed/block_index.pkl',
+            'data/processed/block_adjacency.npz'
+        ],
+        'outputs': [
+            'models/summary_poisson_violent.csv',
+            'models/summary_poisson_property.csv',
+            'models/summary_poisson_violent_reduced.csv',
+            'models/summary_poisson_property_reduced.csv',
+            'models/summary_specifications.csv', 'models/placebo_draws.csv'
+        ],
+    },
+    '5_analysis/1.0-binste-analyze-crime-results-census-block-level.ipynb': {
+        'inputs': [
+            'data/processed/schools_blocks.pkl', 'data/processed/routes.pkl',
+            'data/processed/figures/blocks_fig_3.pkl',
+            'data/processed/figures/violent_yearly_counts.pkl',
+            'data/processed/figures/violent_hourly_counts.pkl',
+            'data/processed/figures/yearly_violent_FBI.pkl',
+            'data/processed/figures/blocks_with_dummies.pkl',
+            'models/summary_poisson_violent.csv',
+            'models/summary_poisson_property.csv',
+            'models/summary_poisson_violent_reduced.csv',
+            'models/summary_poisson_property_reduced.csv'
+        ],
+        'outputs': [],
+    },
+    '5_analysis/2.0-binste-descriptives-for-appendix.ipynb': {
+        'inputs': [
+            'data/processed/crimes.db:crimes',
+            'data/processed/figures/blocks_with_dummies.pkl'
+        ],
+        'outputs': [],
+    },
+}
+
+# Stores hashes of code, inputs and outputs of the last successful run
+# of each notebook
+STATE_PATH = Path('.run_ipynb_state.json')
+
+# Log of the wall time, CPU time and memory of the notebooks and of the
+# instrumented functions of src which they call (see src/instrument.py)
+LOG_PATH = Path('.run_ipynb_log.jsonl')
 
-def validate_input(input_args):
-    """Extracts folder names from passed arguments and makes sure that
-    they are valid.
+
+def validate_input(folder_names):
+    """Makes sure that the passed folder names are valid.
 
     Parameters
     ----------
-    input_args : iterable
-        All input arguments with the first one being the script name
-        (i.e. sys.argv)
+    folder_names : list of str
+        Folder names relative to notebooks_path
 
     Returns
     -------
@@ -32,11 +185,11 @@ def validate_input(input_args):
         All valid folder names
     """
     # Stops execution of script if no folders are given
-    if len(input_args) == 1:
+    if not folder_names:
         raise Exception('You need to specify either one or multiple folders ' +
                         f'inside "./{str(notebooks_path)}" to run')
     # If folders are given, first check if they exist, else stop
-    folders = [Path(f) for f in input_args[1:]]
+    folders = [Path(f) for f in folder_names]
     for f in folders:
         if not (notebooks_path / f).is_dir():
             raise Exception(
@@ -50,6 +203,8 @@ def run_notebook(nb_wd, nb_path):
     Executes the passed notebook with nb_wd as the working directory.
     If an error occurs during the execution, a message is raised to the user
     and the notebook is saved anyway, including the traceback.
+    Wall time, CPU time and peak memory during the run (including the
+    kernel) are written to the log of src.instrument.
 
     Parameters
     ----------
@@ -80,7 +235,8 @@ def run_notebook(nb_wd, nb_path):
     # https://nbconvert.readthedocs.io/en/latest/execute_api.html
     try:
         # Run notebook
-        out = ep.preprocess(nb, {'metadata': {'path': str(nb_wd)}})
+        with measure('run_notebook', label=str(nb_path), children=True):
+            out = ep.preprocess(nb, {'metadata': {'path': str(nb_wd)}})
     except CellExecutionError:
         out = None
         msg = f'Error executing the notebook "{str(nb_path)}".\n\n'
@@ -94,27 +250,496 @@ def run_notebook(nb_wd, nb_path):
     return
 
 
+def file_hash(path, hash_cache):
+    """Calculates SHA-1 hash of the content of a file
+
+    Hashes are cached by path, size and modification time, such that large
+    files like the crimes database are only read again if they changed.
+
+    Parameters
+    ----------
+    path : Path
+
+    hash_cache : dict
+        Cached hashes, is updated in place
+
+    Returns
+    -------
+    str
+    """
+    stat = path.stat()
+    key = str(path)
+    cached = hash_cache.get(key)
+    if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached[2]
+    h = hashlib.sha1()
+    with path.open('rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    hash_cache[key] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return h.hexdigest()
+
+
+def table_hash(path, table, hash_cache):
+    """Calculates SHA-1 hash of the definition and the rows of a table
+    of an SQLite database
+
+    Hashes are cached like in file_hash. Reading all rows takes about
+    10 seconds per million crimes, therefore this only happens if the
+    database changed.
+
+    Parameters
+    ----------
+    path : Path
+        Path to the database
+
+    table : str
+
+    hash_cache : dict
+        See file_hash
+
+    Returns
+    -------
+    str or None
+        None if the table does not exist
+    """
+    stat = path.stat()
+    key = '{}:{}'.format(path, table)
+    cached = hash_cache.get(key)
+    if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return cached[2]
+    con = sqlite3.connect('{}?mode=ro'.format(path.resolve().as_uri()),
+                          uri=True)
+    try:
+        definition = con.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (table, )).fetchone()
+        if definition is None:
+            return None
+        h = hashlib.sha1(definition[0].encode())
+        cursor = con.execute('SELECT * FROM "{}"'.format(table))
+        for rows in iter(lambda: cursor.fetchmany(100000), []):
+            h.update(repr(rows).encode())
+    finally:
+        con.close()
+    hash_cache[key] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return h.hexdigest()
+
+
+def artifact_hash(artifact, hash_cache):
+    """Calculates hash of a file, of all files in a folder or of a table
+    of an SQLite database
+
+    Parameters
+    ----------
+    artifact : str
+        Path relative to the project root, '<path>:<table>' for a table
+
+    hash_cache : dict
+        See file_hash
+
+    Returns
+    -------
+    str or None
+        None if the artifact does not exist
+    """
+    path, _, table = artifact.partition(':')
+    path = Path(path)
+    if table:
+        return table_hash(path, table, hash_cache) if path.is_file() else None
+    if path.is_file():
+        return file_hash(path, hash_cache)
+    if path.is_dir():
+        h = hashlib.sha1()
+        for f in sorted(x for x in path.rglob('*') if x.is_file()):
+            h.update(str(f.relative_to(path)).encode())
+            h.update(file_hash(f, hash_cache).encode())
+        return h.hexdigest()
+    return None
+
+
+def module_path(module):
+    """Finds the file of a module of the project
+
+    Parameters
+    ----------
+    module : str
+        Dotted module name, e.g. 'src.prepare_data.routes'
+
+    Returns
+    -------
+    Path or None
+        None if the module is not a file of the project
+    """
+    path = Path(*module.split('.'))
+    for candidate in [path.with_suffix('.py'), path / '__init__.py']:
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def imported_modules(source, package=None):
+    """Finds the names of all modules of the src package which are imported
+    by some code
+
+    Parameters
+    ----------
+    source : str
+        Python code
+
+    package : str, optional (default=None)
+        Package of the code, needed to resolve relative imports
+
+    Returns
+    -------
+    set of str
+    """
+    modules = set(re.findall(r'^\s*(?:from|import)\s+(src(?:\.\w+)*)',
+                             source, re.MULTILINE))
+    if package is not None:
+        parts = package.split('.')
+        for dots, name in re.findall(r'^\s*from\s+(\.+)(\w*(?:\.\w+)*)',
+                                     source, re.MULTILINE):
+            parent = parts[:len(parts) - len(dots) + 1]
+            modules.add('.'.join(parent + ([name] if name else [])))
+    return modules
+
+
+def imported_src_files(source):
+    """Finds all files of the src package which are imported by some code,
+    including the ones imported by these files
+
+    Parameters
+    ----------
+    source : str
+        Python code
+
+    Returns
+    -------
+    set of Path
+    """
+    files = set()
+    to_visit = [(source, None)]
+    while to_visit:
+        source, package = to_visit.pop()
+        for module in imported_modules(source, package=package):
+            path = module_path(module)
+            # Modules can import each other, visit each file only once
+            if path is not None and path not in files:
+                files.add(path)
+                to_visit.append((path.read_text(),
+                                 '.'.join(path.parent.parts)))
+    return files
+
+
+def code_hash(nb_path):
+    """Calculates hash of the code of a notebook and of all files
+    of the src package which it imports
+
+    Outputs of the cells are ignored as they change with every run.
+
+    Parameters
+    ----------
+    nb_path : Path
+
+    Returns
+    -------
+    str
+    """
+    with nb_path.open() as f:
+        nb = nbformat.read(f, as_version=nbformat.NO_CONVERT)
+    source = '\n'.join(
+        cell['source'] for cell in nb['cells'] if cell['cell_type'] == 'code')
+    h = hashlib.sha1(source.encode())
+    for path in sorted(imported_src_files(source)):
+        h.update(str(path).encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def notebook_key(nb_path):
+    """Path of a notebook relative to notebooks_path as used
+    in NOTEBOOK_ARTIFACTS
+
+    Parameters
+    ----------
+    nb_path : Path
+
+    Returns
+    -------
+    str
+    """
+    return nb_path.relative_to(notebooks_path).as_posix()
+
+
+def build_dependencies(nb_paths):
+    """Finds for each notebook the notebooks which have to run before it
+
+    A notebook depends on all notebooks before it (in the given order)
+    which write one of its inputs. Notebooks without declared artifacts
+    depend on all notebooks before them and vice versa.
+
+    Parameters
+    ----------
+    nb_paths : list of Path
+        Notebooks in the order of their numbering
+
+    Returns
+    -------
+    dict
+        Notebook paths as keys and sets of notebook paths as values
+    """
+    dependencies = {}
+    for i, nb_path in enumerate(nb_paths):
+        artifacts = NOTEBOOK_ARTIFACTS.get(notebook_key(nb_path))
+        dependencies[nb_path] = set()
+        for earlier in nb_paths[:i]:
+            earlier_artifacts = NOTEBOOK_ARTIFACTS.get(notebook_key(earlier))
+            if (artifacts is None or earlier_artifacts is None
+                    or set(artifacts['inputs'])
+                    & set(earlier_artifacts['outputs'])):
+                dependencies[nb_path].add(earlier)
+    return dependencies
+
+
+def notebook_fingerprint(nb_path, hash_cache):
+    """Hashes of the code and of all inputs of a notebook
+
+    Inputs which are written by a later notebook (e.g. the blocks which
+    2_set_up_crime_database/0.0 reads with update=True) are left out.
+    They stem from an earlier run of the pipeline, and a change of them
+    reruns the later notebook, but not this one.
+
+    Parameters
+    ----------
+    nb_path : Path
+
+    hash_cache : dict
+        See file_hash
+
+    Returns
+    -------
+    dict or None
+        None if the notebook has no declared artifacts
+    """
+    key = notebook_key(nb_path)
+    artifacts = NOTEBOOK_ARTIFACTS.get(key)
+    if artifacts is None:
+        return None
+    later_outputs = set()
+    for other_key, other_artifacts in NOTEBOOK_ARTIFACTS.items():
+        if other_key > key:
+            later_outputs.update(other_artifacts['outputs'])
+    return {
+        'code': code_hash(nb_path),
+        'inputs': {a: artifact_hash(a, hash_cache)
+                   for a in artifacts['inputs'] if a not in later_outputs}
+    }
+
+
+def output_hashes(nb_path, hash_cache):
+    """Hashes of all outputs of a notebook
+
+    Parameters
+    ----------
+    nb_path : Path
+
+    hash_cache : dict
+        See file_hash
+
+    Returns
+    -------
+    dict
+    """
+    artifacts = NOTEBOOK_ARTIFACTS[notebook_key(nb_path)]
+    return {a: artifact_hash(a, hash_cache) for a in artifacts['outputs']}
+
+
+def is_up_to_date(nb_path, fingerprint, state, hash_cache):
+    """Checks if a notebook can be skipped
+
+    Parameters
+    ----------
+    nb_path : Path
+
+    fingerprint : dict or None
+        See notebook_fingerprint
+
+    state : dict
+        Content of the state file
+
+    hash_cache : dict
+        See file_hash
+
+    Returns
+    -------
+    bool
+        True if code and inputs are the same as in the last successful
+        run and the outputs were not changed since
+    """
+    last_run = state['notebooks'].get(notebook_key(nb_path))
+    if fingerprint is None or last_run is None:
+        return False
+    outputs = output_hashes(nb_path, hash_cache)
+    return (last_run['code'] == fingerprint['code']
+            and last_run['inputs'] == fingerprint['inputs']
+            and last_run['outputs'] == outputs
+            and None not in outputs.values())
+
+
+def load_state():
+    """Loads the state file
+
+    Returns
+    -------
+    dict
+        With keys 'notebooks' and 'file_hashes'
+    """
+    if STATE_PATH.is_file():
+        with STATE_PATH.open() as f:
+            return json.load(f)
+    return {'notebooks': {}, 'file_hashes': {}}
+
+
+def save_state(state):
+    """Saves the state file
+
+    Parameters
+    ----------
+    state : dict
+
+    Returns
+    -------
+    Nothing
+    """
+    with STATE_PATH.open('w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    return
+
+
+def run_pipeline(nb_paths, workers=1, force=False):
+    """Runs notebooks in the order given by their dependencies
+
+    Notebooks whose dependencies are done are submitted to a pool of worker
+    processes, each notebook gets its own kernel. If a notebook fails,
+    the notebooks depending on it are not run.
+
+    Parameters
+    ----------
+    nb_paths : list of Path
+        Notebooks in the order of their numbering
+
+    workers : int, optional (default=1)
+        Maximal number of notebooks which run at the same time
+
+    force : boolean, optional (default=False)
+        If True, all notebooks are run, even if they are up to date
+
+    Returns
+    -------
+    dict
+        Notebook paths as keys and 'run', 'skipped', 'failed' or
+        'not run' as values
+    """
+    dependencies = build_dependencies(nb_paths)
+    state = load_state()
+    hash_cache = state['file_hashes']
+    status = {}
+    fingerprints = {}
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(status) < len(nb_paths):
+            for nb_path in nb_paths:
+                if nb_path in status or nb_path in running.values():
+                    continue
+                deps_status = [status.get(d) for d in dependencies[nb_path]]
+                if any(s in ['failed', 'not run'] for s in deps_status):
+                    status[nb_path] = 'not run'
+                    print(f'Not run {str(nb_path)} (a dependency failed)')
+                    continue
+                if not all(s in ['run', 'skipped'] for s in deps_status):
+                    continue
+                # Inputs are hashed only now, after all notebooks
+                # which write them have finished
+                fingerprint = notebook_fingerprint(nb_path, hash_cache)
+                if not force and is_up_to_date(nb_path, fingerprint, state,
+                                               hash_cache):
+                    status[nb_path] = 'skipped'
+                    print(f'Skip {str(nb_path)} (up to date)')
+                    continue
+                print(f'Run {str(nb_path)}')
+                fingerprints[nb_path] = fingerprint
+                future = executor.submit(run_notebook, nb_path.parent,
+                                         nb_path)
+                running[future] = nb_path
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                nb_path = running.pop(future)
+                if future.exception() is not None:
+                    status[nb_path] = 'failed'
+                    error = type(future.exception()).__name__
+                    print(f'Failed {str(nb_path)} ({error})')
+                    state['notebooks'].pop(notebook_key(nb_path), None)
+                else:
+                    status[nb_path] = 'run'
+                    print(f'Done {str(nb_path)}')
+                    fingerprint = fingerprints[nb_path]
+                    if fingerprint is not None:
+                        # Inputs are hashed again as a notebook can write
+                        # to its own inputs (e.g. the crimes database)
+                        fingerprint = notebook_fingerprint(
+                            nb_path, hash_cache)
+                        fingerprint['outputs'] = output_hashes(
+                            nb_path, hash_cache)
+                        state['notebooks'][notebook_key(nb_path)] = (
+                            fingerprint)
+                save_state(state)
+    save_state(state)
+    return status
+
+
 if __name__ == '__main__':
     # Set path to root directory of notebooks
     notebooks_path = Path('notebooks')
+    parser = argparse.ArgumentParser(
+        description='Runs all Jupyter notebooks in the given folders.')
+    parser.add_argument(
+        'folders', nargs='*', help=f'Folders inside "./{notebooks_path}"')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Maximal number of notebooks which run at the same time')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Run all notebooks, even if their inputs and code are unchanged')
+    args = parser.parse_args()
     # Validate input and get folder names
-    folders = validate_input(sys.argv)
+    folders = validate_input(args.folders)
     # Get sorted list of all notebooks to run
     print('-' * 20)
-    print('The following notebooks will be executed in order:')
+    print('The following notebooks will be executed:')
     print('-' * 20)
-    notebooks = []
+    nb_paths = []
     for f in folders:
         nb_found = sorted([
             x for x in (notebooks_path / f).iterdir() if x.suffix == '.ipynb'
         ])
         print('\n'.join(str(x) for x in nb_found))
-        notebooks.append([f, nb_found])
+        nb_paths.extend(nb_found)
         print('-' * 20)
 
-    # Run notebooks
-    for nb_wd, nb_paths in notebooks:
-        for nb_p in nb_paths:
-            print(f'Run {str(nb_p)}')
-            run_notebook(notebooks_path / nb_wd, nb_p)
-        print('-' * 20)
+    # Run notebooks. The kernels inherit the environment variable
+    # and write the measurements of src functions to the same log.
+    os.environ.setdefault(LOG_ENV, str(LOG_PATH.resolve()))
+    start = time.time()
+    status = run_pipeline(nb_paths, workers=args.workers, force=args.force)
+    print('-' * 20)
+    print(format_summary(read_log(os.environ[LOG_ENV], since=start)))
+    print('-' * 20)
+    if any(s in ['failed', 'not run'] for s in status.values()):
+        sys.exit(1)
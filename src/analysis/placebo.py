@@ -0,0 +1,594 @@
+"""Contains a randomization inference for the treatment effects of the
+Poisson model (see poisson.py): the model is refitted many times with
+placebo treatments and the estimated coefficients are compared with the
+ones of the actual treatment.
+
+Two kinds of placebo treatments are supported:
+* 'permute': the clusters of contiguous treated blocks (i.e. the blocks
+  along the routes) are moved to random places among the blocks of the
+  panel. Each cluster keeps its size, its contiguity and the treatment
+  years of its blocks.
+* 'shift': the treatment of each block starts a number of school
+  years earlier (positive shift) or later (negative shift).
+The rings around the placebo treated blocks are recalculated on the
+adjacency matrix of all blocks (see calculate.contiguity).
+
+As in specifications.py, the columns of the panel are written once as
+.npy files and opened read-only as memory-mapped arrays by the worker
+processes. Each draw is an independent task with its own random seed,
+such that the draws do not depend on the number of processes. The
+coefficients of each draw are appended to a .csv file as soon as the
+draw is done. A run which was interrupted continues with the draws
+which are missing in this file."""
+import tempfile
+from collections import deque
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csgraph
+
+from ..calculate.contiguity import ring_distances, ring_name
+from .poisson import COVARIATES, fit_poisson_fe, group_codes, summary_df
+
+# Columns of the file with the coefficients of the draws
+PLACEBO_COLUMNS = [
+    'scheme', 'draw', 'count_col', 'var', 'coef', 'se', 'z', 'p', 'n',
+    'n_blocks', 'converged'
+]
+
+# Maximal number of random seeds tried to place a cluster of blocks
+MAX_TRIES = 100
+
+
+def placebo_grid(n_permutations=0, shifts=()):
+    """Lists the placebo draws
+
+    Parameters
+    ----------
+    n_permutations : int, optional (default=0)
+        Number of random relocations of the treated blocks
+
+    shifts : iterable of ints, optional (default=())
+        Number of school years by which the treatment is moved
+        earlier (positive) or later (negative)
+
+    Returns
+    -------
+    list of dict
+        One draw per element with the keys 'scheme' ('permute' or
+        'shift') and 'draw' (number of the permutation or shift)
+    """
+    draws = [{
+        'scheme': 'permute',
+        'draw': draw
+    } for draw in range(n_permutations)]
+    draws.extend({'scheme': 'shift', 'draw': int(shift)} for shift in shifts)
+    return draws
+
+
+def treatment_design(df, adjacency, ids, block_col='tract_bloc',
+                     sy_col='school_year', treated_col='treated'):
+    """Collects the actual treatment of each block and school year of
+    a panel and the clusters of contiguous treated blocks
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Panel, e.g. est_df
+
+    adjacency : scipy.sparse.csr_matrix
+        Adjacency matrix of all blocks, see calculate.contiguity
+
+    ids : np.ndarray
+        Sorted block identifiers corresponding to the rows of adjacency
+
+    block_col, sy_col, treated_col : str, optional
+        (default='tract_bloc', 'school_year' and 'treated')
+        Names of columns with the blocks, the school years and the
+        treatment dummy
+
+    Returns
+    -------
+    dict
+        'adjacency', 'positions' (position of each block of the panel in
+        adjacency), 'treated' (booleans, shape (n_blocks, n_years)),
+        'clusters' (positions in the panel of the blocks of each cluster
+        in breadth-first order), 'row_block' and 'row_year' (block and
+        school year of each row of df as positions)
+    """
+    blocks, row_block = np.unique(df[block_col].values, return_inverse=True)
+    school_years, row_year = np.unique(
+        np.asarray(df[sy_col].values, dtype='object'), return_inverse=True)
+    positions = np.searchsorted(ids, blocks)
+    assert (ids[np.minimum(positions, len(ids) - 1)] == blocks).all(), (
+        'Not all blocks are in the adjacency matrix')
+
+    treated = np.zeros((blocks.shape[0], school_years.shape[0]), dtype=bool)
+    is_treated = (df[treated_col] == 1).values
+    treated[row_block[is_treated], row_year[is_treated]] = True
+
+    # Contiguous blocks which are treated in any school year
+    ever_treated = np.flatnonzero(treated.any(axis=1))
+    subgraph = adjacency[positions[ever_treated]][:, positions[ever_treated]]
+    n_clusters, labels = csgraph.connected_components(
+        subgraph, directed=False)
+    clusters = []
+    for label in range(n_clusters):
+        first = np.flatnonzero(labels == label)[0]
+        order = csgraph.breadth_first_order(
+            subgraph, first, directed=False, return_predecessors=False)
+        clusters.append(ever_treated[order])
+    return {
+        'adjacency': adjacency,
+        'positions': positions,
+        'treated': treated,
+        'clusters': clusters,
+        'row_block': row_block.astype('int32'),
+        'row_year': row_year.astype('int16')
+    }
+
+
+def grow_cluster(adjacency, seed, size, available):
+    """Collects contiguous blocks with a breadth-first search
+
+    Parameters
+    ----------
+    adjacency : scipy.sparse.csr_matrix
+
+    seed : int
+        Position of the first block
+
+    size : int
+        Number of blocks of the cluster
+
+    available : np.ndarray of booleans
+        Blocks which can be part of the cluster
+
+    Returns
+    -------
+    list of ints
+        Positions of the blocks in breadth-first order. Shorter than
+        size if not enough blocks can be reached from seed.
+    """
+    cluster = [seed]
+    visited = {seed}
+    queue = deque([seed])
+    while queue and len(cluster) < size:
+        block = queue.popleft()
+        for neighbour in adjacency.indices[adjacency.indptr[block]:
+                                           adjacency.indptr[block + 1]]:
+            if neighbour in visited or not available[neighbour]:
+                continue
+            visited.add(neighbour)
+            cluster.append(neighbour)
+            queue.append(neighbour)
+            if len(cluster) == size:
+                break
+    return cluster
+
+
+def permute_treatment(design, rs):
+    """Moves each cluster of treated blocks to a random place
+
+    The clusters are placed one after another on blocks of the panel
+    which are not part of another placebo cluster. The i-th block of
+    the new cluster gets the treatment years of the i-th block of the
+    actual cluster (both in breadth-first order).
+
+    Parameters
+    ----------
+    design : dict
+        See treatment_design
+
+    rs : np.random.RandomState
+
+    Returns
+    -------
+    np.ndarray of booleans, shape (n_blocks, n_years)
+        Placebo treatment of the blocks of the panel
+
+    Raises
+    ------
+    ValueError
+        If a cluster can not be placed within MAX_TRIES random seeds
+    """
+    adjacency = design['adjacency']
+    positions = design['positions']
+    # Position in the panel of each block of adjacency
+    panel_block = np.full(adjacency.shape[0], -1)
+    panel_block[positions] = np.arange(positions.shape[0])
+    available = panel_block >= 0
+
+    placebo = np.zeros_like(design['treated'])
+    for i in rs.permutation(len(design['clusters'])):
+        cluster = design['clusters'][i]
+        for _ in range(MAX_TRIES):
+            seed = rs.choice(np.flatnonzero(available))
+            new_cluster = grow_cluster(adjacency, seed, len(cluster),
+                                       available)
+            if len(new_cluster) == len(cluster):
+                break
+        else:
+            raise ValueError('Could not place a cluster of {} blocks'.format(
+                len(cluster)))
+        available[new_cluster] = False
+        placebo[panel_block[new_cluster]] = design['treated'][cluster]
+    return placebo
+
+
+def shift_treatment(treated, shift):
+    """Moves the treatment of all blocks by a number of school years
+
+    Parameters
+    ----------
+    treated : np.ndarray of booleans, shape (n_blocks, n_years)
+        Actual treatment, school years in chronological order
+
+    shift : int
+        Number of school years by which the treatment starts earlier
+        (positive) or later (negative). The treatment status of the
+        last school year is carried forward.
+
+    Returns
+    -------
+    np.ndarray of booleans, shape (n_blocks, n_years)
+    """
+    n_years = treated.shape[1]
+    source = np.arange(n_years) + shift
+    placebo = treated[:, np.clip(source, 0, n_years - 1)]
+    placebo[:, source < 0] = False
+    return placebo
+
+
+def placebo_covariates(design, placebo, covariates):
+    """Treatment and ring dummies of each row of the panel
+
+    Parameters
+    ----------
+    design : dict
+        See treatment_design
+
+    placebo : np.ndarray of booleans, shape (n_blocks, n_years)
+
+    covariates : list of str
+        'treated' and ring dummies (see contiguity.ring_name)
+
+    Returns
+    -------
+    dict of np.ndarray of uint8
+        One dummy per covariate
+
+    Raises
+    ------
+    ValueError
+        If a covariate is neither 'treated' nor a ring dummy
+    """
+    # Distance to the placebo treated blocks of each covariate
+    ring_k = {ring_name(k): k for k in range(1, len(covariates) + 1)}
+    ring_k['treated'] = 0
+    unknown = [col for col in covariates if col not in ring_k]
+    if unknown:
+        raise ValueError('Unknown covariates: {}'.format(', '.join(unknown)))
+    max_k = max(ring_k[col] for col in covariates)
+    positions = design['positions']
+    distances = np.full(placebo.shape, -1, dtype='int8')
+    for year in range(placebo.shape[1]):
+        distances[:, year] = ring_distances(
+            design['adjacency'],
+            positions[placebo[:, year]],
+            max_k=max_k)[positions]
+    row_distances = distances[design['row_block'], design['row_year']]
+    return {
+        col: (row_distances == ring_k[col]).astype('uint8')
+        for col in covariates
+    }
+
+
+def write_columns(df, folder, count_cols, block_col='tract_bloc',
+                  time_col='time_fe'):
+    """Writes the columns needed by the placebo fits as .npy files
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Panel
+
+    folder : str or pathlib.Path
+
+    count_cols : list of str
+
+    block_col, time_col : str, optional (default='tract_bloc' and 'time_fe')
+
+    Returns
+    -------
+    Nothing
+    """
+    folder = Path(folder)
+    for col in list(count_cols) + [block_col, time_col]:
+        if col in (block_col, time_col):
+            values = group_codes(df[col].values).astype('int32')
+        else:
+            values = df[col].values
+        np.save(str(folder / '{}.npy'.format(col)), values)
+    return
+
+
+# Memory-mapped columns, treatment design and settings of the worker
+# processes of run_placebos
+worker_data = None
+
+
+def init_worker(folder, design, settings):
+    """Opens the columns written by write_columns in the worker process
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+
+    design : dict
+        See treatment_design
+
+    settings : dict
+        'count_cols', 'covariates', 'block_col', 'time_col' and 'seed'
+
+    Returns
+    -------
+    Nothing
+    """
+    global worker_data
+    worker_data = {
+        'columns': {
+            path.stem: np.load(str(path), mmap_mode='r')
+            for path in Path(folder).glob('*.npy')
+        },
+        'design': design,
+        'settings': settings
+    }
+    return
+
+
+def fit_placebo(draw):
+    """Fits the models of all count columns with one placebo treatment
+
+    Parameters
+    ----------
+    draw : dict
+        See placebo_grid
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns PLACEBO_COLUMNS with one row per count column and
+        covariate. The coefficients are missing if the model can not be
+        estimated.
+    """
+    columns = worker_data['columns']
+    design = worker_data['design']
+    settings = worker_data['settings']
+    if draw['scheme'] == 'permute':
+        rs = np.random.RandomState([settings['seed'], draw['draw']])
+        placebo = permute_treatment(design, rs)
+    elif draw['scheme'] == 'shift':
+        placebo = shift_treatment(design['treated'], draw['draw'])
+    else:
+        raise ValueError("Unknown scheme '{}'".format(draw['scheme']))
+
+    covariates = settings['covariates']
+    df = pd.DataFrame(placebo_covariates(design, placebo, covariates))
+    for col in [settings['block_col'], settings['time_col']]:
+        df[col] = columns[col]
+    summaries = []
+    for count_col in settings['count_cols']:
+        df[count_col] = columns[count_col]
+        try:
+            result = fit_poisson_fe(
+                df,
+                count_col,
+                covariates=covariates,
+                block_col=settings['block_col'],
+                time_col=settings['time_col'],
+                verbose=False)
+            summary = summary_df(result)
+            summary['n_blocks'] = result['n_blocks']
+            summary['converged'] = result['converged']
+        except np.linalg.LinAlgError:
+            summary = pd.DataFrame({'var': covariates})
+            summary['converged'] = False
+        summary['count_col'] = count_col
+        summaries.append(summary)
+    summaries = pd.concat(summaries, ignore_index=True)
+    summaries['scheme'] = draw['scheme']
+    summaries['draw'] = draw['draw']
+    return summaries.reindex(columns=PLACEBO_COLUMNS)
+
+
+def load_draws(results_path, rows_per_draw):
+    """Loads the completed draws of an earlier run
+
+    Rows of draws which were only partly written, e.g. because the
+    run was interrupted, are removed from the file.
+
+    Parameters
+    ----------
+    results_path : str or pathlib.Path
+        .csv file written by run_placebos
+
+    rows_per_draw : int
+        Number of count columns times number of covariates
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns PLACEBO_COLUMNS, empty if the file does not exist
+    """
+    results_path = Path(results_path)
+    if not results_path.is_file():
+        return pd.DataFrame(columns=PLACEBO_COLUMNS)
+    with results_path.open() as f:
+        content = f.read()
+    if not content.endswith('\n'):
+        # Cut the last line, which was not completely written
+        with results_path.open('w') as f:
+            f.write(content[:content.rfind('\n') + 1])
+    if content.count('\n') < 2:
+        return pd.DataFrame(columns=PLACEBO_COLUMNS)
+    draws = pd.read_csv(str(results_path))
+    size = draws.groupby(['scheme', 'draw'])['var'].transform('size')
+    complete = (size == rows_per_draw).values
+    if not complete.all():
+        draws = draws[complete]
+        draws.to_csv(str(results_path), index=False)
+    return draws.reset_index(drop=True)
+
+
+def run_placebos(df,
+                 adjacency,
+                 ids,
+                 draws,
+                 results_path,
+                 n_jobs=1,
+                 count_cols=('violent_count', 'property_count'),
+                 covariates=COVARIATES,
+                 seed=0,
+                 block_col='tract_bloc',
+                 time_col='time_fe',
+                 tmp_dir=None,
+                 verbose=True):
+    """Fits the Poisson models with many placebo treatments in parallel
+
+    The draws run independently of each other in the worker processes,
+    i.e. the run time decreases about linearly with the number of
+    processes as long as the memory-mapped panel fits into memory.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Panel with the columns count_cols, block_col, time_col,
+        'school_year' and 'treated', e.g. est_df
+
+    adjacency : scipy.sparse.csr_matrix
+        Adjacency matrix of all blocks, see contiguity.load_adjacency
+
+    ids : np.ndarray
+        Sorted block identifiers corresponding to the rows of adjacency,
+        e.g. BlockIndex.ids
+
+    draws : list of dict
+        See placebo_grid
+
+    results_path : str or pathlib.Path
+        .csv file to which the coefficients of each draw are appended.
+        Draws which are already in this file are not fitted again.
+
+    n_jobs : int, optional (default=1)
+        Number of processes
+
+    count_cols : iterable of str, optional
+        (default=('violent_count', 'property_count'))
+        Names of columns with the dependent variables
+
+    covariates : list of str, optional
+        (default=['treated', 'one_over', 'two_over'])
+        Treatment and ring dummies of the model
+
+    seed : int, optional (default=0)
+        Seed of the permutations. Permutation i of a seed is always
+        the same.
+
+    block_col, time_col : str, optional (default='tract_bloc' and 'time_fe')
+        Names of columns with the block and time fixed effects
+
+    tmp_dir : str or pathlib.Path, optional (default=None)
+        Folder for the memory-mapped columns, defaults to the
+        temporary folder of the system
+
+    verbose : boolean, optional (default=True)
+        If True, prints the progress
+
+    Returns
+    -------
+    pd.DataFrame
+        All draws in results_path, see fit_placebo
+    """
+    global worker_data
+    count_cols = list(count_cols)
+    rows_per_draw = len(count_cols) * len(covariates)
+    done = load_draws(results_path, rows_per_draw)
+    done = set(zip(done['scheme'], done['draw']))
+    missing = [d for d in draws if (d['scheme'], d['draw']) not in done]
+    if verbose:
+        print('{:,} of {:,} draws already done'.format(
+            len(draws) - len(missing), len(draws)))
+
+    design = treatment_design(df, adjacency, ids, block_col=block_col)
+    settings = {
+        'count_cols': count_cols,
+        'covariates': list(covariates),
+        'block_col': block_col,
+        'time_col': time_col,
+        'seed': seed
+    }
+    results_path = Path(results_path)
+    write_header = (not results_path.is_file() or
+                    results_path.stat().st_size == 0)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as folder, \
+            results_path.open('a') as f:
+        write_columns(df, folder, count_cols, block_col=block_col,
+                      time_col=time_col)
+        initargs = (folder, design, settings)
+        if n_jobs == 1:
+            init_worker(*initargs)
+            summaries = map(fit_placebo, missing)
+        else:
+            pool = Pool(n_jobs, initializer=init_worker, initargs=initargs)
+            summaries = pool.imap_unordered(fit_placebo, missing)
+        try:
+            for i, summary in enumerate(summaries):
+                summary.to_csv(f, header=write_header, index=False)
+                f.flush()
+                write_header = False
+                if verbose:
+                    print('Completed {:,} of {:,} draws'.format(
+                        i + 1, len(missing)), end='\r', flush=True)
+        finally:
+            if n_jobs == 1:
+                # Close the memory-mapped files before the folder is removed
+                worker_data = None
+            else:
+                pool.terminate()
+                pool.join()
+    if verbose:
+        print()
+    return pd.read_csv(str(results_path))
+
+
+def randomization_p_value(draws, actual, count_col, var='treated',
+                          scheme='permute'):
+    """Share of placebo coefficients which are at least as large in
+    absolute value as the actual one
+
+    Parameters
+    ----------
+    draws : pd.DataFrame
+        See run_placebos
+
+    actual : float
+        Coefficient of the actual treatment
+
+    count_col : str
+
+    var : str, optional (default='treated')
+
+    scheme : str, optional (default='permute')
+
+    Returns
+    -------
+    float
+        Two-sided p-value, the actual treatment counts as one draw
+    """
+    coefs = draws.loc[(draws['scheme'] == scheme) &
+                      (draws['count_col'] == count_col) &
+                      (draws['var'] == var), 'coef'].dropna().values
+    return (np.sum(np.abs(coefs) >= abs(actual)) + 1) / (coefs.shape[0] + 1)
@@ -0,0 +1,247 @@
+"""Contains a Poisson regression with block and time fixed effects.
+
+The fixed effects are not estimated as dummy variables. Instead, they are
+absorbed in each iteration of iteratively reweighted least squares (IRLS):
+the working dependent variable and the covariates are demeaned within
+blocks and within time periods (weighted alternating projections), and
+only the coefficients of the covariates are estimated on the demeaned
+data. This gives the same coefficients and standard errors as the model
+with dummy variables, e.g. glmmboot of the R package glmmML with blocks
+as clusters and factor(time_fe) as covariates, but only needs a few
+arrays of the length of the dataset."""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Covariates of the main specification
+COVARIATES = ['treated', 'one_over', 'two_over']
+
+
+def drop_constant_blocks(df, count_col, block_col='tract_bloc'):
+    """Drops all blocks with a constant count
+
+    Their level would be taken out by the block fixed effects anyway
+    and they do not contribute to the likelihood. Blocks with a single
+    observation are dropped as well.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    count_col : str
+        Name of column with the counts
+
+    block_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    Returns
+    -------
+    pd.DataFrame
+        Observations of all blocks with a non-constant count
+    """
+    counts = df.groupby(block_col)[count_col]
+    non_constant = (counts.transform('min') < counts.transform('max')).values
+    return df[non_constant]
+
+
+def group_codes(values):
+    """Converts values to consecutive integer codes
+
+    Parameters
+    ----------
+    values : array-like
+
+    Returns
+    -------
+    np.ndarray of ints
+    """
+    return pd.factorize(values, sort=True)[0]
+
+
+def demean(values, groups, weights, tol=1e-10, max_iter=1000):
+    """Subtracts weighted group means of multiple groupings
+    (method of alternating projections)
+
+    Parameters
+    ----------
+    values : np.ndarray of floats, shape (n, k)
+
+    groups : list of np.ndarray of ints
+        Codes of each grouping, e.g. of the blocks and of the months
+
+    weights : np.ndarray of floats, shape (n, )
+
+    tol : float, optional (default=1e-10)
+        The projections are repeated until no value changes by more than
+        tol times the largest absolute value of its column
+
+    max_iter : int, optional (default=1000)
+        Maximal number of iterations
+
+    Returns
+    -------
+    np.ndarray of floats, shape (n, k)
+        Residuals of a weighted regression of values on the dummies of
+        all groupings
+    """
+    values = np.array(values, dtype='float64')
+    group_weights = [np.bincount(g, weights=weights) for g in groups]
+    scale = np.maximum(np.abs(values).max(axis=0), 1)
+    for _ in range(max_iter):
+        max_change = 0
+        for g, gw in zip(groups, group_weights):
+            for j in range(values.shape[1]):
+                means = np.bincount(
+                    g, weights=weights * values[:, j]) / gw
+                values[:, j] -= means[g]
+                max_change = max(max_change,
+                                 np.abs(means).max() / scale[j])
+        # Only one grouping needs one projection
+        if max_change < tol or len(groups) == 1:
+            break
+    return values
+
+
+def poisson_deviance(y, mu):
+    """Deviance of a Poisson model
+
+    Parameters
+    ----------
+    y, mu : np.ndarray of floats
+        Observed counts and expected counts
+
+    Returns
+    -------
+    float
+    """
+    positive = y > 0
+    return 2 * (np.sum(y[positive] * np.log(y[positive] / mu[positive])) -
+                np.sum(y - mu))
+
+
+def fit_poisson_fe(df,
+                   count_col,
+                   covariates=COVARIATES,
+                   block_col='tract_bloc',
+                   time_col='time_fe',
+                   drop_constant=True,
+                   tol=1e-8,
+                   max_iter=100,
+                   verbose=True):
+    """Fits Poisson regression with block and time fixed effects
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Contains count_col, covariates, block_col and time_col
+
+    count_col : str
+        Name of column with the dependent variable, e.g. 'violent_count'
+
+    covariates : list of str, optional
+        (default=['treated', 'one_over', 'two_over'])
+        Names of columns with the covariates
+
+    block_col : str, optional (default='tract_bloc')
+        Name of column with the block fixed effects
+
+    time_col : str, optional (default='time_fe')
+        Name of column with the time fixed effects. If None, only block
+        fixed effects are used.
+
+    drop_constant : boolean, optional (default=True)
+        If True, drops blocks with a constant count first
+        (see drop_constant_blocks)
+
+    tol : float, optional (default=1e-8)
+        Convergence criterion on the relative change of the deviance
+
+    max_iter : int, optional (default=100)
+        Maximal number of IRLS iterations
+
+    verbose : boolean, optional (default=True)
+        If True, prints the deviance of each iteration
+
+    Returns
+    -------
+    dict
+        'coef' (pd.Series), 'cov' (covariance matrix as pd.DataFrame),
+        'n' (number of observations used), 'n_blocks', 'deviance',
+        'iterations' and 'converged'
+    """
+    if verbose:
+        print('Fit model with {}'.format(count_col))
+    if drop_constant:
+        df = drop_constant_blocks(df, count_col, block_col=block_col)
+    groups = [group_codes(df[block_col].values)]
+    if time_col is not None:
+        time_codes = group_codes(df[time_col].values)
+        # Expected counts of periods without any count would go to zero
+        # (their fixed effect to minus infinity), drop them
+        has_counts = np.bincount(
+            time_codes, weights=df[count_col].values)[time_codes] > 0
+        df = df[has_counts]
+        groups = [group_codes(df[block_col].values),
+                  group_codes(df[time_col].values)]
+
+    y = df[count_col].values.astype('float64')
+    X = df[covariates].values.astype('float64')
+    mu = (y + y.mean()) / 2
+    eta = np.log(mu)
+    deviance = np.inf
+    converged = False
+    for iteration in range(1, max_iter + 1):
+        # Working dependent variable and weights of IRLS
+        z = eta + (y - mu) / mu
+        demeaned = demean(np.column_stack([z, X]), groups, weights=mu)
+        z_tilde, X_tilde = demeaned[:, 0], demeaned[:, 1:]
+        XtWX = X_tilde.T.dot(X_tilde * mu[:, None])
+        coef = np.linalg.solve(XtWX, X_tilde.T.dot(z_tilde * mu))
+        # Linear predictor including the fixed effects
+        eta = z - (z_tilde - X_tilde.dot(coef))
+        mu = np.exp(eta)
+        deviance_old, deviance = deviance, poisson_deviance(y, mu)
+        if verbose:
+            print('Iteration {}: deviance {:.6f}'.format(iteration, deviance))
+        if abs(deviance - deviance_old) / max(deviance, 0.1) < tol:
+            converged = True
+            break
+
+    # Inverse of the Hessian at the final weights
+    X_tilde = demean(X, groups, weights=mu)
+    cov = np.linalg.inv(X_tilde.T.dot(X_tilde * mu[:, None]))
+    return {
+        'coef': pd.Series(coef, index=covariates),
+        'cov': pd.DataFrame(cov, index=covariates, columns=covariates),
+        'n': len(y),
+        'n_blocks': int(groups[0].max()) + 1,
+        'deviance': deviance,
+        'iterations': iteration,
+        'converged': converged
+    }
+
+
+def summary_df(result):
+    """Summarizes the estimated coefficients
+
+    Parameters
+    ----------
+    result : dict
+        See fit_poisson_fe
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'var', 'coef', 'se', 'z', 'p' (two-sided) and 'n'
+    """
+    coef = result['coef']
+    se = np.sqrt(np.diag(result['cov'].values))
+    z = coef.values / se
+    return pd.DataFrame({
+        'var': coef.index,
+        'coef': coef.values,
+        'se': se,
+        'z': z,
+        'p': stats.chi2.sf(z**2, 1),
+        'n': result['n']
+    }, columns=['var', 'coef', 'se', 'z', 'p', 'n'])
@@ -0,0 +1,249 @@
+"""Contains functions to estimate many specifications of the Poisson
+model (see poisson.py) in parallel, e.g. with different rings of blocks
+around the routes, time windows and crime categories.
+
+The columns of the estimation dataset which are needed by any of the
+specifications are written once as .npy files and opened read-only as
+memory-mapped arrays by each worker process. Therefore, the dataset is
+neither copied into nor pickled for each worker, and the operating
+system shares its pages between all workers."""
+import itertools
+import tempfile
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .poisson import fit_poisson_fe, group_codes, summary_df
+
+# Rings of blocks around the routes, from the treated blocks only
+# to all blocks up to three blocks over
+RING_COVARIATES = [
+    ['treated'],
+    ['treated', 'one_over'],
+    ['treated', 'one_over', 'two_over'],
+    ['treated', 'one_over', 'two_over', 'three_over'],
+]
+
+# Columns of the results table in addition to the ones of summary_df
+SPEC_COLUMNS = ['spec', 'count_col', 'covariates', 'start', 'end']
+
+
+def specification_grid(count_cols=('violent_count', 'property_count'),
+                       covariate_sets=RING_COVARIATES,
+                       periods=((None, None), )):
+    """Creates all combinations of crime categories, covariates and
+    time windows
+
+    Parameters
+    ----------
+    count_cols : iterable of str, optional
+        (default=('violent_count', 'property_count'))
+        Names of columns with the dependent variable
+
+    covariate_sets : iterable of lists of str, optional
+        (default=RING_COVARIATES)
+
+    periods : iterable of tuples of str, format = "YYYY-MM-DD", optional
+        (default=((None, None), ))
+        Start and end date (both inclusive) of the time windows,
+        None means no restriction
+
+    Returns
+    -------
+    list of dict
+        One specification per combination with the keys 'spec' (name),
+        'count_col', 'covariates', 'start' and 'end'
+    """
+    specs = []
+    for count_col, covariates, (start, end) in itertools.product(
+            count_cols, covariate_sets, periods):
+        specs.append({
+            'spec': '{}|{}|{}|{}'.format(count_col, '+'.join(covariates),
+                                         start or '', end or ''),
+            'count_col': count_col,
+            'covariates': list(covariates),
+            'start': start,
+            'end': end
+        })
+    return specs
+
+
+def write_columns(df, specs, folder, block_col='tract_bloc',
+                  time_col='time_fe', date_col='Date'):
+    """Writes all columns needed by the specifications as .npy files
+
+    Blocks and time periods are stored as integer codes.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Estimation dataset
+
+    specs : list of dict
+        See specification_grid
+
+    folder : str or pathlib.Path
+
+    block_col, time_col, date_col : str, optional
+        (default='tract_bloc', 'time_fe' and 'Date')
+        Names of columns with the blocks, the time fixed effects and the
+        dates used for the time windows
+
+    Returns
+    -------
+    Nothing
+    """
+    folder = Path(folder)
+    columns = {block_col, time_col, date_col}
+    for spec in specs:
+        columns.add(spec['count_col'])
+        columns.update(spec['covariates'])
+    for col in columns:
+        if col in (block_col, time_col):
+            values = group_codes(df[col].values).astype('int32')
+        else:
+            values = df[col].values
+        np.save(str(folder / '{}.npy'.format(col)), values)
+    return
+
+
+# Memory-mapped columns and column names of the worker processes
+# of run_specifications
+worker_data = None
+
+
+def init_worker(folder, block_col, time_col, date_col):
+    """Opens the columns written by write_columns in the worker process
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+
+    block_col, time_col, date_col : str
+        See write_columns
+
+    Returns
+    -------
+    Nothing
+    """
+    global worker_data
+    worker_data = {
+        'columns': {
+            path.stem: np.load(str(path), mmap_mode='r')
+            for path in Path(folder).glob('*.npy')
+        },
+        'block_col': block_col,
+        'time_col': time_col,
+        'date_col': date_col
+    }
+    return
+
+
+def fit_worker(spec):
+    """Fits a single specification on the columns of the worker process
+
+    Parameters
+    ----------
+    spec : dict
+        See specification_grid
+
+    Returns
+    -------
+    pd.DataFrame
+        See run_specifications. The coefficients are missing if the
+        specification can not be estimated, e.g. because a covariate
+        is zero during the whole time window.
+    """
+    columns = worker_data['columns']
+    block_col = worker_data['block_col']
+    time_col = worker_data['time_col']
+    dates = columns[worker_data['date_col']]
+    in_period = np.ones(dates.shape[0], dtype=bool)
+    if spec['start'] is not None:
+        in_period &= dates >= np.datetime64(spec['start'])
+    if spec['end'] is not None:
+        in_period &= dates <= np.datetime64(spec['end'])
+
+    needed = [spec['count_col'], block_col, time_col] + spec['covariates']
+    df = pd.DataFrame({col: columns[col][in_period] for col in needed})
+    try:
+        result = fit_poisson_fe(
+            df,
+            spec['count_col'],
+            covariates=spec['covariates'],
+            block_col=block_col,
+            time_col=time_col,
+            verbose=False)
+        summary = summary_df(result)
+        summary['n_blocks'] = result['n_blocks']
+        summary['converged'] = result['converged']
+    except np.linalg.LinAlgError:
+        summary = pd.DataFrame({'var': spec['covariates']})
+        summary['converged'] = False
+    for key in SPEC_COLUMNS:
+        summary[key] = ('+'.join(spec[key])
+                        if key == 'covariates' else spec[key])
+    return summary
+
+
+def run_specifications(df,
+                       specs,
+                       n_jobs=1,
+                       results_path=None,
+                       block_col='tract_bloc',
+                       time_col='time_fe',
+                       date_col='Date',
+                       tmp_dir=None):
+    """Fits Poisson models of many specifications in parallel
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Estimation dataset, e.g. est_df
+
+    specs : list of dict
+        See specification_grid
+
+    n_jobs : int, optional (default=1)
+        Number of processes
+
+    results_path : str or pathlib.Path, optional (default=None)
+        If given, the results are written to this .csv file
+
+    block_col, time_col, date_col : str, optional
+        (default='tract_bloc', 'time_fe' and 'Date')
+        See write_columns
+
+    tmp_dir : str or pathlib.Path, optional (default=None)
+        Folder for the memory-mapped columns, defaults to the
+        temporary folder of the system
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per specification and covariate with the columns
+        SPEC_COLUMNS, the columns of summary_df, 'n_blocks' and 'converged'
+    """
+    global worker_data
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as folder:
+        write_columns(df, specs, folder, block_col=block_col,
+                      time_col=time_col, date_col=date_col)
+        initargs = (folder, block_col, time_col, date_col)
+        if n_jobs == 1:
+            init_worker(*initargs)
+            summaries = [fit_worker(spec) for spec in specs]
+            # Close the memory-mapped files before the folder is removed
+            worker_data = None
+        else:
+            with Pool(n_jobs, initializer=init_worker,
+                      initargs=initargs) as pool:
+                summaries = pool.map(fit_worker, specs, chunksize=1)
+    results = pd.concat(summaries, ignore_index=True)
+    results = results.reindex(columns=SPEC_COLUMNS + [
+        'var', 'coef', 'se', 'z', 'p', 'n', 'n_blocks', 'converged'
+    ])
+    if results_path is not None:
+        results.to_csv(str(results_path), index=False)
+    return results
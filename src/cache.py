@@ -0,0 +1,494 @@
+"""Contains a cache for the results of expensive stages of the pipeline,
+e.g. spatial joins.
+
+A stage is a function which is decorated with ArtifactCache.stage. Its
+results are stored under a key which is a hash of the source code of the
+function and of all arguments. If the function is called again with the
+same arguments (and unchanged code), the stored result is loaded instead
+of computed.
+
+Dataframes are stored as Parquet files (GeoParquet for GeoDataFrames)
+if pyarrow is installed and the version of geopandas supports it, all
+other results as compressed pickles. Each entry is a folder containing
+the result and a file 'meta.json' which records the stage, the arguments
+and when the entry was created and last used. If the cache grows beyond
+the given number of entries or size, the least recently used entries
+are deleted."""
+import gzip
+import hashlib
+import inspect
+import json
+import pickle
+import shutil
+import time
+import uuid
+from functools import wraps
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Name of the file with the metadata of a cache entry
+META_FILE = 'meta.json'
+
+
+def is_geometry_column(series):
+    """Checks if a column contains shapely geometries
+
+    Parameters
+    ----------
+    series : pd.Series
+
+    Returns
+    -------
+    boolean
+    """
+    if series.dtype != 'object' and series.dtype.name != 'geometry':
+        return False
+    first = series.dropna()[:1]
+    return len(first) == 1 and hasattr(first.iloc[0], 'wkb')
+
+
+def update_hash(h, obj):
+    """Adds an object to a hash
+
+    Dataframes, series and arrays are hashed by their values (plus index,
+    column names and dtypes), geometries by their WKB representation.
+    Containers are hashed recursively, all other objects by their pickled
+    representation.
+
+    Parameters
+    ----------
+    h : hashlib hash object
+        Is updated in place
+
+    obj : object
+
+    Returns
+    -------
+    Nothing
+    """
+    h.update(type(obj).__name__.encode())
+    if isinstance(obj, pd.DataFrame):
+        update_hash(h, list(obj.columns))
+        update_hash(h, [str(dtype) for dtype in obj.dtypes])
+        update_hash(h, obj.index)
+        for col in obj.columns:
+            update_hash(h, obj[col].reset_index(drop=True))
+    elif isinstance(obj, (pd.Series, pd.Index)):
+        if isinstance(obj, pd.Series) and is_geometry_column(obj):
+            for geometry in obj:
+                h.update(b'' if geometry is None else geometry.wkb)
+            return
+        try:
+            hashes = pd.util.hash_pandas_object(obj)
+            h.update(np.ascontiguousarray(hashes.values).tobytes())
+        except TypeError:
+            # Unhashable values, e.g. lists of route numbers
+            update_hash(h, obj.tolist())
+    elif isinstance(obj, np.ndarray) and obj.dtype != 'object':
+        h.update(str(obj.dtype).encode() + str(obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            update_hash(h, item)
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            update_hash(h, key)
+            update_hash(h, obj[key])
+    elif hasattr(obj, 'wkb'):
+        h.update(obj.wkb)
+    else:
+        h.update(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    return
+
+
+def write_result(result, folder, compression='snappy'):
+    """Writes the result of a stage into a folder
+
+    Parameters
+    ----------
+    result : object
+
+    folder : pathlib.Path
+        Existing, empty folder
+
+    compression : str, optional (default='snappy')
+        Compression of Parquet files
+
+    Returns
+    -------
+    str
+        Format of the stored result, 'parquet', 'geoparquet' or 'pickle'
+    """
+    if isinstance(result, pd.DataFrame):
+        is_geo = hasattr(result, 'geometry') and hasattr(
+            type(result), 'to_parquet') and 'geometry' in result.columns
+        try:
+            if is_geo:
+                result.to_parquet(
+                    str(folder / 'result.parquet'), compression=compression)
+                return 'geoparquet'
+            elif not any(
+                    is_geometry_column(result[col]) for col in result.columns):
+                result.to_parquet(
+                    str(folder / 'result.parquet'),
+                    engine='pyarrow',
+                    compression=compression)
+                return 'parquet'
+        except (ImportError, ValueError, TypeError, NotImplementedError):
+            # No pyarrow or columns which cannot be stored in Parquet,
+            # e.g. mixed types (errors of pyarrow subclass these)
+            parquet_file = folder / 'result.parquet'
+            if parquet_file.exists():
+                parquet_file.unlink()
+
+    with gzip.open(str(folder / 'result.pkl.gz'), 'wb', compresslevel=3) as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return 'pickle'
+
+
+def read_result(folder, result_format):
+    """Reads the result of a stage which was written with write_result
+
+    Parameters
+    ----------
+    folder : pathlib.Path
+
+    result_format : str
+        See write_result
+
+    Returns
+    -------
+    object
+    """
+    if result_format == 'geoparquet':
+        import geopandas as gpd
+        return gpd.read_parquet(str(folder / 'result.parquet'))
+    elif result_format == 'parquet':
+        return pd.read_parquet(
+            str(folder / 'result.parquet'), engine='pyarrow')
+    with gzip.open(str(folder / 'result.pkl.gz'), 'rb') as f:
+        return pickle.load(f)
+
+
+def folder_size(folder):
+    """Size of all files in a folder in bytes
+
+    Parameters
+    ----------
+    folder : pathlib.Path
+
+    Returns
+    -------
+    int
+    """
+    return sum(f.stat().st_size for f in folder.rglob('*') if f.is_file())
+
+
+def describe(value, max_length=200):
+    """Short description of an argument for the metadata of an entry
+
+    Parameters
+    ----------
+    value : object
+
+    max_length : int, optional (default=200)
+        Maximal length of the description
+
+    Returns
+    -------
+    str
+    """
+    if isinstance(value, pd.DataFrame):
+        return '{} with shape {}'.format(type(value).__name__, value.shape)
+    description = repr(value)
+    if len(description) > max_length:
+        description = description[:max_length - 3] + '...'
+    return description
+
+
+class ArtifactCache:
+    """Cache for the results of stages of the pipeline
+
+    Parameters
+    ----------
+    cache_dir : str or pathlib.Path, optional (default='data/cache')
+        Folder in which the results are stored. Is created if it
+        does not exist.
+
+    max_size_mb : float, optional (default=None)
+        Maximal size of all entries in megabytes. If None, the size
+        is not limited.
+
+    max_entries : int, optional (default=None)
+        Maximal number of entries. If None, the number is not limited.
+
+    verbose : boolean, optional (default=True)
+        If True, prints whether a result is loaded or computed
+
+    Example
+    -------
+    >>> cache = ArtifactCache('../../data/cache', max_size_mb=2000)
+    >>> @cache.stage
+    ... def join_blocks_routes(blocks, routes):
+    ...     ...
+    """
+
+    def __init__(self,
+                 cache_dir='data/cache',
+                 max_size_mb=None,
+                 max_entries=None,
+                 verbose=True):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size_mb = max_size_mb
+        self.max_entries = max_entries
+        self.verbose = verbose
+
+    def entry_path(self, name, key):
+        """Folder of an entry
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+
+        key : str
+            See make_key
+
+        Returns
+        -------
+        pathlib.Path
+        """
+        return self.cache_dir / '{}-{}'.format(name, key)
+
+    def make_key(self, func, arguments):
+        """Calculates the key of a call of a stage
+
+        Parameters
+        ----------
+        func : function
+            Stage function. Only the source code of the function itself
+            is hashed, not the one of the functions it calls.
+
+        arguments : dict
+            Names and values of all arguments, including defaults
+
+        Returns
+        -------
+        str
+            Hex digest
+        """
+        h = hashlib.sha1()
+        h.update(func.__qualname__.encode())
+        try:
+            h.update(inspect.getsource(func).encode())
+        except (OSError, TypeError):
+            # Source is not available, e.g. for builtins
+            pass
+        update_hash(h, arguments)
+        return h.hexdigest()
+
+    def entries(self):
+        """Metadata of all entries
+
+        Returns
+        -------
+        list of dict
+            Metadata of each entry (see put) with the additional key
+            'path'
+        """
+        entries = []
+        for meta_path in self.cache_dir.glob('*/' + META_FILE):
+            with meta_path.open() as f:
+                meta = json.load(f)
+            meta['path'] = meta_path.parent
+            entries.append(meta)
+        return entries
+
+    def get(self, name, key):
+        """Loads a result from the cache
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+
+        key : str
+            See make_key
+
+        Returns
+        -------
+        tuple of boolean and object
+            True and the result if the entry exists, else False and None
+        """
+        folder = self.entry_path(name, key)
+        meta_path = folder / META_FILE
+        if not meta_path.is_file():
+            return False, None
+        with meta_path.open() as f:
+            meta = json.load(f)
+        result = read_result(folder, meta['format'])
+        meta['last_used'] = time.time()
+        with meta_path.open('w') as f:
+            json.dump(meta, f, indent=1)
+        return True, result
+
+    def put(self, name, key, result, arguments=None):
+        """Stores a result in the cache and evicts old entries
+        if necessary
+
+        The result is written into a temporary folder first, which is
+        renamed at the end, such that aborted writes leave no entry.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+
+        key : str
+            See make_key
+
+        result : object
+
+        arguments : dict, optional (default=None)
+            Arguments which produced the result. A short description of
+            them is stored in the metadata.
+
+        Returns
+        -------
+        str
+            Format of the stored result, see write_result
+        """
+        folder = self.entry_path(name, key)
+        tmp_folder = self.cache_dir / 'tmp-{}'.format(uuid.uuid4().hex)
+        tmp_folder.mkdir()
+        try:
+            result_format = write_result(result, tmp_folder)
+            now = time.time()
+            meta = {
+                'stage': name,
+                'key': key,
+                'format': result_format,
+                'arguments': {
+                    arg: describe(value)
+                    for arg, value in (arguments or {}).items()
+                },
+                'size': folder_size(tmp_folder),
+                'created': now,
+                'last_used': now
+            }
+            with (tmp_folder / META_FILE).open('w') as f:
+                json.dump(meta, f, indent=1)
+            if folder.exists():
+                shutil.rmtree(str(folder))
+            tmp_folder.rename(folder)
+        finally:
+            if tmp_folder.exists():
+                shutil.rmtree(str(tmp_folder))
+        self.evict(keep=folder)
+        return result_format
+
+    def evict(self, keep=None):
+        """Deletes the least recently used entries until the cache is
+        within its limits
+
+        Parameters
+        ----------
+        keep : pathlib.Path, optional (default=None)
+            Folder of an entry which is never deleted, e.g. the one
+            which was just stored
+
+        Returns
+        -------
+        int
+            Number of deleted entries
+        """
+        entries = sorted(self.entries(), key=lambda e: e['last_used'])
+        total_size = sum(e['size'] for e in entries)
+        max_size = (np.inf if self.max_size_mb is None else
+                    self.max_size_mb * 1024**2)
+        max_entries = (np.inf
+                       if self.max_entries is None else self.max_entries)
+        n_deleted = 0
+        for entry in entries:
+            if total_size <= max_size and len(entries) - n_deleted <= (
+                    max_entries):
+                break
+            if entry['path'] == keep:
+                continue
+            shutil.rmtree(str(entry['path']))
+            total_size -= entry['size']
+            n_deleted += 1
+        return n_deleted
+
+    def clear(self):
+        """Deletes all entries
+
+        Returns
+        -------
+        Nothing
+        """
+        for entry in self.entries():
+            shutil.rmtree(str(entry['path']))
+        return
+
+    def stage(self, func=None, name=None, ignore=None):
+        """Decorator which caches the results of a stage function
+
+        Can be used as @cache.stage or with arguments, e.g.
+        @cache.stage(ignore=['block_index']).
+
+        Parameters
+        ----------
+        func : function, optional (default=None)
+            Function to decorate
+
+        name : str, optional (default=None)
+            Name of the stage, defaults to the name of the function
+
+        ignore : list of str, optional (default=None)
+            Arguments which are not part of the key, e.g. because they
+            are derived from other arguments or are expensive to hash
+
+        Returns
+        -------
+        function
+            Decorated function which returns the stored result if the
+            function was called with the same arguments before
+        """
+        if func is None:
+            return lambda f: self.stage(f, name=name, ignore=ignore)
+        stage_name = func.__name__ if name is None else name
+        ignore = set(ignore or [])
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                arg: value
+                for arg, value in bound.arguments.items() if arg not in ignore
+            }
+            key = self.make_key(func, arguments)
+            found, result = self.get(stage_name, key)
+            if found:
+                if self.verbose:
+                    print('Loaded {} from cache'.format(stage_name))
+                return result
+            result = func(*args, **kwargs)
+            result_format = self.put(
+                stage_name, key, result, arguments=arguments)
+            if self.verbose:
+                print('Stored {} in cache'.format(stage_name))
+            if result_format != 'pickle':
+                # Parquet files do not keep all details of a dataframe
+                # (e.g. missing strings are read as None). Return what
+                # is stored, such that a hit returns the same as a miss.
+                _, result = self.get(stage_name, key)
+            return result
+
+        return wrapper
+
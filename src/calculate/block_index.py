@@ -0,0 +1,258 @@
+"""Contains a spatial index of the census blocks which is built once and
+reused for all spatial joins with the blocks (crimes, schools, routes and
+contiguous blocks).
+
+The index can be stored on disk together with a hash of the block
+geometries. It is only rebuilt if the geometries change."""
+import hashlib
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from shapely.prepared import prep
+
+from ..instrument import instrument
+from .point_in_polygon import PolygonIndex, assign_blocks
+
+
+def unique_blocks(blocks, id_col='tract_bloc'):
+    """Keeps the first row of each block, sorted by identifier
+
+    Parameters
+    ----------
+    blocks : gpd.GeoDataFrame
+        Blocks with columns id_col and 'geometry'
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        Columns id_col and 'geometry' with one row per block
+    """
+    blocks = blocks.drop_duplicates(subset=[id_col])[[id_col, 'geometry']]
+    return blocks.sort_values(id_col).reset_index(drop=True)
+
+
+def geometry_key(ids, geometries):
+    """Calculates a hash of block identifiers and geometries
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        Identifiers of the blocks
+
+    geometries : iterable of shapely geometries
+
+    Returns
+    -------
+    str
+        Hex digest which changes if any identifier or geometry changes
+    """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(ids).tobytes())
+    for geometry in geometries:
+        h.update(geometry.wkb)
+    return h.hexdigest()
+
+
+class BlockIndex:
+    """Spatial index of census blocks
+
+    Parameters
+    ----------
+    blocks : gpd.GeoDataFrame
+        Blocks with columns id_col and 'geometry'. Can contain multiple
+        rows per block (e.g. one per school year), only the first one
+        is used (see unique_blocks).
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        Sorted identifiers of the indexed blocks. The block positions
+        returned by the query methods refer to this array.
+
+    key : str
+        Hash of the identifiers and geometries (see geometry_key)
+    """
+
+    def __init__(self, blocks, id_col='tract_bloc'):
+        self.id_col = id_col
+        self.blocks = unique_blocks(blocks, id_col=id_col)
+        self.ids = self.blocks[id_col].values
+        self.key = geometry_key(self.ids, self.blocks['geometry'])
+        self.polygon_index = PolygonIndex(self.blocks['geometry'])
+
+    @instrument
+    def query_points(self, x, y, batch_size=100000, n_jobs=1, verbose=True):
+        """Finds the block which contains each point
+
+        Parameters
+        ----------
+        x, y : array-like of floats
+            Longitudes and latitudes of the points
+
+        batch_size, n_jobs, verbose
+            See point_in_polygon.assign_blocks
+
+        Returns
+        -------
+        pd.Series
+            Identifier of the block of each point, NaN if a point lies
+            in no block
+        """
+        return assign_blocks(
+            x,
+            y,
+            self.blocks,
+            id_col=self.id_col,
+            index=self.polygon_index,
+            batch_size=batch_size,
+            n_jobs=n_jobs,
+            verbose=verbose)
+
+    @instrument
+    def query_geometries(self, geometries):
+        """Finds all blocks which intersect with each geometry
+
+        Parameters
+        ----------
+        geometries : iterable of shapely geometries
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            Positions of the geometries and of the intersecting blocks
+            (in ids), sorted by geometry and block
+        """
+        geometries = list(geometries)
+        if not geometries:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+        bounds = np.array([g.bounds for g in geometries])
+        query, block = self.polygon_index.box_candidates(bounds)
+        intersects = np.zeros(query.shape[0], dtype=bool)
+        # Candidates are sorted by geometry, i.e. each geometry is
+        # prepared only once
+        starts = np.flatnonzero(np.r_[True, query[1:] != query[:-1]])
+        ends = np.append(starts[1:], query.shape[0])
+        block_geometries = self.polygon_index.geometries
+        for start, end in zip(starts, ends):
+            prepared = prep(geometries[query[start]])
+            intersects[start:end] = [
+                prepared.intersects(block_geometries[b])
+                for b in block[start:end]
+            ]
+        return query[intersects], block[intersects]
+
+    def query_lines(self, geometries):
+        """Finds all blocks which intersect with each line,
+        e.g. Safe Passage routes
+
+        Parameters
+        ----------
+        geometries : iterable of shapely LineStrings or MultiLineStrings
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            See query_geometries
+        """
+        return self.query_geometries(geometries)
+
+    def query_polygons(self, geometries):
+        """Finds all blocks which intersect with each polygon,
+        e.g. other blocks
+
+        Parameters
+        ----------
+        geometries : iterable of shapely Polygons or MultiPolygons
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            See query_geometries
+        """
+        return self.query_geometries(geometries)
+
+    def join(self, df, how='left'):
+        """Joins a dataframe of lines or polygons with the blocks
+        they intersect with
+
+        Same as gpd.sjoin(blocks, df, how=how, op='intersects') with one
+        row per block, without the geometry of df.
+
+        Parameters
+        ----------
+        df : gpd.GeoDataFrame
+            Lines or polygons. Must not contain a column id_col.
+
+        how : str, optional (default='left')
+            'left' keeps blocks without any intersection,
+            'inner' only keeps intersecting blocks
+
+        Returns
+        -------
+        pd.DataFrame
+            Column id_col and all columns of df except the geometry,
+            sorted by block and by the order of df
+        """
+        assert how in ['left', 'inner']
+        assert self.id_col not in df.columns
+        query, block = self.query_geometries(df['geometry'])
+        order = np.lexsort((query, block))
+        query, block = query[order], block[order]
+        joined = df.drop('geometry', axis='columns').iloc[query]
+        joined.insert(0, self.id_col, self.ids[block])
+        if how == 'left':
+            unmatched = np.setdiff1d(np.arange(len(self.ids)), block)
+            joined = pd.concat(
+                [joined,
+                 pd.DataFrame({
+                     self.id_col: self.ids[unmatched]
+                 })],
+                ignore_index=True)
+            # Blocks are sorted by identifier, a stable sort keeps the
+            # order of df within each block
+            joined = joined.sort_values(self.id_col, kind='mergesort')
+        return joined.reset_index(drop=True)
+
+
+def load_block_index(blocks, cache_path=None, id_col='tract_bloc'):
+    """Loads the block index from disk or builds it
+
+    The stored index is only used if it was built from the same block
+    identifiers and geometries. Otherwise, it is rebuilt and stored.
+
+    Parameters
+    ----------
+    blocks : gpd.GeoDataFrame
+        See BlockIndex
+
+    cache_path : str or pathlib.Path, optional (default=None)
+        Path to pickled index. If None, the index is not stored.
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    Returns
+    -------
+    BlockIndex
+    """
+    if cache_path is not None and Path(cache_path).is_file():
+        blocks = unique_blocks(blocks, id_col=id_col)
+        key = geometry_key(blocks[id_col].values, blocks['geometry'])
+        with Path(cache_path).open('rb') as f:
+            index = pickle.load(f)
+        if index.key == key and index.id_col == id_col:
+            return index
+
+    index = BlockIndex(blocks, id_col=id_col)
+    if cache_path is not None:
+        with Path(cache_path).open('wb') as f:
+            pickle.dump(index, f)
+    return index
@@ -0,0 +1,221 @@
+"""Contains functions to find blocks which are one, two, three, ... blocks
+away from treated blocks ("cells over").
+
+Two blocks are contiguous if their geometries intersect. The contiguity
+is stored once as a sparse adjacency matrix over all blocks, the rings
+around the treated blocks of a school year are then found with a
+breadth-first search on this graph."""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Names of the dummy columns of the first rings
+RING_NAMES = {
+    1: 'one_over',
+    2: 'two_over',
+    3: 'three_over',
+    4: 'four_over',
+    5: 'five_over',
+    6: 'six_over',
+    7: 'seven_over',
+    8: 'eight_over',
+    9: 'nine_over'
+}
+
+
+def ring_name(k):
+    """Name of the dummy column of ring k
+
+    Parameters
+    ----------
+    k : int
+        Distance to the treated blocks, at least 1
+
+    Returns
+    -------
+    str
+        For example 'one_over' for k=1 or '12_over' for k=12
+    """
+    assert k >= 1
+    return RING_NAMES.get(k, '{}_over'.format(k))
+
+
+def build_adjacency(block_index):
+    """Builds the adjacency matrix of all blocks
+
+    Parameters
+    ----------
+    block_index : BlockIndex
+        Index of all blocks, see calculate.block_index
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix of booleans, shape (n_blocks, n_blocks)
+        Entry (i, j) is True if blocks i and j (positions in
+        block_index.ids) intersect. The diagonal is False.
+    """
+    query, block = block_index.query_polygons(
+        block_index.blocks['geometry'])
+    not_self = query != block
+    n_blocks = len(block_index.ids)
+    adjacency = sparse.csr_matrix(
+        (np.ones(not_self.sum(), dtype=bool),
+         (query[not_self], block[not_self])),
+        shape=(n_blocks, n_blocks))
+    # Intersection is symmetric, but make sure numerical edge cases
+    # do not lead to a directed graph
+    return (adjacency + adjacency.T).tocsr()
+
+
+def load_adjacency(block_index, cache_path=None):
+    """Loads the adjacency matrix of all blocks from disk or builds it
+
+    The stored matrix is only used if it was built from the same block
+    identifiers and geometries, i.e. the same key of the block index.
+
+    Parameters
+    ----------
+    block_index : BlockIndex
+        Index of all blocks, see calculate.block_index
+
+    cache_path : str or pathlib.Path, optional (default=None)
+        Path to .npz file. If None, the matrix is not stored.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        See build_adjacency
+    """
+    if cache_path is not None and Path(cache_path).is_file():
+        with np.load(str(cache_path)) as cached:
+            if str(cached['key']) == block_index.key:
+                return sparse.csr_matrix(
+                    (cached['data'], cached['indices'], cached['indptr']),
+                    shape=tuple(cached['shape']))
+
+    adjacency = build_adjacency(block_index)
+    if cache_path is not None:
+        # Saved with np.savez instead of sparse.save_npz
+        # to store the key of the block index alongside
+        with Path(cache_path).open('wb') as f:
+            np.savez(
+                f,
+                data=adjacency.data,
+                indices=adjacency.indices,
+                indptr=adjacency.indptr,
+                shape=np.array(adjacency.shape),
+                key=np.array(block_index.key))
+    return adjacency
+
+
+def ring_distances(adjacency, sources, max_k=3):
+    """Calculates the distance in blocks to the closest source block
+    with a multi-source breadth-first search
+
+    Parameters
+    ----------
+    adjacency : scipy.sparse.csr_matrix
+        Adjacency matrix of all blocks
+
+    sources : np.ndarray of ints or booleans
+        Positions of the source (treated) blocks or boolean mask
+
+    max_k : int, optional (default=3)
+        Maximal distance which is searched
+
+    Returns
+    -------
+    np.ndarray of ints
+        Distance of each block, 0 for the sources and -1 for blocks which
+        are more than max_k blocks away
+    """
+    n_blocks = adjacency.shape[0]
+    visited = np.zeros(n_blocks, dtype=bool)
+    visited[sources] = True
+    distances = np.where(visited, 0, -1)
+    frontier = visited.copy()
+    for k in range(1, max_k + 1):
+        if not frontier.any():
+            break
+        # Neighbours of the current ring which have not been reached yet
+        frontier = (adjacency.dot(frontier.astype('int64')) > 0) & ~visited
+        distances[frontier] = k
+        visited |= frontier
+    return distances
+
+
+def add_ring_dummies(blocks,
+                     adjacency,
+                     ids,
+                     max_k=3,
+                     treated_col='treated',
+                     id_col='tract_bloc',
+                     year_col='school_year',
+                     first_school_year='SY0910'):
+    """Adds dummies for blocks which are one, two, ... blocks away
+    from the treated blocks of the same school year
+
+    Same as finding the blocks contiguous to the treated blocks
+    ('one_over'), then the blocks contiguous to these which are not
+    treated or one over ('two_over'), and so on. A block is in at most
+    one ring and treated blocks are in none. Before first_school_year,
+    all dummies are zero and 'info' is '-', as no treatment took place.
+
+    Parameters
+    ----------
+    blocks : pd.DataFrame
+        One row per block and school year
+
+    adjacency : scipy.sparse.csr_matrix
+        Adjacency matrix of all blocks, see load_adjacency
+
+    ids : np.ndarray
+        Sorted block identifiers corresponding to the rows of adjacency,
+        e.g. BlockIndex.ids
+
+    max_k : int, optional (default=3)
+        Number of rings
+
+    treated_col : str, optional (default='treated')
+        Name of column with the treatment dummy
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    year_col : str, optional (default='school_year')
+        Name of column with the school year
+
+    first_school_year : str, optional (default='SY0910')
+        First school year with treated blocks
+
+    Returns
+    -------
+    pd.DataFrame
+        blocks with one integer dummy column per ring (see ring_name)
+        and a column 'info' ('treated', 'one over', ..., or '-')
+    """
+    assert not blocks[[id_col, year_col]].duplicated().any()
+    positions = np.searchsorted(ids, blocks[id_col].values)
+    assert (ids[np.minimum(positions, len(ids) - 1)] == blocks[id_col]
+            .values).all(), 'Not all blocks are in the adjacency matrix'
+
+    treated = (blocks[treated_col] == 1).values
+    distances = np.full(blocks.shape[0], -1)
+    for school_year, rows in blocks.groupby(year_col).indices.items():
+        # School years 'SYxxyy' sort chronologically as strings
+        if school_year < first_school_year:
+            continue
+        distances_year = ring_distances(
+            adjacency, positions[rows[treated[rows]]], max_k=max_k)
+        distances[rows] = distances_year[positions[rows]]
+
+    blocks = blocks.copy()
+    info = pd.Series('-', index=blocks.index)
+    info[distances == 0] = 'treated'
+    for k in range(1, max_k + 1):
+        blocks[ring_name(k)] = (distances == k).astype('int64')
+        info[distances == k] = ring_name(k).replace('_', ' ')
+    blocks['info'] = info
+    return blocks
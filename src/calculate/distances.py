@@ -1,9 +1,18 @@
-"""Contains function for calculating distance between two GPS coordinates.
+"""Contains functions for calculating distances between GPS coordinates.
 
+vincenty calculates the distance for one pair of coordinates, whereas
+vincenty_batch calculates it for many pairs at once using NumPy arrays.
 You could add the jit decorator of the numba package for a huge speed up
-on the performance. Remember to first install the package."""
+on the performance of vincenty. Remember to first install the package."""
 from math import atan, atan2, cos, radians, sin, sqrt, tan
 
+import numpy as np
+
+# Constants of the WGS-84 ellipsoid
+WGS84_A = 6378137  # radius at equator in meters
+WGS84_F = 1 / 298.257223563  # flattening of the ellipsoid
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
 
 def vincenty(coord1, coord2, max_iter=200, tol=10**-12):
     """Calculates vincenty distance between two coordinate points
@@ -30,9 +39,7 @@ def vincenty(coord1, coord2, max_iter=200, tol=10**-12):
         Distance in meters
     """
     # Constants
-    a = 6378137  # radius at equator in meters (WGS-84)
-    f = 1 / 298.257223563  # flattening of the ellipsoid (WGS-84)
-    b = (1 - f) * a
+    a, f, b = WGS84_A, WGS84_F, WGS84_B
 
     phi_1, L_1 = coord1
     phi_2, L_2 = coord2
@@ -84,3 +91,178 @@ def vincenty(coord1, coord2, max_iter=200, tol=10**-12):
                                   (-3 + 4 * sin_sigma**2) *
                                   (-3 + 4 * cos2_sigma_m**2)))
     return b * A * (sigma - delta_sig)
+
+
+def _vincenty_arrays(phi_1, L_1, phi_2, L_2, max_iter=200, tol=10**-12):
+    """Calculates vincenty distances between two equally long arrays
+    of latitudes and longitudes
+
+    Same iteration as in vincenty, but run for all pairs at once. Pairs
+    which already converged are masked out of the following iterations.
+
+    Parameters
+    ----------
+    phi_1, L_1 : np.ndarray of floats, shape (n,)
+        Latitudes and longitudes of first points
+
+    phi_2, L_2 : np.ndarray of floats, shape (n,)
+        Latitudes and longitudes of second points
+
+    max_iter : int, optional (default=200)
+        Maximum number of iterations. Higher -> slower/more accurate
+
+    tol: float, optional (default=10**-12)
+        Tolerance value which stands for successful convergence
+
+    Returns
+    -------
+    np.ndarray of floats, shape (n,)
+        Distances in meters
+    """
+    a, f, b = WGS84_A, WGS84_F, WGS84_B
+
+    u_1 = np.arctan((1 - f) * np.tan(np.radians(phi_1)))
+    u_2 = np.arctan((1 - f) * np.tan(np.radians(phi_2)))
+    L = np.radians(L_2 - L_1)
+
+    sin_u1 = np.sin(u_1)
+    cos_u1 = np.cos(u_1)
+    sin_u2 = np.sin(u_2)
+    cos_u2 = np.cos(u_2)
+
+    # Values of the last iteration of each pair
+    n = L.shape[0]
+    sin_sigma = np.zeros(n)
+    cos_sigma = np.ones(n)
+    sigma = np.zeros(n)
+    cos_sq_alpha = np.ones(n)
+    cos2_sigma_m = np.zeros(n)
+
+    # set initial value of lambda to L
+    Lambda = L.copy()
+    # Positions of pairs which did not converge yet
+    active = np.arange(n)
+    for i in range(0, max_iter):
+        if active.size == 0:
+            break
+        s_u1, c_u1 = sin_u1[active], cos_u1[active]
+        s_u2, c_u2 = sin_u2[active], cos_u2[active]
+        lam = Lambda[active]
+
+        cos_lambda = np.cos(lam)
+        sin_lambda = np.sin(lam)
+        sin_sig = np.sqrt((c_u2 * sin_lambda)**2 +
+                          (c_u1 * s_u2 - s_u1 * c_u2 * cos_lambda)**2)
+        cos_sig = s_u1 * s_u2 + c_u1 * c_u2 * cos_lambda
+        sig = np.arctan2(sin_sig, cos_sig)
+        # Coincident points would lead to a division by zero,
+        # their distance is zero and they count as converged
+        coincident = sin_sig == 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sin_alpha = np.where(coincident, 0,
+                                 (c_u1 * c_u2 * sin_lambda) / sin_sig)
+            cos_sq_a = 1 - sin_alpha**2
+            # Lines along the equator have cos_sq_alpha == 0
+            cos2_sig_m = np.where(cos_sq_a == 0, 0,
+                                  cos_sig - ((2 * s_u1 * s_u2) / cos_sq_a))
+        C = (f / 16) * cos_sq_a * (4 + f * (4 - 3 * cos_sq_a))
+        lam_new = L[active] + (1 - C) * f * sin_alpha * (
+            sig + C * sin_sig * (cos2_sig_m + C * cos_sig *
+                                 (-1 + 2 * cos2_sig_m**2)))
+
+        sin_sigma[active] = sin_sig
+        cos_sigma[active] = cos_sig
+        sigma[active] = sig
+        cos_sq_alpha[active] = cos_sq_a
+        cos2_sigma_m[active] = cos2_sig_m
+        Lambda[active] = lam_new
+
+        # successful convergence
+        converged = (np.abs(lam - lam_new) <= tol) | coincident
+        active = active[~converged]
+
+    u_sq = cos_sq_alpha * ((a**2 - b**2) / b**2)
+    A = 1 + (u_sq / 16384) * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = (u_sq / 1024) * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sig = B * sin_sigma * (cos2_sigma_m + 0.25 * B *
+                                 (cos_sigma * (-1 + 2 * cos2_sigma_m**2) -
+                                  (1 / 6) * B * cos2_sigma_m *
+                                  (-3 + 4 * sin_sigma**2) *
+                                  (-3 + 4 * cos2_sigma_m**2)))
+    return b * A * (sigma - delta_sig)
+
+
+def vincenty_batch(coords1,
+                   coords2,
+                   pairing='rowwise',
+                   max_iter=200,
+                   tol=10**-12):
+    """Calculates vincenty distances between many coordinate points at once
+
+    Vectorized version of vincenty. The iteration runs for all pairs
+    at the same time and stops separately for each pair as soon as it
+    converged. Results match vincenty within the given tolerance.
+    In contrast to vincenty, coincident points return a distance of zero
+    instead of raising a ZeroDivisionError.
+
+    Parameters
+    ----------
+    coords1 : array-like of floats, shape (n, 2) or (2,)
+        Coordinates as (latitude, longitude)
+
+    coords2 : array-like of floats, shape (m, 2) or (2,)
+        Coordinates as (latitude, longitude)
+
+    pairing : str, optional (default='rowwise')
+        How the coordinates are paired:
+        * 'rowwise': i-th point of coords1 with i-th point of coords2
+          (n has to be equal to m), returns shape (n,)
+        * 'one_to_many': single point coords1 with every point of coords2,
+          returns shape (m,)
+        * 'pairwise': every point of coords1 with every point of coords2,
+          returns distance matrix of shape (n, m)
+
+    max_iter : int, optional (default=200)
+        Maximum number of iterations. Higher -> slower/more accurate
+
+    tol: float, optional (default=10**-12)
+        Tolerance value which stands for successful convergence
+
+    Returns
+    -------
+    np.ndarray of floats
+        Distances in meters
+
+    Example
+    -------
+    >>> vincenty_batch((41.88, -87.63), schools[['lat', 'lon']].values,
+                       pairing='one_to_many')
+    """
+    coords1 = np.atleast_2d(np.asarray(coords1, dtype='float64'))
+    coords2 = np.atleast_2d(np.asarray(coords2, dtype='float64'))
+    assert coords1.shape[1] == 2 and coords2.shape[1] == 2
+
+    if pairing == 'rowwise':
+        assert coords1.shape[0] == coords2.shape[0]
+        shape = (coords1.shape[0], )
+    elif pairing == 'one_to_many':
+        assert coords1.shape[0] == 1
+        coords1 = np.repeat(coords1, coords2.shape[0], axis=0)
+        shape = (coords2.shape[0], )
+    elif pairing == 'pairwise':
+        shape = (coords1.shape[0], coords2.shape[0])
+        coords1 = np.repeat(coords1, shape[1], axis=0)
+        coords2 = np.tile(coords2, (shape[0], 1))
+    else:
+        raise ValueError(
+            "pairing has to be one of 'rowwise', 'one_to_many' or "
+            "'pairwise', got '{}'".format(pairing))
+
+    distances = _vincenty_arrays(
+        coords1[:, 0],
+        coords1[:, 1],
+        coords2[:, 0],
+        coords2[:, 1],
+        max_iter=max_iter,
+        tol=tol)
+    return distances.reshape(shape)
@@ -0,0 +1,374 @@
+"""Contains an index of the Safe Passage routes to find the nearest route
+and its distance for large numbers of points, e.g. crimes or the
+centroids of the census blocks, in each school year.
+
+The routes are densified into vertices which are at most a few meters
+apart and the vertices are stored in a KD-tree per school year. To this
+end, coordinates are projected to meters with an equirectangular
+projection around the center of the routes, which is accurate to a few
+tenths of a percent within Chicago. The distance to the nearest vertex
+overestimates the distance to the route by at most half of the spacing
+of the vertices. Optionally, the exact distances to the nearest
+candidate vertices are calculated with vincenty_batch."""
+from math import cos, radians, sin, sqrt
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from ..instrument import instrument
+from .distances import WGS84_A, WGS84_F, vincenty_batch
+from .point_in_polygon import expand_ranges
+
+
+class LocalProjection:
+    """Equirectangular projection of longitudes and latitudes to meters
+
+    Uses the radii of curvature of the WGS-84 ellipsoid at the
+    center latitude.
+
+    Parameters
+    ----------
+    lon0, lat0 : float
+        Center of the projection
+    """
+
+    def __init__(self, lon0, lat0):
+        self.lon0 = lon0
+        self.lat0 = lat0
+        e_sq = WGS84_F * (2 - WGS84_F)
+        w = sqrt(1 - e_sq * sin(radians(lat0))**2)
+        # Meters per radian in north-south and east-west direction
+        self.scale_y = WGS84_A * (1 - e_sq) / w**3
+        self.scale_x = WGS84_A / w * cos(radians(lat0))
+
+    def forward(self, lon, lat):
+        """Projects longitudes and latitudes
+
+        Parameters
+        ----------
+        lon, lat : array-like of floats
+
+        Returns
+        -------
+        np.ndarray of floats, shape (n, 2)
+            x and y in meters
+        """
+        return np.column_stack([
+            np.radians(np.asarray(lon, dtype='float64') - self.lon0) *
+            self.scale_x,
+            np.radians(np.asarray(lat, dtype='float64') - self.lat0) *
+            self.scale_y
+        ])
+
+    def inverse(self, xy):
+        """Converts projected coordinates back to longitudes and latitudes
+
+        Parameters
+        ----------
+        xy : np.ndarray of floats, shape (n, 2)
+
+        Returns
+        -------
+        tuple of np.ndarray of floats
+            Longitudes and latitudes
+        """
+        return (self.lon0 + np.degrees(xy[:, 0] / self.scale_x),
+                self.lat0 + np.degrees(xy[:, 1] / self.scale_y))
+
+
+def line_parts(geometry):
+    """Extracts the coordinates of all parts of a line or multiline
+
+    Parameters
+    ----------
+    geometry : shapely LineString or MultiLineString
+
+    Returns
+    -------
+    list of np.ndarray of floats, shape (n, 2)
+        Longitudes and latitudes of the vertices of each part
+    """
+    if geometry.geom_type == 'LineString':
+        parts = [geometry]
+    elif geometry.geom_type == 'MultiLineString':
+        parts = list(geometry.geoms)
+    else:
+        raise ValueError('Geometry of type {} is not supported'.format(
+            geometry.geom_type))
+    return [np.asarray(part.coords)[:, :2] for part in parts]
+
+
+def densify(parts, owners, spacing):
+    """Interpolates vertices along lines such that consecutive vertices
+    are at most spacing apart
+
+    Parameters
+    ----------
+    parts : list of np.ndarray of floats, shape (n, 2)
+        Projected coordinates of the vertices of each line
+
+    owners : np.ndarray of ints
+        Position of the route each line belongs to
+
+    spacing : float
+        Maximal distance between vertices in meters
+
+    Returns
+    -------
+    tuple of np.ndarray
+        Coordinates of all vertices (shape (m, 2)) and the position
+        of their route
+    """
+    n_vertices = np.array([part.shape[0] for part in parts])
+    coords = np.concatenate(parts)
+    vertex_owner = np.repeat(owners, n_vertices)
+    # Segments between consecutive vertices of the same line
+    is_start = np.ones(coords.shape[0], dtype=bool)
+    is_start[np.cumsum(n_vertices) - 1] = False
+    start = np.flatnonzero(is_start)
+    delta = coords[start + 1] - coords[start]
+    n_steps = np.maximum(
+        np.ceil(np.sqrt((delta**2).sum(axis=1)) / spacing), 1).astype('int64')
+    segment, step = expand_ranges(np.zeros_like(n_steps), n_steps)
+    t = (step / n_steps[segment])[:, None]
+    points = coords[start[segment]] + t * delta[segment]
+    # The last vertex of each line is not the start of a segment
+    last = np.cumsum(n_vertices) - 1
+    return (np.concatenate([points, coords[last]]),
+            np.concatenate([vertex_owner[start[segment]],
+                            vertex_owner[last]]))
+
+
+class RouteIndex:
+    """Index of the vertices of the routes of each school year
+
+    Parameters
+    ----------
+    routes : gpd.GeoDataFrame
+        Routes with the columns route_col, sy_col and 'geometry'
+        (lines in longitudes and latitudes), e.g. routes.pkl
+
+    spacing : float, optional (default=10)
+        Maximal distance between the vertices of a route in meters
+
+    route_col : str, optional (default='route_number')
+        Name of column which identifies a route
+
+    sy_col : str, optional (default='school_year')
+        Name of column with the school year of a route
+
+    Attributes
+    ----------
+    school_years : list of str
+        School years with at least one route
+
+    projection : LocalProjection
+    """
+
+    def __init__(self,
+                 routes,
+                 spacing=10,
+                 route_col='route_number',
+                 sy_col='school_year'):
+        routes = routes.dropna(subset=['geometry']).reset_index(drop=True)
+        parts, owners = [], []
+        for i, geometry in enumerate(routes['geometry']):
+            for part in line_parts(geometry):
+                parts.append(part)
+                owners.append(i)
+        all_coords = np.concatenate(parts)
+        self.projection = LocalProjection(all_coords[:, 0].mean(),
+                                          all_coords[:, 1].mean())
+        vertices, vertex_owner = densify(
+            [self.projection.forward(p[:, 0], p[:, 1]) for p in parts],
+            np.array(owners), spacing)
+
+        route_numbers = routes[route_col].values
+        school_years = routes[sy_col].values[vertex_owner]
+        self.spacing = spacing
+        self.school_years = sorted(set(school_years))
+        self.trees = {}
+        self.vertex_routes = {}
+        for sy in self.school_years:
+            in_sy = school_years == sy
+            self.trees[sy] = cKDTree(vertices[in_sy])
+            self.vertex_routes[sy] = route_numbers[vertex_owner[in_sy]]
+
+    def query_school_year(self, lon, lat, school_year, k=1, refine=False):
+        """Finds the nearest route of points in a single school year
+
+        Parameters
+        ----------
+        lon, lat : np.ndarray of floats
+            Coordinates of the points, no missing values
+
+        school_year : str
+            Has to be in school_years
+
+        k, refine
+            See query
+
+        Returns
+        -------
+        tuple of np.ndarray
+            Distances in meters and route numbers
+        """
+        tree = self.trees[school_year]
+        k = min(k, tree.n)
+        distances, vertices = tree.query(
+            self.projection.forward(lon, lat), k=k)
+        distances = distances.reshape(lon.shape[0], k)
+        vertices = vertices.reshape(lon.shape[0], k)
+        if refine:
+            vertex_lon, vertex_lat = self.projection.inverse(
+                tree.data[vertices.ravel()])
+            distances = vincenty_batch(
+                np.column_stack([np.repeat(lat, k),
+                                 np.repeat(lon, k)]),
+                np.column_stack([vertex_lat, vertex_lon])).reshape(
+                    lon.shape[0], k)
+        nearest = distances.argmin(axis=1)
+        rows = np.arange(lon.shape[0])
+        return (distances[rows, nearest],
+                self.vertex_routes[school_year][vertices[rows, nearest]])
+
+    @instrument
+    def query(self,
+              lon,
+              lat,
+              school_years,
+              k=1,
+              refine=False,
+              batch_size=100000):
+        """Finds the nearest route of the same school year for each point
+
+        Parameters
+        ----------
+        lon, lat : array-like of floats
+            Longitudes and latitudes of the points
+
+        school_years : array-like of str
+            School year of each point
+
+        k : int, optional (default=1)
+            Number of nearest vertices which are candidates for the
+            nearest route. Only matters if refine is True.
+
+        refine : boolean, optional (default=False)
+            If True, the distances to the k candidate vertices are
+            calculated with vincenty_batch and the nearest one is taken
+
+        batch_size : int, optional (default=100000)
+            Number of points per query
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns 'route_distance' (meters) and 'nearest_route' in the
+            order of the points. Both are missing for points without
+            coordinates or in school years without routes.
+        """
+        lon = np.asarray(lon, dtype='float64')
+        lat = np.asarray(lat, dtype='float64')
+        school_years = np.asarray(school_years, dtype='object')
+        distances = np.full(lon.shape[0], np.nan)
+        nearest_routes = np.full(lon.shape[0], np.nan)
+        valid = ~(np.isnan(lon) | np.isnan(lat))
+        for sy in self.school_years:
+            positions = np.flatnonzero(valid & (school_years == sy))
+            for i in range(0, positions.shape[0], batch_size):
+                batch = positions[i:i + batch_size]
+                distances[batch], nearest_routes[batch] = (
+                    self.query_school_year(
+                        lon[batch], lat[batch], sy, k=k, refine=refine))
+        return pd.DataFrame({
+            'route_distance': distances,
+            'nearest_route': nearest_routes
+        }, columns=['route_distance', 'nearest_route'])
+
+
+def block_route_distances(blocks, route_index, id_col='tract_bloc',
+                          sy_col='school_year', **kwargs):
+    """Distances of the centroids of the blocks to the nearest route
+    in each school year
+
+    Parameters
+    ----------
+    blocks : gpd.GeoDataFrame
+        Blocks with the columns id_col, sy_col and 'geometry'. The
+        geometry of a block has to be the same in all school years.
+
+    route_index : RouteIndex
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    sy_col : str, optional (default='school_year')
+        Name of column with the school year
+
+    **kwargs
+        Passed to RouteIndex.query, e.g. refine=True
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns id_col, sy_col, 'route_distance' and 'nearest_route'
+        with one row per block and school year of blocks
+    """
+    unique = blocks.drop_duplicates(subset=[id_col])
+    centroids = [geometry.centroid for geometry in unique['geometry']]
+    centroid_lon = pd.Series([c.x for c in centroids],
+                             index=unique[id_col].values)
+    centroid_lat = pd.Series([c.y for c in centroids],
+                             index=unique[id_col].values)
+
+    block_years = blocks[[id_col, sy_col]].drop_duplicates().reset_index(
+        drop=True)
+    distances = route_index.query(
+        centroid_lon.loc[block_years[id_col]].values,
+        centroid_lat.loc[block_years[id_col]].values,
+        block_years[sy_col].values, **kwargs)
+    return pd.concat([block_years, distances], axis='columns')
+
+
+def crime_route_distances(crimes, route_index, sy_col='school_year',
+                          first_route_year='SY1314', **kwargs):
+    """Distances of the crimes to the nearest route of their school year
+
+    Parameters
+    ----------
+    crimes : pd.DataFrame
+        Crimes with the columns 'Longitude', 'Latitude' and sy_col.
+        Crimes without a school year (e.g. in the summer months) get
+        missing distances.
+
+    route_index : RouteIndex
+
+    sy_col : str, optional (default='school_year')
+        Name of column with the school year
+
+    first_route_year : str, optional (default='SY1314')
+        School year of the first routes. Crimes in earlier school years
+        are measured against the routes of this school year, like the
+        route information of the blocks.
+
+    **kwargs
+        Passed to RouteIndex.query, e.g. refine=True
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'route_distance' (meters) and 'nearest_route' with the
+        index of crimes
+    """
+    school_years = crimes[sy_col]
+    # School years 'SYxxyy' sort chronologically as strings
+    school_years = school_years.where(
+        school_years.isnull() | (school_years >= first_route_year),
+        first_route_year)
+    distances = route_index.query(crimes['Longitude'].values,
+                                  crimes['Latitude'].values,
+                                  school_years.values, **kwargs)
+    distances.index = crimes.index
+    return distances
@@ -0,0 +1,409 @@
+"""Contains a grid index over polygons to assign large numbers of points,
+e.g. crimes, to the polygons, e.g. census blocks, which contain them.
+
+The points are given as coordinate arrays, no shapely Point objects are
+created. Candidate polygons are looked up in a regular grid over the
+bounding boxes of the polygons and the point in polygon test
+(crossing number) is vectorized over all candidate pairs of a batch."""
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+
+def polygon_rings(geometry):
+    """Extracts all rings (exteriors and interiors) of a polygon
+    or multipolygon
+
+    Parameters
+    ----------
+    geometry : shapely Polygon or MultiPolygon
+
+    Returns
+    -------
+    list of np.ndarray of floats, shape (n, 2)
+        Coordinates of each ring
+    """
+    if geometry.geom_type == 'Polygon':
+        parts = [geometry]
+    elif geometry.geom_type == 'MultiPolygon':
+        parts = list(geometry.geoms)
+    else:
+        raise ValueError('Geometry of type {} is not supported'.format(
+            geometry.geom_type))
+    rings = []
+    for part in parts:
+        rings.append(np.asarray(part.exterior.coords)[:, :2])
+        rings.extend(
+            np.asarray(interior.coords)[:, :2] for interior in part.interiors)
+    return rings
+
+
+def expand_ranges(starts, counts):
+    """Concatenates the ranges [start, start + count) of all elements
+
+    Parameters
+    ----------
+    starts : np.ndarray of ints
+
+    counts : np.ndarray of ints
+
+    Returns
+    -------
+    tuple of np.ndarray of ints
+        Position of the element each value belongs to and the values
+    """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    values = np.arange(owner.shape[0]) - offsets[owner] + starts[owner]
+    return owner, values
+
+
+class PolygonIndex:
+    """Grid index over polygons for fast point in polygon queries
+
+    All edges of the polygons are stored in flat arrays. A point lies in a
+    polygon if a ray from the point crosses the edges of the polygon
+    an odd number of times. This also handles holes and multipolygons.
+    Points on the boundary of a polygon, which the crossing number
+    cannot decide, are checked exactly with shapely.
+
+    Parameters
+    ----------
+    geometries : iterable of shapely Polygons or MultiPolygons
+
+    cell_size : float, optional (default=None)
+        Size of a grid cell in units of the coordinates. By default, chosen
+        such that there are about as many cells as polygons.
+    """
+
+    def __init__(self, geometries, cell_size=None):
+        self.geometries = list(geometries)
+        n_polygons = len(self.geometries)
+        assert n_polygons > 0
+
+        # Flat arrays of all edges, ordered by polygon
+        x0, y0, x1, y1, n_edges = [], [], [], [], []
+        for geometry in self.geometries:
+            count = 0
+            for ring in polygon_rings(geometry):
+                x0.append(ring[:-1, 0])
+                y0.append(ring[:-1, 1])
+                x1.append(ring[1:, 0])
+                y1.append(ring[1:, 1])
+                count += ring.shape[0] - 1
+            n_edges.append(count)
+        self.x0 = np.concatenate(x0)
+        self.y0 = np.concatenate(y0)
+        self.x1 = np.concatenate(x1)
+        self.y1 = np.concatenate(y1)
+        self.n_edges = np.array(n_edges, dtype='int64')
+        self.edge_start = np.cumsum(self.n_edges) - self.n_edges
+
+        self.bounds = np.array([g.bounds for g in self.geometries])
+        self.build_grid(cell_size)
+
+    def build_grid(self, cell_size=None):
+        """Assigns the polygons to all grid cells their bounding box overlaps
+
+        Parameters
+        ----------
+        cell_size : float, optional (default=None)
+            See class docstring
+
+        Returns
+        -------
+        Nothing
+        """
+        minx, miny = self.bounds[:, 0].min(), self.bounds[:, 1].min()
+        maxx, maxy = self.bounds[:, 2].max(), self.bounds[:, 3].max()
+        if cell_size is None:
+            cell_size = np.sqrt(
+                (maxx - minx) * (maxy - miny) / len(self.geometries))
+        self.cell_size = cell_size
+        self.origin = (minx, miny)
+        self.nx = int((maxx - minx) // cell_size) + 1
+        self.ny = int((maxy - miny) // cell_size) + 1
+
+        polygon, cells = self.box_cells(self.bounds)
+        # Compressed sparse row layout: polygons of cell c are
+        # cell_polygons[cell_start[c]:cell_start[c + 1]]
+        order = np.lexsort((polygon, cells))
+        self.cell_polygons = polygon[order]
+        self.cell_start = np.concatenate(
+            [[0],
+             np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))])
+        return
+
+    def cell_coords(self, x, y):
+        """Calculates the column and row of the grid cells of coordinates
+
+        Parameters
+        ----------
+        x, y : np.ndarray of floats
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            Column and row, clipped to the grid
+        """
+        ix = np.clip((x - self.origin[0]) // self.cell_size, 0, self.nx - 1)
+        iy = np.clip((y - self.origin[1]) // self.cell_size, 0, self.ny - 1)
+        return ix.astype('int64'), iy.astype('int64')
+
+    def box_cells(self, bounds):
+        """Finds all grid cells which overlap with bounding boxes
+
+        Parameters
+        ----------
+        bounds : np.ndarray of floats, shape (n, 4)
+            Bounding boxes as (minx, miny, maxx, maxy)
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            Positions of the boxes and the cells they overlap with
+        """
+        ix0, iy0 = self.cell_coords(bounds[:, 0], bounds[:, 1])
+        ix1, iy1 = self.cell_coords(bounds[:, 2], bounds[:, 3])
+        width = ix1 - ix0 + 1
+        box, k = expand_ranges(np.zeros_like(width), width * (iy1 - iy0 + 1))
+        cells = ((iy0[box] + k // width[box]) * self.nx + ix0[box] +
+                 k % width[box])
+        return box, cells
+
+    def box_candidates(self, bounds):
+        """Finds all polygons whose bounding box overlaps with
+        the given bounding boxes
+
+        Parameters
+        ----------
+        bounds : np.ndarray of floats, shape (n, 4)
+            Bounding boxes as (minx, miny, maxx, maxy)
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            Positions of the boxes and of the polygons of all
+            candidate pairs, sorted by box and polygon
+        """
+        bounds = np.asarray(bounds, dtype='float64').reshape(-1, 4)
+        box, cells = self.box_cells(bounds)
+        owner, pos = expand_ranges(
+            self.cell_start[cells],
+            self.cell_start[cells + 1] - self.cell_start[cells])
+        box, polygon = box[owner], self.cell_polygons[pos]
+        # A pair is found in every cell both boxes overlap with
+        pairs = np.unique(box * len(self.geometries) + polygon)
+        box, polygon = pairs // len(self.geometries), pairs % len(
+            self.geometries)
+        a, b = bounds[box], self.bounds[polygon]
+        overlap = ((a[:, 0] <= b[:, 2]) & (a[:, 2] >= b[:, 0]) &
+                   (a[:, 1] <= b[:, 3]) & (a[:, 3] >= b[:, 1]))
+        return box[overlap], polygon[overlap]
+
+    def candidates(self, x, y):
+        """Finds all polygons whose bounding box contains a point
+
+        Parameters
+        ----------
+        x, y : np.ndarray of floats
+            Coordinates of the points
+
+        Returns
+        -------
+        tuple of np.ndarray of ints
+            Positions of the points and of the polygons of all
+            candidate pairs, sorted by point and polygon
+        """
+        inside_grid = ((x >= self.origin[0]) & (y >= self.origin[1]) &
+                       (x <= self.origin[0] + self.nx * self.cell_size) &
+                       (y <= self.origin[1] + self.ny * self.cell_size))
+        # Points outside of the grid (or NaN) get no candidates
+        ix, iy = self.cell_coords(
+            np.where(inside_grid, x, self.origin[0]),
+            np.where(inside_grid, y, self.origin[1]))
+        cells = iy * self.nx + ix
+        counts = np.where(inside_grid,
+                          self.cell_start[cells + 1] - self.cell_start[cells],
+                          0)
+        point, pos = expand_ranges(self.cell_start[cells], counts)
+        polygon = self.cell_polygons[pos]
+        b = self.bounds[polygon]
+        in_bbox = ((x[point] >= b[:, 0]) & (y[point] >= b[:, 1]) &
+                   (x[point] <= b[:, 2]) & (y[point] <= b[:, 3]))
+        return point[in_bbox], polygon[in_bbox]
+
+    def query(self, x, y):
+        """Finds the polygon which contains each point
+
+        Should a point lie in multiple polygons, the first one is returned.
+
+        Parameters
+        ----------
+        x, y : array-like of floats
+            Coordinates of the points (in the same coordinate reference
+            system as the polygons)
+
+        Returns
+        -------
+        np.ndarray of ints
+            Position of the polygon in geometries for each point,
+            -1 if no polygon contains the point
+        """
+        x = np.asarray(x, dtype='float64')
+        y = np.asarray(y, dtype='float64')
+        point, polygon = self.candidates(x, y)
+
+        # Crossing number test for all edges of all candidate pairs
+        pair, edge = expand_ranges(self.edge_start[polygon],
+                                   self.n_edges[polygon])
+        px, py = x[point[pair]], y[point[pair]]
+        x0, y0 = self.x0[edge], self.y0[edge]
+        x1, y1 = self.x1[edge], self.y1[edge]
+        straddles = (y0 > py) != (y1 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        crosses = straddles & (px < x_cross)
+        n_crossings = np.bincount(
+            pair, weights=crosses, minlength=point.shape[0])
+        inside = n_crossings % 2 == 1
+
+        result = np.full(x.shape[0], -1, dtype='int64')
+        # Reversed such that the first polygon of each point is assigned last
+        result[point[inside][::-1]] = polygon[inside][::-1]
+
+        # Points on a boundary are not reliably detected by the crossing
+        # number, check the unmatched candidates exactly
+        unmatched = result[point] == -1
+        for p, poly in zip(point[unmatched], polygon[unmatched]):
+            if result[p] == -1 and self.geometries[poly].intersects(
+                    Point(x[p], y[p])):
+                result[p] = poly
+        return result
+
+    def query_batches(self, x, y, batch_size=100000, n_jobs=1):
+        """Same as query but processes the points in batches to limit
+        memory usage, optionally in multiple processes
+
+        Parameters
+        ----------
+        x, y : array-like of floats
+            Coordinates of the points
+
+        batch_size : int, optional (default=100000)
+            Number of points per batch
+
+        n_jobs : int, optional (default=1)
+            Number of processes
+
+        Returns
+        -------
+        np.ndarray of ints
+            See query
+        """
+        x = np.asarray(x, dtype='float64')
+        y = np.asarray(y, dtype='float64')
+        batches = [(x[i:i + batch_size], y[i:i + batch_size])
+                   for i in range(0, x.shape[0], batch_size)]
+        if not batches:
+            return np.empty(0, dtype='int64')
+        if n_jobs == 1:
+            results = [self.query(*batch) for batch in batches]
+        else:
+            with Pool(n_jobs, initializer=init_worker,
+                      initargs=(self, )) as pool:
+                results = pool.starmap(query_worker, batches)
+        return np.concatenate(results)
+
+
+# Index of the worker processes of PolygonIndex.query_batches
+worker_index = None
+
+
+def init_worker(index):
+    """Stores the index in the worker process
+
+    Parameters
+    ----------
+    index : PolygonIndex
+
+    Returns
+    -------
+    Nothing
+    """
+    global worker_index
+    worker_index = index
+    return
+
+
+def query_worker(x, y):
+    """Queries the index of the worker process
+
+    Parameters
+    ----------
+    x, y : np.ndarray of floats
+
+    Returns
+    -------
+    np.ndarray of ints
+        See PolygonIndex.query
+    """
+    return worker_index.query(x, y)
+
+
+def assign_blocks(lon,
+                  lat,
+                  blocks,
+                  id_col='tract_bloc',
+                  index=None,
+                  batch_size=100000,
+                  n_jobs=1,
+                  verbose=True):
+    """Assigns points to the census blocks which contain them
+
+    Gives the same assignments as gpd.sjoin(points, blocks, how='left',
+    op='intersects') as long as the blocks do not overlap.
+
+    Parameters
+    ----------
+    lon, lat : array-like of floats
+        Longitudes and latitudes of the points
+
+    blocks : gpd.GeoDataFrame
+        Blocks with one row per block and columns id_col and 'geometry'
+
+    id_col : str, optional (default='tract_bloc')
+        Name of column which identifies a block
+
+    index : PolygonIndex, optional (default=None)
+        Index over the geometries of blocks, built if not given
+
+    batch_size : int, optional (default=100000)
+        Number of points per batch
+
+    n_jobs : int, optional (default=1)
+        Number of processes
+
+    verbose : boolean, optional (default=True)
+        If True, prints the number of points which are not in any block
+
+    Returns
+    -------
+    pd.Series
+        Identifier of the block of each point, NaN if a point lies
+        in no block
+    """
+    assert not blocks[id_col].duplicated().any()
+    if index is None:
+        index = PolygonIndex(blocks['geometry'])
+    positions = index.query_batches(
+        lon, lat, batch_size=batch_size, n_jobs=n_jobs)
+    unmatched = positions == -1
+    if verbose:
+        print('{:,} of {:,} points are not in any block'.format(
+            unmatched.sum(), positions.shape[0]))
+    block_ids = blocks[id_col].values[positions].astype('float64')
+    block_ids[unmatched] = np.nan
+    return pd.Series(block_ids, name=id_col)
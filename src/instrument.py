@@ -0,0 +1,477 @@
+"""Contains functions to measure the wall time, CPU time, peak memory
+and number of returned rows of the stages of the pipeline.
+
+Functions are measured by decorating them with instrument, arbitrary code
+blocks with the context manager measure. Each measurement is appended as
+one JSON object per line to the log file given by the environment
+variable PIPELINE_LOG (if it is set), such that measurements of notebook
+kernels end up in the same log as the ones of run_ipynb.py.
+
+The peak memory is the maximum resident set size (RSS) during the stage.
+On Linux, the high-water mark of the RSS of the process (VmHWM) is reset
+when a stage starts and read when it ends. The RSS of child processes,
+e.g. of notebook kernels, is sampled by a background thread. On other
+systems, only the high-water mark since the start of the process
+(ru_maxrss) is available, which can stem from an earlier stage. The
+record tells which one was measured in 'peak_rss_scope' ('stage' or
+'process'). It is not available on Windows."""
+import inspect
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variable with the path to the log file
+LOG_ENV = 'PIPELINE_LOG'
+
+# Files of the Linux kernel with the memory of the current process and
+# to reset its high-water mark
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+# Seconds between two samples of the memory of child processes
+SAMPLE_INTERVAL = 0.2
+
+# Peaks of the stages of this process which are measured at the moment.
+# Resetting the high-water mark for a stage must not lose the peak which
+# the enclosing stages have reached so far.
+_open_peaks = []
+
+
+def usage(children=False):
+    """CPU time and memory high-water mark of the current process
+
+    Parameters
+    ----------
+    children : boolean, optional (default=False)
+        If True, includes terminated child processes, e.g. notebook kernels
+
+    Returns
+    -------
+    tuple of floats
+        CPU time in seconds and high-water mark of the resident set
+        size since the start of the process in megabytes (None if it is
+        not available)
+    """
+    cpu = time.process_time()
+    if resource is None:
+        return cpu, None
+    who = [resource.RUSAGE_SELF]
+    if children:
+        who.append(resource.RUSAGE_CHILDREN)
+    peak = 0
+    for w in who:
+        r = resource.getrusage(w)
+        if w == resource.RUSAGE_CHILDREN:
+            cpu += r.ru_utime + r.ru_stime
+        peak = max(peak, r.ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    divisor = 1024**2 if os.uname().sysname == 'Darwin' else 1024
+    return cpu, peak / divisor
+
+
+def status_mb(field, pid='self'):
+    """Reads a memory field of a process from /proc/<pid>/status
+
+    Parameters
+    ----------
+    field : str
+        E.g. 'VmRSS' or 'VmHWM'
+
+    pid : int or str, optional (default='self')
+
+    Returns
+    -------
+    float or None
+        Megabytes, None if the field can not be read (e.g. not on Linux
+        or the process terminated)
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Resets the high-water mark of the RSS of the current process
+
+    The peaks of the stages which are measured at the moment are updated
+    before, such that they are not lost.
+
+    Returns
+    -------
+    boolean
+        False if the high-water mark can not be reset (not on Linux)
+    """
+    peak = status_mb('VmHWM')
+    if peak is None:
+        return False
+    for open_peak in _open_peaks:
+        open_peak['peak'] = max(open_peak['peak'], peak)
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def descendants(pid):
+    """Identifiers of all child processes of a process and their children
+
+    Parameters
+    ----------
+    pid : int
+
+    Returns
+    -------
+    list of int
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry)) as f:
+                # The name of the command in brackets can contain spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found = []
+    to_visit = [pid]
+    while to_visit:
+        for child in children.get(to_visit.pop(), []):
+            found.append(child)
+            to_visit.append(child)
+    return found
+
+
+class ChildrenSampler(threading.Thread):
+    """Background thread which samples the total RSS of all child
+    processes of the current process
+
+    Attributes
+    ----------
+    peak : float
+        Largest total RSS of the child processes in megabytes
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0.
+        self.stopped = threading.Event()
+
+    def sample(self):
+        rss = [status_mb('VmRSS', pid) for pid in descendants(os.getpid())]
+        self.peak = max(self.peak, sum(r for r in rss if r is not None))
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        """Stops sampling and returns the peak in megabytes"""
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def count_rows(result):
+    """Number of rows of the result of a stage
+
+    Parameters
+    ----------
+    result : object
+
+    Returns
+    -------
+    int or None
+        Length of dataframes, series and arrays. For tuples, the number
+        of rows of the first element. None for all other results.
+    """
+    if isinstance(result, tuple) and result:
+        return count_rows(result[0])
+    if hasattr(result, 'shape') and len(getattr(result, 'shape')) > 0:
+        return int(result.shape[0])
+    return None
+
+
+def write_record(record, log_path=None):
+    """Appends a measurement to the log file
+
+    Parameters
+    ----------
+    record : dict
+
+    log_path : str or pathlib.Path, optional (default=None)
+        Defaults to the path in the environment variable PIPELINE_LOG.
+        If neither is given, the record is not written.
+
+    Returns
+    -------
+    Nothing
+    """
+    log_path = log_path or os.environ.get(LOG_ENV)
+    if log_path:
+        # A single write of one line, such that records of processes
+        # which run at the same time do not interleave
+        with open(str(log_path), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    return
+
+
+def read_log(log_path, since=None):
+    """Reads all measurements of a log file
+
+    Parameters
+    ----------
+    log_path : str or pathlib.Path
+
+    since : float, optional (default=None)
+        If given, only measurements which started at or after this
+        time (seconds since the epoch) are returned
+
+    Returns
+    -------
+    list of dict
+    """
+    if not os.path.isfile(str(log_path)):
+        return []
+    with open(str(log_path)) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if since is not None:
+        records = [r for r in records if r['start'] >= since]
+    return records
+
+
+@contextmanager
+def measure(stage, label=None, children=False, log_path=None):
+    """Measures a block of code
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage, e.g. the name of the function
+
+    label : str, optional (default=None)
+        Additional description, e.g. the path of a notebook
+
+    children : boolean, optional (default=False)
+        If True, includes the CPU time of child processes which terminated
+        during the stage and the memory of all child processes (sampled
+        on Linux, else their high-water mark)
+
+    log_path : str or pathlib.Path, optional (default=None)
+        See write_record
+
+    Yields
+    ------
+    dict
+        Record of the measurement. The key 'rows' can be set inside the
+        block, setting the key 'skip' to True discards the record. The
+        other values are filled in when the block is left.
+    """
+    record = {
+        'stage': stage,
+        'label': label,
+        'rows': None,
+        'pid': os.getpid(),
+        'host': socket.gethostname(),
+        'start': time.time()
+    }
+    start_wall = time.perf_counter()
+    start_cpu, _ = usage(children=children)
+    per_stage = reset_peak_rss()
+    stage_peak = {'peak': 0.}
+    sampler = None
+    if per_stage:
+        _open_peaks.append(stage_peak)
+        if children:
+            sampler = ChildrenSampler()
+            sampler.start()
+    record['failed'] = True
+    try:
+        yield record
+        record['failed'] = False
+    finally:
+        cpu, max_rss = usage(children=children)
+        record['wall_s'] = time.perf_counter() - start_wall
+        record['cpu_s'] = cpu - start_cpu
+        if per_stage:
+            # Removed by identity, the stages of generators (see
+            # instrument) do not end in the reverse order of their start
+            _open_peaks[:] = [p for p in _open_peaks if p is not stage_peak]
+            peak = max(stage_peak['peak'], status_mb('VmHWM') or 0)
+            for open_peak in _open_peaks:
+                open_peak['peak'] = max(open_peak['peak'], peak)
+            if sampler is not None:
+                peak += sampler.stop()
+            record['peak_rss_mb'] = peak
+            record['peak_rss_scope'] = 'stage'
+        else:
+            record['peak_rss_mb'] = max_rss
+            record['peak_rss_scope'] = None if max_rss is None else 'process'
+        if not record.pop('skip', False):
+            write_record(record, log_path=log_path)
+
+
+def measure_generator(generator, stage, children=False):
+    """Measures a generator from its first item until it is used up
+
+    Parameters
+    ----------
+    generator : generator
+
+    stage, children
+        See measure
+
+    Yields
+    ------
+    object
+        Items of generator. The number of rows is summed up over the
+        items (see count_rows). The wall time includes the time which
+        the consumer spends between the items.
+    """
+    with measure(stage, children=children) as record:
+        for item in generator:
+            rows = count_rows(item)
+            if rows is not None:
+                record['rows'] = (record['rows'] or 0) + rows
+            try:
+                yield item
+            except GeneratorExit:
+                # The consumer stopped early, which is not a failure
+                generator.close()
+                return
+
+
+def instrument(func=None, stage=None, children=False):
+    """Decorator which measures each call of a function
+
+    Can be used as @instrument or with arguments, e.g.
+    @instrument(stage='load crimes').
+
+    Parameters
+    ----------
+    func : function, optional (default=None)
+        Function to decorate
+
+    stage : str, optional (default=None)
+        Name of the stage, defaults to the qualified name of the function
+
+    children : boolean, optional (default=False)
+        See measure
+
+    Returns
+    -------
+    function
+        Decorated function which writes a record to the log after each
+        call. The number of rows is taken from the result (see
+        count_rows). If the function returns a generator, the record
+        is written once the generator is used up (see measure_generator).
+    """
+    if func is None:
+        return lambda f: instrument(f, stage=stage, children=children)
+    stage_name = func.__qualname__ if stage is None else stage
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if inspect.isgeneratorfunction(func):
+            return measure_generator(
+                func(*args, **kwargs), stage_name, children=children)
+        with measure(stage_name, children=children) as record:
+            result = func(*args, **kwargs)
+            record['rows'] = count_rows(result)
+            # A returned generator is measured while it is used up
+            record['skip'] = inspect.isgenerator(result)
+        if (inspect.isgenerator(result)
+                and result.gi_code is not measure_generator.__code__):
+            # Generators of other instrumented functions are measured
+            # by themselves
+            return measure_generator(result, stage_name, children=children)
+        return result
+
+    return wrapper
+
+
+def summarize(records):
+    """Aggregates measurements per stage and label
+
+    Parameters
+    ----------
+    records : list of dict
+        See read_log
+
+    Returns
+    -------
+    list of dict
+        One entry per stage and label with the number of calls, the total
+        wall and CPU time, the maximal peak memory and the total number
+        of rows, sorted by wall time (descending)
+    """
+    summary = {}
+    for r in records:
+        key = (r['stage'], r['label'])
+        s = summary.setdefault(key, {
+            'stage': r['stage'],
+            'label': r['label'],
+            'calls': 0,
+            'failed': 0,
+            'wall_s': 0.,
+            'cpu_s': 0.,
+            'peak_rss_mb': None,
+            'rows': None
+        })
+        s['calls'] += 1
+        s['failed'] += int(r['failed'])
+        s['wall_s'] += r['wall_s']
+        s['cpu_s'] += r['cpu_s']
+        if r['peak_rss_mb'] is not None:
+            s['peak_rss_mb'] = max(s['peak_rss_mb'] or 0, r['peak_rss_mb'])
+        if r['rows'] is not None:
+            s['rows'] = (s['rows'] or 0) + r['rows']
+    return sorted(summary.values(), key=lambda s: -s['wall_s'])
+
+
+def format_summary(records):
+    """Formats the summary of measurements as a text table
+
+    Parameters
+    ----------
+    records : list of dict
+        See read_log
+
+    Returns
+    -------
+    str
+    """
+    header = '{:<60} {:>5} {:>10} {:>10} {:>10} {:>12}'.format(
+        'Stage', 'Calls', 'Wall [s]', 'CPU [s]', 'Peak [MB]', 'Rows')
+    lines = [header, '-' * len(header)]
+    for s in summarize(records):
+        name = s['stage'] if s['label'] is None else s['label']
+        if s['failed']:
+            name += ' (failed)'
+        if len(name) > 60:
+            name = '...' + name[-57:]
+        lines.append('{:<60} {:>5} {:>10.1f} {:>10.1f} {:>10} {:>12}'.format(
+            name, s['calls'], s['wall_s'], s['cpu_s'],
+            '-' if s['peak_rss_mb'] is None else
+            '{:.0f}'.format(s['peak_rss_mb']),
+            '-' if s['rows'] is None else '{:,}'.format(s['rows'])))
+    return '\n'.join(lines)
@@ -0,0 +1,301 @@
+"""Contains functions to aggregate crimes to counts chunk by chunk.
+
+Together with iter_relevant_crimes in crime_database, this allows to
+compute the counts used for the figures without loading all crimes
+into memory at once.
+
+The crime counts per block and month of the estimation dataset are
+aggregated within the database (see count_block_months), such that
+only the counts are loaded into pandas."""
+import pandas as pd
+
+from .crime_database import (CRIME_CATEGORIES, VIOLENT_CRIME,
+                             crime_conditions, get_engine,
+                             iter_relevant_crimes, load_crimes)
+from .panel import PANEL_DTYPES, count_crimes_per_block_month, to_integer
+
+
+def count_chunk(df):
+    """Counts crimes of one chunk per hour, per year and per FBI code
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Crimes containing the columns 'Date', 'violent' and 'FBI Code'
+
+    Returns
+    -------
+    tuple of pd.Series
+        Counts per violent and hour, per violent and year
+        and per FBI code and year of violent crimes
+    """
+    hourly = df.groupby(['violent', df['Date'].dt.floor('H')]).size()
+    yearly = df.groupby(['violent', df['Date'].dt.year]).size()
+    violent = df[df['violent'] == 1]
+    yearly_fbi = violent.groupby(
+        ['FBI Code', violent['Date'].dt.year], observed=True).size()
+    return hourly, yearly, yearly_fbi
+
+
+def add_counts(total, counts):
+    """Adds counts of a chunk to the total counts
+
+    Parameters
+    ----------
+    total : pd.Series or None
+        Counts so far, None for the first chunk
+
+    counts : pd.Series
+        Counts of a chunk with the same index levels as total
+
+    Returns
+    -------
+    pd.Series
+        Sum of both counts
+    """
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0)
+
+
+def to_count_frame(counts):
+    """Converts counts to a dataframe with a column 'count'
+
+    Parameters
+    ----------
+    counts : pd.Series or None
+
+    Returns
+    -------
+    pd.DataFrame
+        Index levels as columns and integer column 'count'
+    """
+    return counts.sort_index().astype('int64').rename(
+        'count').reset_index()
+
+
+def fill_hours(hourly):
+    """Adds hours without any crimes with a count of zero
+
+    Same result as resample('1H') per crime category, i.e. hours between the
+    first and the last crime of each category are filled.
+
+    Parameters
+    ----------
+    hourly : pd.Series
+        Counts with index levels 'violent' and 'Date' (hour)
+
+    Returns
+    -------
+    pd.Series
+        Counts including all hours
+    """
+    filled = []
+    for violent, counts in hourly.groupby(level='violent'):
+        counts = counts.reset_index(level='violent', drop=True).sort_index()
+        hours = pd.date_range(counts.index[0], counts.index[-1], freq='H')
+        counts = counts.reindex(hours, fill_value=0)
+        counts.index = pd.MultiIndex.from_product(
+            [[violent], counts.index], names=['violent', 'Date'])
+        filled.append(counts)
+    return pd.concat(filled)
+
+
+def aggregate_crime_counts(chunks):
+    """Aggregates chunks of crimes to the counts used for the figures
+
+    Folds chunk after chunk into the counts, i.e. only one chunk has to be
+    in memory at a time. The results are the same as for the following
+    computations on a dataframe crimes containing all crimes:
+    * hourly: crimes.set_index('Date').groupby('violent').resample('1H')
+    * yearly: crimes.groupby(['violent', crimes['Date'].dt.year])
+    * yearly_violent_FBI: crimes.query('violent == 1')
+      .groupby(['FBI Code', crimes['Date'].dt.year])
+
+    Parameters
+    ----------
+    chunks : iterable of pd.DataFrame
+        Chunks of crimes containing the columns 'Date', 'violent'
+        and 'FBI Code', for example from iter_relevant_crimes
+
+    Returns
+    -------
+    dict of pd.DataFrame
+        Dataframes with a column 'count' and the keys
+        'hourly', 'yearly' and 'yearly_violent_FBI'
+
+    Example
+    -------
+    >>> counts = aggregate_crime_counts(
+            iter_relevant_crimes('2006-01-01', '2017-12-31',
+                                 columns=['Date', 'FBI Code'],
+                                 compact=True))
+    """
+    hourly, yearly, yearly_fbi = None, None, None
+    for df in chunks:
+        hourly_chunk, yearly_chunk, yearly_fbi_chunk = count_chunk(df)
+        hourly = add_counts(hourly, hourly_chunk)
+        yearly = add_counts(yearly, yearly_chunk)
+        yearly_fbi = add_counts(yearly_fbi, yearly_fbi_chunk)
+    assert hourly is not None, 'No crimes to aggregate'
+    return {
+        'hourly': to_count_frame(fill_hours(hourly)),
+        'yearly': to_count_frame(yearly),
+        'yearly_violent_FBI': to_count_frame(yearly_fbi)
+    }
+
+
+def count_block_months_sqlite(min_date, max_date, sqldb_path,
+                              school_times=True):
+    """Counts crimes per block and month with a single query
+
+    The crimes table is joined with the crimes_blocks table on the
+    indexed ID and grouped within SQLite.
+
+    Parameters
+    ----------
+    See count_block_months
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'tract_bloc', 'school_year', 'month' ('YYYY-MM'),
+        'violent_count' and 'property_count'
+    """
+    conditions, params = crime_conditions(
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=CRIME_CATEGORIES,
+        school_times=school_times,
+        table='c')
+    violent = ', '.join("'{}'".format(code) for code in VIOLENT_CRIME)
+    query_command = (
+        'SELECT b.tract_bloc AS tract_bloc, b.school_year AS school_year, '
+        'substr(c.Date, 1, 7) AS month, '
+        'SUM(c."FBI Code" IN ({0})) AS violent_count, '
+        'SUM(c."FBI Code" NOT IN ({0})) AS property_count '
+        'FROM crimes AS c JOIN crimes_blocks AS b ON c.ID = b.ID '
+        'WHERE {1} AND b.tract_bloc IS NOT NULL '
+        'AND b.school_year IS NOT NULL '
+        'GROUP BY b.tract_bloc, b.school_year, month'.format(
+            violent, ' AND '.join(conditions)))
+    # The engine creates the index on crimes_blocks if it is missing
+    return load_crimes(
+        query_command,
+        disk_engine=get_engine(str(sqldb_path)),
+        params=params)
+
+
+def count_block_months_parquet(min_date, max_date, sqldb_path,
+                               parquet_path, school_times=True,
+                               chunksize=500000):
+    """Counts crimes per block and month chunk by chunk
+
+    The crimes are read from the Parquet dataset, the blocks and school
+    years from the crimes_blocks table of the database.
+
+    Parameters
+    ----------
+    See count_block_months
+
+    Returns
+    -------
+    pd.DataFrame
+        See count_crimes_per_block_month
+    """
+    crimes_blocks = load_crimes(
+        'SELECT ID, tract_bloc, school_year FROM crimes_blocks '
+        'WHERE tract_bloc IS NOT NULL AND school_year IS NOT NULL',
+        sqldb_path=str(sqldb_path)).set_index('ID')
+    chunks = iter_relevant_crimes(
+        min_date,
+        max_date=max_date,
+        columns=['ID', 'Date'],
+        backend='parquet',
+        parquet_path=str(parquet_path),
+        chunksize=chunksize,
+        school_times=school_times)
+    # The counts of a chunk are much smaller than its crimes. They are
+    # summed up once at the end instead of being aligned chunk by chunk.
+    counts = [
+        count_crimes_per_block_month(
+            df.join(crimes_blocks, on='ID', how='inner')) for df in chunks
+    ]
+    assert counts, 'No crimes to aggregate'
+    return pd.concat(counts).groupby(
+        ['tract_bloc', 'school_year', 'Date']).sum().reset_index()
+
+
+def count_block_months(min_date,
+                       max_date=None,
+                       sqldb_path='data/processed/crimes.db',
+                       school_times=True,
+                       backend='sqlite',
+                       parquet_path='data/processed/crimes_parquet'):
+    """Counts violent and property crimes per block, school year and month
+
+    Same result as loading the relevant crimes, merging them with the
+    crimes_blocks table, dropping crimes without a block or school year,
+    keeping only crimes on weekdays within the school hours and applying
+    panel.count_crimes_per_block_month. However, the crimes are never
+    loaded into pandas at once.
+
+    Parameters
+    ----------
+    min_date : str, format = "YYYY-MM-DD"
+        Min date of the crimes
+
+    max_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Max date of the crimes, see crime_database.read_crimes
+
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to the SQLite database with the tables crimes and
+        crimes_blocks
+
+    school_times : boolean, optional (default=True)
+        If True, only counts crimes on weekdays within the school hours
+        (see crime_database.read_crimes)
+
+    backend : str, optional (default='sqlite')
+        'sqlite' aggregates with a single GROUP BY query in the
+        database. 'parquet' reads the crimes from the Parquet dataset in
+        parquet_path chunk by chunk.
+
+    parquet_path : str or pathlib.Path, optional
+        (default='data/processed/crimes_parquet')
+        Path to the Parquet dataset, only used by the Parquet backend
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'tract_bloc', 'school_year', 'Date' (end of month),
+        'violent_count' and 'property_count' with the dtypes of
+        panel.PANEL_DTYPES. Contains only months with at least one crime.
+    """
+    if backend == 'sqlite':
+        counts = count_block_months_sqlite(
+            min_date, max_date, sqldb_path, school_times=school_times)
+        counts['Date'] = (pd.to_datetime(counts.pop('month') + '-01') +
+                          pd.offsets.MonthEnd(0))
+    elif backend == 'parquet':
+        counts = count_block_months_parquet(
+            min_date,
+            max_date,
+            sqldb_path,
+            parquet_path,
+            school_times=school_times)
+    else:
+        raise ValueError(
+            "backend has to be 'sqlite' or 'parquet', got '{}'".format(
+                backend))
+
+    counts = counts[[
+        'tract_bloc', 'school_year', 'Date', 'violent_count', 'property_count'
+    ]].sort_values(['tract_bloc', 'school_year', 'Date'])
+    # crimes_blocks stores tract_bloc as FLOAT, i.e. float64, which holds
+    # the 10-digit identifiers exactly. They need int64 (PANEL_DTYPES).
+    for col in ['tract_bloc', 'violent_count', 'property_count']:
+        counts[col] = to_integer(counts[col], PANEL_DTYPES[col], col)
+    counts['school_year'] = counts['school_year'].astype('category')
+    return counts.reset_index(drop=True)
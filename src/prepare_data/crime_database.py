@@ -1,11 +1,303 @@
 """Contains various helper functions to load crimes from the SQL database."""
+import sqlite3
 from pathlib import Path
+from timeit import default_timer
 
 import pandas as pd
 from sqlalchemy import create_engine
 
+from ..instrument import instrument
+from .crime_parquet import iter_crimes_parquet, read_crimes_parquet
+from .school_years import SCHOOL_HOURS, tag_school_times
 
-def get_engine(sqldb_path='data/processed/crimes.db', wal=False):
+# FBI codes of the relevant categories
+VIOLENT_CRIME = {
+    '01A': 'Homicide 1st & 2nd Degree',
+    '02': 'Criminal Sexual Assault',
+    '03': 'Robbery',
+    '04A': 'Aggravated Assault',
+    '04B': 'Aggravated Battery'
+}
+PROPERTY_CRIME = {
+    '05': 'Burglary',
+    '06': 'Larceny',
+    '07': 'Motor Vehicle Theft',
+    '09': 'Arson'
+}
+CRIME_CATEGORIES = list(VIOLENT_CRIME.keys()) + list(PROPERTY_CRIME.keys())
+
+# Indexes on the crimes table as name: (columns, unique).
+# Dates are stored as ISO formatted text ('YYYY-MM-DD HH:MM:SS.ffffff'),
+# which sorts chronologically. Therefore, the composite index can be
+# used for the date range of each FBI code.
+CRIMES_INDEXES = {
+    'ix_crimes_id': (['ID'], True),
+    'ix_crimes_fbi_code_date': (['FBI Code', 'Date'], False),
+}
+
+# Indexes on the crimes_blocks table (block and school year of each
+# crime), used to join it with the crimes table
+CRIMES_BLOCKS_INDEXES = {
+    'ix_crimes_blocks_id': (['ID'], True),
+}
+
+# Columns of the crimes_blocks table: block, school year and distance in
+# meters to the nearest route of the school year (see
+# calculate.nearest_route.crime_route_distances) of each crime
+CRIMES_BLOCKS_COLUMNS = [
+    'ID', 'tract_bloc', 'school_year', 'route_distance', 'nearest_route'
+]
+
+# Columns which load_relevant_crimes can return
+RELEVANT_COLUMNS = [
+    'ID', 'Date', 'Longitude', 'Latitude', 'Primary Type', 'FBI Code'
+]
+
+
+def quote(name):
+    """Quotes a table or column name for the use in a SQL statement
+
+    Parameters
+    ----------
+    name : str
+        Name of table or column, e.g. 'FBI Code'
+
+    Returns
+    -------
+    str
+        Quoted name, e.g. '"FBI Code"'
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def df_to_rows(df, columns):
+    """Converts dataframe to rows of Python objects for executemany
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    columns : list of str
+        Columns in the order in which they should appear in the rows
+
+    Returns
+    -------
+    iterator of tuples
+        NaN values are written by SQLite as NULL
+    """
+    return zip(*(df[col].tolist() for col in columns))
+
+
+def primary_key(connectable, table):
+    """Columns of the primary key of a table
+
+    Parameters
+    ----------
+    connectable : SQLAlchemy engine or sqlite3.Connection
+
+    table : str
+
+    Returns
+    -------
+    list of str
+        Empty if the table has no explicit primary key
+    """
+    # Rows of table_info: cid, name, type, notnull, dflt_value, pk
+    columns = connectable.execute('PRAGMA table_info({})'.format(
+        quote(table))).fetchall()
+    return [row[1] for row in sorted(columns, key=lambda row: row[5])
+            if row[5] > 0]
+
+
+def create_crimes_indexes(connectable, table='crimes',
+                          indexes=CRIMES_INDEXES):
+    """Creates all indexes in CRIMES_INDEXES on the crimes table
+    if they do not exist yet
+
+    Unique indexes on the columns of the primary key are skipped, as
+    the primary key already is such an index.
+
+    Parameters
+    ----------
+    connectable : SQLAlchemy engine or sqlite3.Connection
+        Anything with an execute method which accepts a SQL string
+
+    table : str, optional (default='crimes')
+        Name of the table
+
+    indexes : dict, optional (default=CRIMES_INDEXES)
+        Indexes as name: (columns, unique)
+
+    Returns
+    -------
+    Nothing
+    """
+    key = primary_key(connectable, table)
+    for index_name, (columns, unique) in indexes.items():
+        if unique and list(columns) == key:
+            continue
+        connectable.execute(
+            'CREATE {}INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                'UNIQUE ' if unique else '', index_name, table, ', '.join(
+                    '"{}"'.format(col) for col in columns)))
+    return
+
+
+def sql_type(dtype):
+    """SQL type of a column of a dataframe
+
+    Parameters
+    ----------
+    dtype : numpy or pandas dtype
+
+    Returns
+    -------
+    str
+        Same types as in the crimes table, e.g. 'BIGINT' or 'TEXT'
+    """
+    return {
+        'i': 'BIGINT',
+        'u': 'BIGINT',
+        'f': 'FLOAT',
+        'b': 'BOOLEAN',
+        'M': 'DATETIME'
+    }.get(getattr(dtype, 'kind', 'O'), 'TEXT')
+
+
+def write_table(df,
+                table,
+                sqldb_path='data/processed/crimes.db',
+                primary_key_cols=None,
+                without_rowid=False,
+                indexes=None,
+                swap=True,
+                chunksize=500000,
+                cache_size_mb=512,
+                verbose=True):
+    """Writes a dataframe as a new table into the SQLite database,
+    e.g. the blocks and school years of the crimes (crimes_blocks)
+
+    An existing table is replaced. The rows are inserted with a prepared
+    statement and executemany inside of a single transaction, which is
+    a lot faster than the multi-row inserts of pd.DataFrame.to_sql.
+    Indexes are only created after all rows have been inserted.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Integer, float and boolean columns are stored as 'BIGINT',
+        'FLOAT' and 'BOOLEAN', datetimes as text in the format of
+        SQLAlchemy ('YYYY-MM-DD HH:MM:SS.ffffff') and all other columns
+        as 'TEXT'. The index is not written.
+
+    table : str
+        Name of the table
+
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to SQLite database
+
+    primary_key_cols : list of str, optional (default=None)
+        Columns of the primary key, e.g. ['ID']
+
+    without_rowid : boolean, optional (default=False)
+        If True, the table is created WITHOUT ROWID, i.e. the rows are
+        stored in the b-tree of the primary key. Saves the separate
+        index on the primary key and makes lookups by the key faster.
+        Needs primary_key_cols.
+
+    indexes : dict, optional (default=None)
+        Indexes as name: (columns, unique), e.g. CRIMES_BLOCKS_INDEXES.
+        See create_crimes_indexes.
+
+    swap : boolean, optional (default=True)
+        If True, the rows are first written into the staging table
+        '<table>_staging', which replaces the existing table in a short
+        second transaction. Until then, the existing table can still be
+        read and it is kept if writing the rows fails.
+
+    chunksize : int, optional (default=500000)
+        Number of rows which are converted and inserted at once
+
+    cache_size_mb : int, optional (default=512)
+        Size of SQLite page cache in megabytes
+
+    verbose : boolean, optional (default=True)
+        If True, prints the number of rows and the time
+
+    Returns
+    -------
+    int
+        Number of written rows
+
+    Raises
+    ------
+    ValueError
+        If without_rowid is True but no primary key is given
+    """
+    if without_rowid and not primary_key_cols:
+        raise ValueError('A WITHOUT ROWID table needs a primary key')
+    columns = list(df.columns)
+    definitions = [
+        '{} {}'.format(quote(col), sql_type(df[col].dtype))
+        for col in columns
+    ]
+    if primary_key_cols:
+        definitions.append('PRIMARY KEY ({})'.format(', '.join(
+            quote(col) for col in primary_key_cols)))
+    target = '{}_staging'.format(table) if swap else table
+    statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(target), ', '.join(quote(col) for col in columns),
+        ', '.join('?' * len(columns)))
+
+    start_time = default_timer()
+    if primary_key_cols:
+        # Rows in the order of the key are appended to the end of its
+        # b-tree instead of being inserted at random pages
+        df = df.sort_values(list(primary_key_cols), kind='mergesort')
+    con = sqlite3.connect(str(sqldb_path), isolation_level=None)
+    con.execute('PRAGMA temp_store = MEMORY')
+    # Negative values are interpreted by SQLite as size in kibibytes
+    con.execute('PRAGMA cache_size = {:d}'.format(-cache_size_mb * 1024))
+    try:
+        con.execute('BEGIN')
+        con.execute('DROP TABLE IF EXISTS {}'.format(quote(target)))
+        con.execute('CREATE TABLE {} ({}){}'.format(
+            quote(target), ', '.join(definitions),
+            ' WITHOUT ROWID' if without_rowid else ''))
+        for start in range(0, df.shape[0], chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            for col in columns:
+                if chunk[col].dtype.kind == 'M':
+                    chunk = chunk.assign(**{
+                        col: chunk[col].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+                    })
+            con.executemany(statement, df_to_rows(chunk, columns))
+        if swap:
+            con.execute('COMMIT')
+            con.execute('BEGIN')
+            con.execute('DROP TABLE IF EXISTS {}'.format(quote(table)))
+            con.execute('ALTER TABLE {} RENAME TO {}'.format(
+                quote(target), quote(table)))
+        if indexes:
+            create_crimes_indexes(con, table=table, indexes=indexes)
+        con.execute('COMMIT')
+    except BaseException:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    if verbose:
+        print('Rows written to {}: {:,} ({:.1f} seconds)'.format(
+            table, df.shape[0], default_timer() - start_time))
+    return df.shape[0]
+
+
+def get_engine(sqldb_path='data/processed/crimes.db',
+               wal=False,
+               create_indexes=True):
     """Sets up a SQL alchemy engine
 
     Creates a SQL alchemy engine and can set
@@ -22,6 +314,12 @@ def get_engine(sqldb_path='data/processed/crimes.db', wal=False):
         If True, write-ahead logging will be enabled
         to allow simultaneous read and write access on SQL database.
 
+    create_indexes : boolean, optional (default=True)
+        If True, creates the indexes of CRIMES_INDEXES on the crimes table
+        and of CRIMES_BLOCKS_INDEXES on the crimes_blocks table
+        should they not exist yet. This only takes time once
+        for a new database.
+
     Returns
     -------
     SQLAlchemy engine
@@ -34,21 +332,212 @@ def get_engine(sqldb_path='data/processed/crimes.db', wal=False):
         # Set journal_mode to write-ahead logging to allow for simultaneous
         # writing and reading access to database
         disk_engine.execute('PRAGMA journal_mode = wal')
+    if create_indexes and disk_engine.has_table('crimes'):
+        create_crimes_indexes(disk_engine)
+    if create_indexes and disk_engine.has_table('crimes_blocks'):
+        create_crimes_indexes(
+            disk_engine, table='crimes_blocks', indexes=CRIMES_BLOCKS_INDEXES)
     return disk_engine
 
 
+def crime_conditions(min_date=None,
+                     max_date=None,
+                     fbi_codes=None,
+                     school_times=False,
+                     table=None):
+    """Builds the conditions of a query on the crimes table
+
+    Parameters
+    ----------
+    min_date, max_date, fbi_codes, school_times
+        See read_crimes
+
+    table : str, optional (default=None)
+        Name or alias of the crimes table which is put in front of the
+        column names, e.g. in a join
+
+    Returns
+    -------
+    tuple of list of str and list
+        Conditions (all have to hold) and their bound parameters
+    """
+    prefix = '' if table is None else table + '.'
+    date = prefix + 'Date'
+    conditions = []
+    params = []
+    if fbi_codes is not None:
+        conditions.append('{}"FBI Code" IN ({})'.format(
+            prefix, ', '.join('?' * len(fbi_codes))))
+        params.extend(fbi_codes)
+    if min_date:
+        conditions.append('{} >= ?'.format(date))
+        params.append(min_date)
+    if max_date:
+        conditions.append('{} <= ?'.format(date))
+        params.append(max_date)
+    if school_times:
+        # Dates are stored as 'YYYY-MM-DD HH:MM:SS.ffffff'. For
+        # strftime, Sunday is 0 and Saturday is 6.
+        conditions.append('substr({}, 12, 8) BETWEEN ? AND ?'.format(date))
+        params.extend(SCHOOL_HOURS)
+        conditions.append("strftime('%w', {}) NOT IN ('0', '6')".format(date))
+    return conditions, params
+
+
+def read_crimes(columns=None,
+                min_date=None,
+                max_date=None,
+                fbi_codes=None,
+                backend='sqlite',
+                sqldb_path='data/processed/crimes.db',
+                parquet_path='data/processed/crimes_parquet',
+                chunksize=None,
+                disk_engine=None,
+                school_times=False,
+                **kwargs):
+    """Loads crimes filtered by date and FBI code from the chosen backend
+
+    Both backends return the same dataframe (up to the order of the rows).
+    For the SQLite backend, dates and FBI codes are passed to the query
+    as bound parameters such that SQLite can use the index
+    on ("FBI Code", Date). Dates are compared as ISO formatted text,
+    therefore min_date is inclusive and max_date effectively exclusive.
+    The Parquet backend only reads the needed partitions and columns.
+
+    Parameters
+    ----------
+    columns : list of str, optional (default=None)
+        Columns which should be loaded. Defaults to all columns.
+
+    min_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Min date which should be loaded
+
+    max_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Max date which should be loaded
+
+    fbi_codes : list of str, optional (default=None)
+        FBI codes which should be loaded. Defaults to all codes.
+
+    backend : str, optional (default='sqlite')
+        Either 'sqlite' to load from the SQLite database in sqldb_path or
+        'parquet' to load from the Parquet dataset in parquet_path
+        (see crime_parquet.export_crimes_to_parquet)
+
+    sqldb_path : str, optional (default='data/processed/crimes.db')
+        Path to SQL database, defaults to relative path
+        to crimes database from project root. Useful to change
+        for example when using Jupyter notebooks in other directories.
+
+    parquet_path : str, optional (default='data/processed/crimes_parquet')
+        Path to Parquet dataset, defaults to relative path from project root
+
+    chunksize : int, optional (default=None)
+        If specified, return an iterator where chunksize
+        is the number of rows to include in each chunk.
+        For the Parquet backend, each chunk contains the crimes
+        of one file of the dataset instead.
+
+    disk_engine : SQLAlchemy engine, optional (default=None)
+        Engine to use instead of creating a new one from sqldb_path
+
+    school_times : boolean, optional (default=False)
+        If True, only loads crimes on weekdays within the school hours
+        (see school_years.SCHOOL_HOURS). For the SQLite backend, the
+        condition is part of the query and other crimes are never
+        loaded. Fractions of seconds are ignored there, which does not
+        matter for the crimes, as they are recorded to the minute.
+
+    kwargs : keyword arguments, optional
+        Further keyword arguments directly passed on to pd.read_sql_query call
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe containing loaded crimes
+    """
+    if backend == 'parquet':
+        if chunksize:
+            read_parquet = iter_crimes_parquet
+        else:
+            read_parquet = read_crimes_parquet
+        read_columns = columns
+        if school_times and columns is not None and 'Date' not in columns:
+            read_columns = list(columns) + ['Date']
+        crimes = read_parquet(
+            parquet_path,
+            columns=read_columns,
+            min_date=min_date,
+            max_date=max_date,
+            fbi_codes=fbi_codes)
+        if not school_times:
+            return crimes
+        if chunksize:
+            return (filter_school_times(df, columns) for df in crimes)
+        return filter_school_times(crimes, columns)
+    elif backend != 'sqlite':
+        raise ValueError(
+            "backend has to be 'sqlite' or 'parquet', got '{}'".format(
+                backend))
+
+    conditions, params = crime_conditions(
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=fbi_codes,
+        school_times=school_times)
+    query_command = 'SELECT {} FROM crimes'.format(
+        ', '.join('"{}"'.format(col)
+                  for col in columns) if columns is not None else '*')
+    if conditions:
+        query_command += ' WHERE ' + ' AND '.join(conditions)
+    return load_crimes(
+        query_command,
+        sqldb_path=sqldb_path,
+        chunksize=chunksize,
+        disk_engine=disk_engine,
+        params=params,
+        **kwargs)
+
+
+def filter_school_times(df, columns=None):
+    """Keeps crimes on weekdays within the school hours
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Crimes with column 'Date'
+
+    columns : list of str, optional (default=None)
+        Columns which should be returned, defaults to all
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    school_times = tag_school_times(df['Date'])
+    df = df[(school_times['school_hours'] & school_times['weekday']).values]
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+@instrument
 def load_relevant_crimes(min_date,
                          max_date=None,
                          sqldb_path='data/processed/crimes.db',
                          chunksize=None,
                          disk_engine=None,
+                         columns=None,
+                         compact=False,
+                         backend='sqlite',
+                         parquet_path='data/processed/crimes_parquet',
+                         school_times=False,
                          **kwargs):
     """Loads relevant violent and property crimes
 
-    Wrapper around load_crimes which only loads violent and property crimes.
+    Wrapper around read_crimes which only loads violent and property crimes.
     Furthermore this function provides an easier interface to load
-    relevant columns. If add_violent_col is True an additional column is
-    added to the returned dataset with a dummy which is 1 for a violent crime
+    relevant columns. An additional column 'violent' is added to the
+    returned dataset with a dummy which is 1 for a violent crime
     and 0 for a property crime.
 
     Parameters
@@ -65,58 +554,184 @@ def load_relevant_crimes(min_date,
         for example when using Jupyter notebooks in other directories.
 
     chunksize : int, optional (default=None)
-        If specified, return an iterator where chunksize
-        is the number of rows to include in each chunk.
+        If specified, return a generator where chunksize
+        is the number of rows to include in each chunk
+        (see iter_relevant_crimes).
+
+    disk_engine : SQLAlchemy engine, optional (default=None)
+        Engine to use instead of creating a new one from sqldb_path
+
+    columns : list of str, optional (default=None)
+        Columns out of RELEVANT_COLUMNS which should be loaded.
+        Defaults to all of them. 'FBI Code' is always loaded
+        as it is needed for the 'violent' column.
+
+    compact : boolean, optional (default=False)
+        If True, uses compact dtypes: 'FBI Code' as categorical,
+        coordinates as float32, 'ID' as int32 and 'violent' as int8.
+
+    backend : str, optional (default='sqlite')
+        Either 'sqlite' or 'parquet', see read_crimes
+
+    parquet_path : str, optional (default='data/processed/crimes_parquet')
+        Path to Parquet dataset, only used by the Parquet backend
+
+    school_times : boolean, optional (default=False)
+        If True, only loads crimes on weekdays within the school hours,
+        see read_crimes
 
     kwargs : keyword arguments, optional
         Further keyword arguments directly passed on to pd.read_sql_query call
 
     Returns
     -------
-    pd.DataFrame
+    pd.DataFrame or generator of pd.DataFrame
         Dataframe containing loaded crimes
     """
-    # FBI codes of the relevant categories
-    violent_crime = {
-        '01A': 'Homicide 1st & 2nd Degree',
-        '02': 'Criminal Sexual Assault',
-        '03': 'Robbery',
-        '04A': 'Aggravated Assault',
-        '04B': 'Aggravated Battery'
-    }
-    property_crime = {
-        '05': 'Burglary',
-        '06': 'Larceny',
-        '07': 'Motor Vehicle Theft',
-        '09': 'Arson'
-    }
-
-    crime_categories = list(violent_crime.keys()) + list(property_crime.keys())
-
-    if max_date:
-        df = load_crimes(
-            """SELECT ID, Date, Longitude, Latitude, "Primary Type", "FBI Code"
-        FROM crimes
-        WHERE "FBI Code" IN {}
-        AND Date BETWEEN "{}" and "{}"
-        """.format(tuple(crime_categories), min_date, max_date),
+    if chunksize:
+        return iter_relevant_crimes(
+            min_date,
+            max_date=max_date,
             sqldb_path=sqldb_path,
             chunksize=chunksize,
+            disk_engine=disk_engine,
+            columns=columns,
+            compact=compact,
+            backend=backend,
+            parquet_path=parquet_path,
+            school_times=school_times,
             **kwargs)
-    else:
-        df = load_crimes(
-            """SELECT ID, Date, Longitude, Latitude, "Primary Type", "FBI Code"
-        FROM crimes
-        WHERE "FBI Code" IN {}
-        AND Date >= "{}"
-        """.format(tuple(crime_categories), min_date),
-            sqldb_path=sqldb_path,
-            chunksize=chunksize,
-            **kwargs)
-    df['violent'] = df['FBI Code'].isin(list(violent_crime.keys())) * 1
+
+    df = read_crimes(
+        columns=relevant_columns(columns),
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=CRIME_CATEGORIES,
+        backend=backend,
+        sqldb_path=sqldb_path,
+        parquet_path=parquet_path,
+        disk_engine=disk_engine,
+        school_times=school_times,
+        **kwargs)
+    return add_violent_col(df, compact=compact)
+
+
+@instrument
+def iter_relevant_crimes(min_date,
+                         max_date=None,
+                         sqldb_path='data/processed/crimes.db',
+                         chunksize=500000,
+                         disk_engine=None,
+                         columns=None,
+                         compact=False,
+                         backend='sqlite',
+                         parquet_path='data/processed/crimes_parquet',
+                         school_times=False,
+                         **kwargs):
+    """Loads relevant violent and property crimes chunk by chunk
+
+    Streaming version of load_relevant_crimes. Each chunk contains the
+    parsed dates, the 'violent' column and only the given columns,
+    optionally with compact dtypes. Only one chunk is kept in memory at
+    a time, which allows to process all crimes with a fixed memory budget,
+    for example with the functions in crime_counts.
+
+    Parameters
+    ----------
+    See load_relevant_crimes. For the Parquet backend, each chunk contains
+    the crimes of one file of the dataset instead of chunksize rows.
+
+    Yields
+    ------
+    pd.DataFrame
+        Chunk of crimes
+    """
+    chunks = read_crimes(
+        columns=relevant_columns(columns),
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=CRIME_CATEGORIES,
+        backend=backend,
+        sqldb_path=sqldb_path,
+        parquet_path=parquet_path,
+        chunksize=chunksize,
+        disk_engine=disk_engine,
+        school_times=school_times,
+        **kwargs)
+    for df in chunks:
+        yield add_violent_col(df, compact=compact)
+
+
+def relevant_columns(columns=None):
+    """Checks columns for load_relevant_crimes and adds 'FBI Code'
+
+    Parameters
+    ----------
+    columns : list of str, optional (default=None)
+        Columns out of RELEVANT_COLUMNS. Defaults to all of them.
+
+    Returns
+    -------
+    list of str
+        Columns which have to be loaded
+    """
+    if columns is None:
+        columns = RELEVANT_COLUMNS
+    assert set(columns) <= set(RELEVANT_COLUMNS)
+    if 'FBI Code' not in columns:
+        columns = list(columns) + ['FBI Code']
+    return columns
+
+
+def add_violent_col(df, compact=False):
+    """Adds dummy column 'violent' which is 1 for violent
+    and 0 for property crimes
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Crimes containing column 'FBI Code'
+
+    compact : boolean, optional (default=False)
+        If True, converts columns to compact dtypes (see compact_crimes)
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    df['violent'] = df['FBI Code'].isin(list(VIOLENT_CRIME.keys())) * 1
+    if compact:
+        df = compact_crimes(df)
     return df
 
 
+def compact_crimes(df):
+    """Converts columns of loaded crimes to compact dtypes
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Crimes as returned by load_relevant_crimes
+
+    Returns
+    -------
+    pd.DataFrame
+        Same dataframe with compact dtypes
+    """
+    dtypes = {
+        'ID': 'int32',
+        'Longitude': 'float32',
+        'Latitude': 'float32',
+        'violent': 'int8',
+        'FBI Code': pd.api.types.CategoricalDtype(CRIME_CATEGORIES),
+        'Primary Type': 'category'
+    }
+    return df.astype({
+        col: dtype
+        for col, dtype in dtypes.items() if col in df.columns
+    })
+
+
 def load_crimes(query_command,
                 sqldb_path='data/processed/crimes.db',
                 chunksize=None,
@@ -0,0 +1,560 @@
+"""Contains functions to bulk load the raw crimes .csv file
+into the SQLite database and to update the database incrementally
+with a newer .csv file."""
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from timeit import default_timer
+
+import pandas as pd
+
+from ..calculate.nearest_route import crime_route_distances
+from .crime_database import (CRIME_CATEGORIES, CRIMES_BLOCKS_COLUMNS,
+                             CRIMES_BLOCKS_INDEXES, create_crimes_indexes,
+                             df_to_rows, load_crimes, quote)
+from .school_years import assign_school_years
+
+# Columns of the crimes table and their SQL types in the order
+# of the .csv file. 'Case Number', 'X Coordinate' and 'Y Coordinate'
+# are not loaded into the database.
+CRIMES_COLUMNS = [
+    ('ID', 'BIGINT'),
+    ('Date', 'DATETIME'),
+    ('Block', 'TEXT'),
+    ('IUCR', 'TEXT'),
+    ('Primary Type', 'TEXT'),
+    ('Description', 'TEXT'),
+    ('Location Description', 'TEXT'),
+    ('Arrest', 'BOOLEAN'),
+    ('Domestic', 'BOOLEAN'),
+    ('Beat', 'BIGINT'),
+    ('District', 'FLOAT'),
+    ('Ward', 'FLOAT'),
+    ('Community Area', 'FLOAT'),
+    ('FBI Code', 'TEXT'),
+    ('Year', 'BIGINT'),
+    ('Updated On', 'TEXT'),
+    ('Latitude', 'FLOAT'),
+    ('Longitude', 'FLOAT'),
+    ('Location', 'TEXT'),
+]
+
+# Explicit dtypes for pd.read_csv. Saves pandas the type inference
+# and keeps codes such as IUCR or FBI Code as strings
+CSV_DTYPES = {
+    'ID': 'int64',
+    'Date': 'object',
+    'Block': 'object',
+    'IUCR': 'object',
+    'Primary Type': 'object',
+    'Description': 'object',
+    'Location Description': 'object',
+    'Arrest': 'bool',
+    'Domestic': 'bool',
+    'Beat': 'int64',
+    'District': 'float64',
+    'Ward': 'float64',
+    'Community Area': 'float64',
+    'FBI Code': 'object',
+    'Year': 'int64',
+    'Updated On': 'object',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+    'Location': 'object',
+}
+
+# Converts a date of the .csv file ('MM/DD/YYYY HH:MM:SS AM') into the
+# format in which SQLAlchemy stores datetimes ('YYYY-MM-DD HH:MM:SS.ffffff'),
+# which is the format expected by load_crimes. Done by SQLite during the
+# insert as this is a lot faster than parsing the dates with pandas.
+# {0} is replaced by the (numbered) SQL parameter which holds the date.
+SQL_PARSE_DATE = (
+    "substr({0}, 7, 4) || '-' || substr({0}, 1, 2) || '-' || substr({0}, 4, 2)"
+    " || ' ' || printf('%02d', substr({0}, 12, 2) % 12"
+    " + CASE substr({0}, 21, 2) WHEN 'PM' THEN 12 ELSE 0 END)"
+    " || substr({0}, 14, 6) || '.000000'")
+
+# Table which records every load or update of the crimes table including
+# the latest 'Updated On' timestamp of all loaded crimes (the watermark)
+UPDATES_TABLE = 'crimes_updates'
+
+# Table with the IDs of the crimes which were new or changed
+# in the latest update
+CHANGED_TABLE = 'crimes_changed'
+
+
+def connect_for_bulk_load(sqldb_path, cache_size_mb=512):
+    """Opens a connection to a SQLite database tuned for bulk loading
+
+    Keeps the rollback journal in memory, turns off the syncs to disk and
+    increases the page cache. A failed transaction can still be rolled
+    back, but if the process crashes during a load, the database can be
+    corrupt and has to be rebuilt from the .csv file.
+
+    Parameters
+    ----------
+    sqldb_path : str or pathlib.Path
+        Path to SQLite database. Will be created if it does not exist.
+
+    cache_size_mb : int, optional (default=512)
+        Size of SQLite page cache in megabytes
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection in autocommit mode, transactions have to be
+        started explicitly with 'BEGIN'
+    """
+    con = sqlite3.connect(str(sqldb_path), isolation_level=None)
+    con.execute('PRAGMA synchronous = OFF')
+    con.execute('PRAGMA journal_mode = MEMORY')
+    con.execute('PRAGMA locking_mode = EXCLUSIVE')
+    con.execute('PRAGMA temp_store = MEMORY')
+    # Negative values are interpreted by SQLite as size in kibibytes
+    con.execute('PRAGMA cache_size = {:d}'.format(-cache_size_mb * 1024))
+    return con
+
+
+def create_crimes_table(con, table='crimes', temporary=False):
+    """Creates the crimes table if it does not exist yet
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+
+    table : str, optional (default='crimes')
+        Name of the table
+
+    temporary : boolean, optional (default=False)
+        If True, a temporary table is created which is dropped
+        when the connection is closed
+
+    Returns
+    -------
+    Nothing
+    """
+    columns = ', '.join(
+        '{} {}'.format(quote(col), sql_type)
+        for col, sql_type in CRIMES_COLUMNS)
+    con.execute('CREATE {}TABLE IF NOT EXISTS {} ({})'.format(
+        'TEMP ' if temporary else '', quote(table), columns))
+    return
+
+
+def read_crimes_csv(csv_path, chunksize=500000):
+    """Reads the raw crimes .csv file in chunks with explicit dtypes
+
+    Parameters
+    ----------
+    csv_path : str or pathlib.Path
+        Path to .csv file containing all crimes
+
+    chunksize : int, optional (default=500000)
+        Number of rows per chunk
+
+    Returns
+    -------
+    iterator of pd.DataFrame
+        Chunks with the columns of CRIMES_COLUMNS, dates are
+        not yet parsed
+    """
+    columns = [col for col, _ in CRIMES_COLUMNS]
+    return pd.read_csv(
+        csv_path,
+        usecols=columns,
+        dtype=CSV_DTYPES,
+        chunksize=chunksize,
+        iterator=True)
+
+
+def insert_statement(table='crimes'):
+    """Builds the INSERT statement for rows of the crimes .csv file
+
+    The date column is converted by SQLite using SQL_PARSE_DATE.
+
+    Parameters
+    ----------
+    table : str, optional (default='crimes')
+        Name of the table into which the rows are inserted
+
+    Returns
+    -------
+    str
+        Statement with numbered parameters
+    """
+    columns = [col for col, _ in CRIMES_COLUMNS]
+    values = [
+        SQL_PARSE_DATE.format('?{}'.format(i + 1))
+        if col == 'Date' else '?{}'.format(i + 1)
+        for i, col in enumerate(columns)
+    ]
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(table), ', '.join(quote(col) for col in columns),
+        ', '.join(values))
+
+
+def load_crimes_csv(csv_path,
+                    sqldb_path='data/processed/crimes.db',
+                    chunksize=500000,
+                    replace=True,
+                    cache_size_mb=512,
+                    verbose=True):
+    """Bulk loads the raw crimes .csv file into the SQLite database
+
+    Streams the .csv file once and inserts all rows with executemany
+    inside of a single transaction. Indexes are only created after all
+    rows have been inserted (see CRIMES_INDEXES in crime_database).
+    If the load fails, a database which was created by it is deleted.
+    Rows appended to an existing database are rolled back.
+
+    Parameters
+    ----------
+    csv_path : str or pathlib.Path
+        Path to .csv file containing all crimes
+
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to SQLite database, defaults to relative path
+        to crimes database from project root.
+
+    chunksize : int, optional (default=500000)
+        Number of rows which are read and inserted at once
+
+    replace : boolean, optional (default=True)
+        If True, an existing database is deleted first.
+        Else, the rows are appended to the existing crimes table.
+
+    cache_size_mb : int, optional (default=512)
+        Size of SQLite page cache in megabytes
+
+    verbose : boolean, optional (default=True)
+        If True, prints the progress in rows per second
+
+    Returns
+    -------
+    int
+        Number of loaded rows
+    """
+    sqldb_path = Path(sqldb_path)
+    if replace and sqldb_path.is_file():
+        sqldb_path.unlink()
+    created = not sqldb_path.is_file()
+
+    con = connect_for_bulk_load(sqldb_path, cache_size_mb=cache_size_mb)
+    columns = [col for col, _ in CRIMES_COLUMNS]
+    statement = insert_statement()
+    start_time = default_timer()
+    nrows_processed = 0
+    try:
+        con.execute('BEGIN')
+        create_crimes_table(con)
+        for df in read_crimes_csv(csv_path, chunksize=chunksize):
+            con.executemany(statement, df_to_rows(df, columns))
+            nrows_processed += len(df)
+            if verbose:
+                seconds = default_timer() - start_time
+                print(
+                    '{:.0f} seconds passed: completed {:,} rows '
+                    '({:,.0f} rows/s)'.format(seconds, nrows_processed,
+                                              nrows_processed / seconds),
+                    end='\r',
+                    flush=True)
+        record_update(con, csv_path, nrows_processed, nrows_processed,
+                      'crimes')
+        con.execute('COMMIT')
+        if verbose:
+            print('\nCreate indexes')
+        create_crimes_indexes(con)
+    except BaseException:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        con.close()
+        # Only a complete database can be used by the later notebooks
+        if created:
+            sqldb_path.unlink()
+        raise
+    finally:
+        con.close()
+
+    if verbose:
+        print('Total time: {:.0f} seconds'.format(default_timer() -
+                                                  start_time))
+        print('Rows processed: {:,}'.format(nrows_processed))
+    return nrows_processed
+
+
+def get_watermark(con):
+    """Reads the latest 'Updated On' timestamp of all loaded crimes
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+
+    Returns
+    -------
+    pd.Timestamp or None
+        None if no load or update has been recorded yet
+    """
+    exists = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        [UPDATES_TABLE]).fetchone()
+    if exists is None:
+        return None
+    watermark = con.execute('SELECT max(max_updated_on) FROM {}'.format(
+        UPDATES_TABLE)).fetchone()[0]
+    return pd.Timestamp(watermark) if watermark is not None else None
+
+
+def record_update(con, csv_path, nrows_read, nrows_upserted, table):
+    """Records a load or update of the crimes table in UPDATES_TABLE
+
+    The watermark is the latest 'Updated On' timestamp of the rows of
+    the given table (the crimes table or the staging table of an update)
+    or the previous watermark if it is later.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+
+    csv_path : str or pathlib.Path
+        Path to .csv file which was loaded
+
+    nrows_read : int
+        Number of rows which were read from the .csv file
+
+    nrows_upserted : int
+        Number of rows which were inserted or replaced
+
+    table : str
+        Table which contains the loaded rows
+
+    Returns
+    -------
+    Nothing
+    """
+    con.execute('CREATE TABLE IF NOT EXISTS {} (load_time TEXT, '
+                'csv_path TEXT, max_updated_on TEXT, nrows_read BIGINT, '
+                'nrows_upserted BIGINT)'.format(UPDATES_TABLE))
+    max_updated_on = con.execute('SELECT max({}) FROM {}'.format(
+        SQL_PARSE_DATE.format(quote('Updated On')),
+        quote(table))).fetchone()[0]
+    previous = get_watermark(con)
+    if max_updated_on is None or (
+            previous is not None and previous > pd.Timestamp(max_updated_on)):
+        max_updated_on = (previous.strftime('%Y-%m-%d %H:%M:%S.%f')
+                          if previous is not None else None)
+    con.execute(
+        'INSERT INTO {} VALUES (?, ?, ?, ?, ?)'.format(UPDATES_TABLE), [
+            datetime.now().isoformat(sep=' '),
+            str(csv_path), max_updated_on, nrows_read, nrows_upserted
+        ])
+    return
+
+
+def parse_updated_on(updated_on):
+    """Parses the 'Updated On' column of the crimes .csv file
+
+    Parameters
+    ----------
+    updated_on : pd.Series of str
+        Format 'MM/DD/YYYY HH:MM:SS AM'
+
+    Returns
+    -------
+    pd.Series of datetimes
+    """
+    return pd.to_datetime(updated_on, format='%m/%d/%Y %I:%M:%S %p')
+
+
+def update_crimes_csv(csv_path,
+                      sqldb_path='data/processed/crimes.db',
+                      chunksize=500000,
+                      use_watermark=True,
+                      cache_size_mb=512,
+                      verbose=True):
+    """Inserts new and replaces changed crimes of a .csv file
+    in the existing SQLite database
+
+    A crime is identified by its 'ID' and has changed if its
+    'Updated On' value differs from the one in the database. The rows
+    are first loaded into a temporary staging table and then upserted
+    within one transaction. The IDs of all new and changed crimes are
+    stored in the table CHANGED_TABLE, such that only for these crimes
+    blocks and school years have to be assigned (see update_crimes_blocks).
+
+    Parameters
+    ----------
+    csv_path : str or pathlib.Path
+        Path to .csv file containing all crimes or only recent ones
+
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to SQLite database
+
+    chunksize : int, optional (default=500000)
+        Number of rows which are read at once
+
+    use_watermark : boolean, optional (default=True)
+        If True, rows which were updated before the watermark of the
+        previous load are skipped without comparing them to the database.
+        Assumes that the .csv files are complete extracts, i.e. that such
+        rows have already been loaded before.
+
+    cache_size_mb : int, optional (default=512)
+        Size of SQLite page cache in megabytes
+
+    verbose : boolean, optional (default=True)
+        If True, prints the number of new and changed crimes
+
+    Returns
+    -------
+    int
+        Number of new and changed crimes
+    """
+    sqldb_path = Path(sqldb_path)
+    assert sqldb_path.is_file(), 'Database does not exist, use load_crimes_csv'
+
+    # Journal and syncs stay turned on as the existing database
+    # must not get corrupted
+    con = sqlite3.connect(str(sqldb_path), isolation_level=None)
+    con.execute('PRAGMA temp_store = MEMORY')
+    con.execute('PRAGMA cache_size = {:d}'.format(-cache_size_mb * 1024))
+    columns = [col for col, _ in CRIMES_COLUMNS]
+    statement = insert_statement('crimes_staging')
+    start_time = default_timer()
+    nrows_read = 0
+    try:
+        watermark = get_watermark(con) if use_watermark else None
+        con.execute('BEGIN')
+        create_crimes_table(con)
+        # The unique index on ID is needed for INSERT OR REPLACE
+        create_crimes_indexes(con)
+        create_crimes_table(con, 'crimes_staging', temporary=True)
+        for df in read_crimes_csv(csv_path, chunksize=chunksize):
+            nrows_read += len(df)
+            if watermark is not None:
+                df = df[(parse_updated_on(df['Updated On']) >
+                         watermark).values]
+            con.executemany(statement, df_to_rows(df, columns))
+
+        con.execute('DROP TABLE IF EXISTS {}'.format(CHANGED_TABLE))
+        con.execute('CREATE TABLE {} (ID BIGINT PRIMARY KEY)'.format(
+            CHANGED_TABLE))
+        con.execute('INSERT OR IGNORE INTO {} SELECT s.ID '
+                    'FROM crimes_staging AS s '
+                    'LEFT JOIN crimes AS c ON c.ID = s.ID '
+                    'WHERE c.ID IS NULL '
+                    'OR c."Updated On" IS NOT s."Updated On"'.format(
+                        CHANGED_TABLE))
+        nrows_changed = con.execute('SELECT count(*) FROM {}'.format(
+            CHANGED_TABLE)).fetchone()[0]
+        con.execute(
+            'INSERT OR REPLACE INTO crimes ({0}) SELECT {0} '
+            'FROM crimes_staging WHERE ID IN (SELECT ID FROM {1})'.format(
+                ', '.join(quote(col) for col in columns), CHANGED_TABLE))
+        record_update(con, csv_path, nrows_read, nrows_changed,
+                      'crimes_staging')
+        con.execute('COMMIT')
+    except BaseException:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    if verbose:
+        print('Rows read: {:,}'.format(nrows_read))
+        print('New or changed crimes: {:,}'.format(nrows_changed))
+        print('Total time: {:.0f} seconds'.format(default_timer() -
+                                                  start_time))
+    return nrows_changed
+
+
+def update_crimes_blocks(block_index,
+                         route_index,
+                         sqldb_path='data/processed/crimes.db',
+                         min_date='2006-01-01',
+                         max_date='2016-06-30',
+                         sy_range=None,
+                         verbose=True):
+    """Assigns blocks, school years and the distance to the nearest route
+    to the crimes of the latest update and replaces them in the
+    crimes_blocks table
+
+    Same steps as in the crimes-blocks notebook, but only for the
+    crimes in CHANGED_TABLE (see update_crimes_csv).
+
+    Parameters
+    ----------
+    block_index : BlockIndex
+        Index of all blocks, see calculate.block_index
+
+    route_index : RouteIndex
+        Index of the routes, see calculate.nearest_route
+
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to SQLite database
+
+    min_date : str, format = "YYYY-MM-DD", optional (default='2006-01-01')
+        Min date of crimes which are matched to blocks
+
+    max_date : str, format = "YYYY-MM-DD", optional (default='2016-06-30')
+        Max date of crimes which are matched to blocks
+
+    sy_range : dict, optional (default=None)
+        See school_years.assign_school_years
+
+    verbose : boolean, optional (default=True)
+        If True, prints the number of updated rows
+
+    Returns
+    -------
+    int
+        Number of rows inserted into crimes_blocks
+    """
+    crimes = load_crimes(
+        'SELECT c.ID, c.Date, c.Longitude, c.Latitude FROM crimes AS c '
+        'JOIN {} AS u ON c.ID = u.ID '
+        'WHERE c."FBI Code" IN ({}) AND c.Date >= ? AND c.Date <= ?'.format(
+            CHANGED_TABLE, ', '.join('?' * len(CRIME_CATEGORIES))),
+        sqldb_path=str(sqldb_path),
+        params=CRIME_CATEGORIES + [min_date, max_date])
+    crimes = crimes.dropna(subset=['Longitude', 'Latitude'])
+    crimes = crimes.reset_index(drop=True)
+    crimes['tract_bloc'] = block_index.query_points(
+        crimes['Longitude'].values, crimes['Latitude'].values,
+        verbose=verbose)
+    crimes = crimes.dropna(subset=['tract_bloc'])
+    crimes['school_year'] = assign_school_years(crimes['Date'], sy_range)
+    crimes = crimes.join(crime_route_distances(crimes, route_index))
+
+    con = sqlite3.connect(str(sqldb_path), isolation_level=None)
+    try:
+        con.execute('BEGIN')
+        con.execute('CREATE TABLE IF NOT EXISTS crimes_blocks '
+                    '(ID BIGINT, tract_bloc FLOAT, school_year TEXT, '
+                    'route_distance FLOAT, nearest_route FLOAT, '
+                    'PRIMARY KEY (ID)) WITHOUT ROWID')
+        create_crimes_indexes(
+            con, table='crimes_blocks', indexes=CRIMES_BLOCKS_INDEXES)
+        # Changed crimes can be irrelevant now or outside of all blocks
+        con.execute(
+            'DELETE FROM crimes_blocks WHERE ID IN (SELECT ID FROM {})'.
+            format(CHANGED_TABLE))
+        con.executemany(
+            'INSERT INTO crimes_blocks ({}) VALUES ({})'.format(
+                ', '.join(CRIMES_BLOCKS_COLUMNS),
+                ', '.join('?' * len(CRIMES_BLOCKS_COLUMNS))),
+            df_to_rows(crimes, CRIMES_BLOCKS_COLUMNS))
+        con.execute('COMMIT')
+    except BaseException:
+        if con.in_transaction:
+            con.execute('ROLLBACK')
+        raise
+    finally:
+        con.close()
+
+    if verbose:
+        print('Rows updated in crimes_blocks: {:,}'.format(len(crimes)))
+    return len(crimes)
@@ -0,0 +1,293 @@
+"""Contains functions to store crimes in a Parquet dataset and to load them
+from it. This is a columnar alternative to the crimes table in the
+SQLite database.
+
+The dataset is partitioned by year and FBI code with one folder
+per partition, e.g. 'year=2006/fbi_code=01A/part-0.parquet'.
+Requires the pyarrow package."""
+import re
+from pathlib import Path
+
+import pandas as pd
+
+# Name of the partition folders
+PARTITION_FORMAT = 'year={year}/fbi_code={fbi_code}'
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/fbi_code=([^/]+)$')
+
+
+def import_pyarrow():
+    """Imports pyarrow and pyarrow.parquet
+
+    Returns
+    -------
+    tuple of modules
+        pyarrow, pyarrow.parquet
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('The Parquet backend requires the package pyarrow. '
+                          'Install it with "conda install pyarrow".')
+    return pa, pq
+
+
+def export_crimes_to_parquet(sqldb_path='data/processed/crimes.db',
+                             parquet_path='data/processed/crimes_parquet',
+                             chunksize=500000,
+                             verbose=True):
+    """Exports the crimes table of the SQLite database to a Parquet dataset
+    partitioned by year and FBI code
+
+    Reads the crimes of one FBI code after another using the index
+    on ("FBI Code", Date) and writes them into one folder per year
+    and FBI code. Dates are stored as timestamps.
+
+    Parameters
+    ----------
+    sqldb_path : str or pathlib.Path, optional
+        (default='data/processed/crimes.db')
+        Path to SQLite database containing the crimes table
+
+    parquet_path : str or pathlib.Path, optional
+        (default='data/processed/crimes_parquet')
+        Folder of the Parquet dataset. Has to be empty or not existing.
+
+    chunksize : int, optional (default=500000)
+        Number of rows which are read from the database at once
+
+    verbose : boolean, optional (default=True)
+        If True, prints the FBI code which is currently exported
+
+    Returns
+    -------
+    int
+        Number of exported rows
+    """
+    # Imported here to avoid a circular import
+    from .crime_database import get_engine, load_crimes
+
+    pa, pq = import_pyarrow()
+    parquet_path = Path(parquet_path)
+    assert not parquet_path.exists() or not any(parquet_path.iterdir())
+
+    disk_engine = get_engine(str(sqldb_path))
+    fbi_codes = load_crimes(
+        'SELECT DISTINCT "FBI Code" FROM crimes ORDER BY "FBI Code"',
+        disk_engine=disk_engine)['FBI Code'].dropna().tolist()
+
+    nrows_exported = 0
+    for fbi_code in fbi_codes:
+        if verbose:
+            print('Export FBI code {}'.format(fbi_code), end='\r', flush=True)
+        chunks = load_crimes(
+            'SELECT * FROM crimes WHERE "FBI Code" = ?',
+            disk_engine=disk_engine,
+            chunksize=chunksize,
+            params=[fbi_code])
+        for i, df in enumerate(chunks):
+            for year, df_year in df.groupby(df['Date'].dt.year):
+                partition = parquet_path / PARTITION_FORMAT.format(
+                    year=year, fbi_code=fbi_code)
+                partition.mkdir(parents=True, exist_ok=True)
+                table = pa.Table.from_pandas(df_year, preserve_index=False)
+                pq.write_table(table,
+                               str(partition / 'part-{}.parquet'.format(i)))
+            nrows_exported += len(df)
+    if verbose:
+        print('\nRows exported: {:,}'.format(nrows_exported))
+    return nrows_exported
+
+
+def find_partitions(parquet_path, min_date=None, max_date=None,
+                    fbi_codes=None):
+    """Finds all partitions of the dataset which can contain crimes
+    in the given date range and of the given FBI codes
+
+    Parameters
+    ----------
+    parquet_path : str or pathlib.Path
+        Folder of the Parquet dataset
+
+    min_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Min date which should be loaded
+
+    max_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Max date which should be loaded
+
+    fbi_codes : list of str, optional (default=None)
+        FBI codes which should be loaded. Defaults to all codes.
+
+    Returns
+    -------
+    list of pathlib.Path
+        Sorted list of all Parquet files in the matching partitions
+    """
+    parquet_path = Path(parquet_path)
+    assert parquet_path.is_dir()
+    min_year = pd.Timestamp(min_date).year if min_date else None
+    max_year = pd.Timestamp(max_date).year if max_date else None
+    fbi_codes = set(fbi_codes) if fbi_codes is not None else None
+
+    files = []
+    for partition in parquet_path.glob('year=*/fbi_code=*'):
+        match = PARTITION_PATTERN.search(partition.as_posix())
+        year, fbi_code = int(match.group(1)), match.group(2)
+        if ((min_year is not None and year < min_year)
+                or (max_year is not None and year > max_year)
+                or (fbi_codes is not None and fbi_code not in fbi_codes)):
+            continue
+        files.extend(partition.glob('*.parquet'))
+    return sorted(files)
+
+
+def filter_date_range(df, columns=None, min_date=None, max_date=None):
+    """Keeps only crimes within the date range and the given columns
+
+    Analogous to the text comparison of dates in SQLite, min_date is
+    inclusive and max_date exclusive.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Crimes containing a 'Date' column if a date range is given
+
+    columns : list of str, optional (default=None)
+        Columns which should be kept. Defaults to all columns.
+
+    min_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Min date which should be kept
+
+    max_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Max date which should be kept
+
+    Returns
+    -------
+    pd.DataFrame
+        Filtered crimes with a new default index
+    """
+    if min_date or max_date:
+        keep = pd.Series(True, index=df.index)
+        if min_date:
+            keep &= df['Date'] >= pd.Timestamp(min_date)
+        if max_date:
+            keep &= df['Date'] < pd.Timestamp(max_date)
+        df = df[keep.values].reset_index(drop=True)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+
+def read_columns_for_filter(columns, min_date=None, max_date=None):
+    """Adds 'Date' to the columns which have to be read
+    if it is needed for the date range
+
+    Parameters
+    ----------
+    columns : list of str or None
+        Columns which should be returned
+
+    min_date, max_date : str or None
+        Date range
+
+    Returns
+    -------
+    list of str or None
+        Columns which have to be read from the files
+    """
+    if columns is not None and (min_date or max_date) and (
+            'Date' not in columns):
+        return list(columns) + ['Date']
+    return columns
+
+
+def read_crimes_parquet(parquet_path='data/processed/crimes_parquet',
+                        columns=None,
+                        min_date=None,
+                        max_date=None,
+                        fbi_codes=None,
+                        memory_map=True):
+    """Loads crimes from the Parquet dataset
+
+    Only the files of the partitions matching the date range and the
+    FBI codes are read, and only the given columns. The date range is
+    then applied to the single rows (see filter_date_range).
+
+    Parameters
+    ----------
+    parquet_path : str or pathlib.Path, optional
+        (default='data/processed/crimes_parquet')
+        Folder of the Parquet dataset
+
+    columns : list of str, optional (default=None)
+        Columns which should be loaded. Defaults to all columns.
+
+    min_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Min date which should be loaded
+
+    max_date : str, format = "YYYY-MM-DD", optional (default=None)
+        Max date which should be loaded
+
+    fbi_codes : list of str, optional (default=None)
+        FBI codes which should be loaded. Defaults to all codes.
+
+    memory_map : boolean, optional (default=True)
+        If True, the files are memory-mapped instead of read into memory
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe containing loaded crimes
+    """
+    pa, pq = import_pyarrow()
+    files = find_partitions(
+        parquet_path,
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=fbi_codes)
+    read_columns = read_columns_for_filter(columns, min_date, max_date)
+    tables = [
+        pq.read_table(str(f), columns=read_columns, memory_map=memory_map)
+        for f in files
+    ]
+    if not tables:
+        return pd.DataFrame(columns=columns if columns is not None else [])
+    df = pa.concat_tables(tables).to_pandas()
+    return filter_date_range(
+        df, columns=columns, min_date=min_date, max_date=max_date)
+
+
+def iter_crimes_parquet(parquet_path='data/processed/crimes_parquet',
+                        columns=None,
+                        min_date=None,
+                        max_date=None,
+                        fbi_codes=None,
+                        memory_map=True):
+    """Loads crimes from the Parquet dataset one file after another
+
+    Same as read_crimes_parquet, but yields the crimes of each file
+    separately. Therefore, only one file has to be kept in memory.
+
+    Parameters
+    ----------
+    See read_crimes_parquet
+
+    Yields
+    ------
+    pd.DataFrame
+        Crimes of one file of the dataset
+    """
+    pa, pq = import_pyarrow()
+    files = find_partitions(
+        parquet_path,
+        min_date=min_date,
+        max_date=max_date,
+        fbi_codes=fbi_codes)
+    read_columns = read_columns_for_filter(columns, min_date, max_date)
+    for f in files:
+        df = pq.read_table(
+            str(f), columns=read_columns, memory_map=memory_map).to_pandas()
+        df = filter_date_range(
+            df, columns=columns, min_date=min_date, max_date=max_date)
+        if len(df) > 0:
+            yield df
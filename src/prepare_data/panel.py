@@ -0,0 +1,345 @@
+"""Contains vectorized functions to build the block panels of the analysis:
+routes aggregated per block and school year, and crime counts per
+block and month.
+
+These replace groupby-apply steps which call a Python function
+for each of the hundreds of thousands of groups.
+
+The block-month panel and the estimation datasets derived from it use
+the compact dtypes of PANEL_DTYPES (see compact_panel), which take a
+fraction of the memory of strings, floats and int64 columns."""
+import numpy as np
+import pandas as pd
+
+# Columns which identify a block in a school year
+BLOCK_YEAR_COLS = ['tract_bloc', 'school_year']
+
+# Dtypes of the columns of the block-month panel. 'time_fe' is the
+# month number of 'Date' (see month_number) and 'Date' stays a datetime.
+PANEL_DTYPES = {
+    'tract_bloc': 'int64',
+    'school_year': 'category',
+    'time_fe': 'int16',
+    'violent_count': 'uint16',
+    'property_count': 'uint16',
+    'treated': 'uint8',
+    'one_over': 'uint8',
+    'two_over': 'uint8',
+    'three_over': 'uint8',
+    'route_number': 'float32',
+    'route_distance': 'float32',
+    'school_name': 'category',
+    'info': 'category'
+}
+
+
+def group_starts(df, group_cols):
+    """Sorts dataframe by group columns and finds the first row of each group
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    group_cols : list of str
+
+    Returns
+    -------
+    tuple of pd.DataFrame and np.ndarray of ints
+        Sorted dataframe (the order within a group is kept) and positions
+        of the first row of each group
+    """
+    df = df.sort_values(group_cols, kind='mergesort').reset_index(drop=True)
+    keys = df[group_cols]
+    new_group = (keys != keys.shift()).any(axis='columns').values
+    return df, np.flatnonzero(new_group)
+
+
+def aggregate_routes(bl_ro, block_cols, route_col='route_number'):
+    """Aggregates all observations of a block per school year to one
+
+    Same result as applying agg_block_schoolyear of the blocks-routes
+    notebook to groupby(['tract_bloc', 'school_year']): The block columns
+    are taken from the first observation, the route numbers of all
+    observations are collected in a list in the new column 'r_numbers'.
+    Blocks without a route get NaN instead of a list.
+
+    Parameters
+    ----------
+    bl_ro : pd.DataFrame
+        Blocks joined with routes, i.e. one row per block, school year
+        and intersecting route (or one row with a missing route_col)
+
+    block_cols : list of str
+        Columns of the blocks which should be kept
+
+    route_col : str, optional (default='route_number')
+        Name of column which should be aggregated into lists
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per block and school year with the columns
+        'tract_bloc', 'school_year', block_cols and 'r_numbers'
+    """
+    bl_ro, starts = group_starts(bl_ro, BLOCK_YEAR_COLS)
+    aggregated = bl_ro.loc[starts, BLOCK_YEAR_COLS + list(block_cols)]
+    aggregated = aggregated.reset_index(drop=True)
+
+    sizes = np.diff(np.append(starts, bl_ro.shape[0]))
+    routes = bl_ro[route_col].values
+    no_route = (sizes == 1) & pd.isnull(routes[starts])
+    r_numbers = [
+        np.nan if missing else group.tolist()
+        for missing, group in zip(no_route, np.split(routes, starts[1:]))
+    ]
+    aggregated['r_numbers'] = pd.Series(r_numbers, dtype='object')
+    return aggregated
+
+
+def school_year_months(sy_range):
+    """Lists the months of each school year
+
+    Parameters
+    ----------
+    sy_range : dict
+        School years as keys and tuples of first and last day
+        ('YYYY-MM-DD') as values
+
+    Returns
+    -------
+    dict of pd.DatetimeIndex
+        Month ends of each school year
+    """
+    return {
+        sy: pd.date_range(start, end, freq='M')
+        for sy, (start, end) in sy_range.items()
+    }
+
+
+def month_number(dates):
+    """Converts dates to consecutive month numbers
+
+    Parameters
+    ----------
+    dates : pd.Series or pd.DatetimeIndex
+
+    Returns
+    -------
+    np.ndarray of ints
+        12 * year + month
+    """
+    dates = pd.DatetimeIndex(dates)
+    return np.asarray(dates.year * 12 + dates.month, dtype='int64')
+
+
+def count_crimes_per_block_month(crimes, violent_col='violent'):
+    """Counts violent and property crimes per block, school year and month
+
+    Parameters
+    ----------
+    crimes : pd.DataFrame
+        Crimes with the columns 'tract_bloc', 'school_year', 'Date'
+        and violent_col
+
+    violent_col : str, optional (default='violent')
+        Name of column which is 1 for violent and 0 for property crimes
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'tract_bloc', 'school_year', 'Date' (end of month),
+        'violent_count' and 'property_count'. Contains only months with
+        at least one crime.
+    """
+    month_end = crimes['Date'].dt.normalize() + pd.offsets.MonthEnd(0)
+    counts = crimes.groupby(
+        [crimes['tract_bloc'], crimes['school_year'], month_end,
+         crimes[violent_col]]).size().unstack(violent_col, fill_value=0)
+    counts = counts.reindex(columns=[1, 0], fill_value=0)
+    counts.columns = ['violent_count', 'property_count']
+    return counts.reset_index()
+
+
+def build_block_month_panel(blocks, counts, sy_range):
+    """Builds a panel with one row per block and month of a school year
+    and fills in the crime counts
+
+    Same result as resampling the crimes of each block and school year
+    to months and reindexing them with all months of the school year
+    (fill_dates of the estimation dataset notebook), but the grid is
+    built at once and the counts are added with a single bincount.
+
+    Parameters
+    ----------
+    blocks : pd.DataFrame
+        Contains the columns 'tract_bloc' and 'school_year'. All school
+        years have to be keys of sy_range.
+
+    counts : pd.DataFrame
+        Crime counts per block and month, see
+        count_crimes_per_block_month. Counts of blocks, school years or
+        months which are not in the panel are ignored.
+
+    sy_range : dict
+        School years as keys and tuples of first and last day
+        ('YYYY-MM-DD') as values
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns 'tract_bloc', 'school_year', 'Date' (end of month),
+        'time_fe', 'violent_count' and 'property_count', sorted by
+        'tract_bloc' and 'Date'. The dtypes are the ones of PANEL_DTYPES.
+    """
+    block_years = blocks[BLOCK_YEAR_COLS].drop_duplicates()
+    block_years = block_years.sort_values(BLOCK_YEAR_COLS).reset_index(
+        drop=True)
+    assert block_years['school_year'].isin(sy_range.keys()).all()
+
+    # Months of all school years in one array. The months of school
+    # year with code c are months[month_start[c]:month_start[c + 1]]
+    school_years = sorted(sy_range.keys())
+    sy_months = school_year_months(sy_range)
+    months = pd.DatetimeIndex(
+        np.concatenate([sy_months[sy].values for sy in school_years]))
+    n_months = np.array([len(sy_months[sy]) for sy in school_years])
+    month_start = np.append(0, np.cumsum(n_months))
+    first_month = month_number(
+        [sy_months[sy][0] for sy in school_years])
+
+    # Grid of all block-years times the months of the school year
+    sy_code = pd.Categorical(
+        block_years['school_year'], categories=school_years).codes
+    rows_per_block_year = n_months[sy_code]
+    block_year = np.repeat(
+        np.arange(block_years.shape[0]), rows_per_block_year)
+    row_start = np.cumsum(rows_per_block_year) - rows_per_block_year
+    month_pos = (np.arange(block_year.shape[0]) - row_start[block_year] +
+                 month_start[sy_code[block_year]])
+
+    panel = block_years.iloc[block_year].reset_index(drop=True)
+    panel['Date'] = months[month_pos]
+
+    # Position of the panel row of each count
+    block_ids = block_years['tract_bloc'].values
+    counts_block = counts['tract_bloc'].values.astype(block_ids.dtype)
+    counts_sy = pd.Categorical(
+        counts['school_year'], categories=school_years).codes
+    block_year_index = pd.MultiIndex.from_arrays(
+        [block_ids, sy_code.astype('int64')])
+    counts_block_year = block_year_index.get_indexer(
+        pd.MultiIndex.from_arrays([counts_block, counts_sy.astype('int64')]))
+    month_offset = (month_number(counts['Date']) -
+                    first_month[np.maximum(counts_sy, 0)])
+    valid = ((counts_block_year >= 0) & (month_offset >= 0) &
+             (month_offset < n_months[np.maximum(counts_sy, 0)]))
+    row = row_start[counts_block_year[valid]] + month_offset[valid]
+
+    for col in ['violent_count', 'property_count']:
+        panel[col] = np.bincount(
+            row,
+            weights=counts[col].values[valid],
+            minlength=panel.shape[0])
+    return compact_panel(panel)
+
+
+def to_integer(values, dtype, name):
+    """Converts values to a small integer dtype without loss
+
+    Parameters
+    ----------
+    values : pd.Series
+
+    dtype : str
+        Numpy integer dtype, e.g. 'uint8'
+
+    name : str
+        Name of the column used in the error message
+
+    Returns
+    -------
+    np.ndarray
+
+    Raises
+    ------
+    ValueError
+        If values are missing, not integers or out of the range of dtype
+    """
+    values = np.asarray(values)
+    info = np.iinfo(dtype)
+    if values.dtype.kind not in 'iub':
+        values = values.astype('float64')
+        if np.isnan(values).any():
+            raise ValueError('Column {} contains missing values'.format(name))
+        if (values != np.round(values)).any():
+            raise ValueError('Column {} contains non-integers'.format(name))
+    if values.size and (values.min() < info.min or values.max() > info.max):
+        raise ValueError('Column {} exceeds the range of {}'.format(
+            name, dtype))
+    return values.astype(dtype)
+
+
+def compact_panel(df):
+    """Converts the columns of a block-month panel to PANEL_DTYPES
+
+    Adds the column 'time_fe' if the panel has a column 'Date'. Columns
+    which are not in PANEL_DTYPES are kept as they are.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Block-month panel or estimation dataset
+
+    Returns
+    -------
+    pd.DataFrame
+        Copy of df with compact dtypes
+
+    Raises
+    ------
+    ValueError
+        If an integer column can not be converted without loss,
+        see to_integer
+    """
+    df = df.copy()
+    if 'Date' in df.columns:
+        df['time_fe'] = month_number(df['Date'])
+    for col, dtype in PANEL_DTYPES.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype in ['category', 'float32']:
+            df[col] = df[col].astype(dtype)
+        else:
+            df[col] = to_integer(df[col], dtype, col)
+    return df
+
+
+def validate_panel(df):
+    """Checks that a block-month panel has the dtypes of PANEL_DTYPES
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    Returns
+    -------
+    Nothing
+
+    Raises
+    ------
+    ValueError
+        If a column of PANEL_DTYPES has another dtype or if one of the
+        columns of the panel of build_block_month_panel is missing
+    """
+    required = BLOCK_YEAR_COLS + ['time_fe', 'violent_count', 'property_count']
+    wrong = [
+        '{} ({})'.format(col, df[col].dtype if col in df.columns else
+                         'missing')
+        for col, dtype in sorted(PANEL_DTYPES.items())
+        if (col in df.columns and str(df[col].dtype) != dtype) or
+        (col not in df.columns and col in required)
+    ]
+    if wrong:
+        raise ValueError('Panel does not follow PANEL_DTYPES: {}'.format(
+            ', '.join(wrong)))
+    return
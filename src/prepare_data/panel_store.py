@@ -0,0 +1,248 @@
+"""Contains an on-disk store for block-month panels like the estimation
+datasets, which can be read partially without loading the whole panel.
+
+A store is a folder with one .npy file per column and a file
+'metadata.json'. The rows are sorted by block and date. Categorical
+columns are stored as their codes, the categories are kept in the
+metadata. Additionally, the store contains the sorted block identifiers
+('index_blocks.npy') and the position of the first row of each block
+('index_offsets.npy'), such that the rows of a set of blocks are found
+without reading the block column.
+
+All columns are opened as read-only memory-mapped arrays. Therefore,
+only the parts of the files which are actually used are read from disk."""
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from ..calculate.point_in_polygon import expand_ranges
+from .panel import validate_panel
+
+METADATA_FILE = 'metadata.json'
+
+# Version of the format of the store. Version 2 stores the block
+# identifiers as int64 (see panel.PANEL_DTYPES), version 1 as int32.
+STORE_VERSION = 2
+
+
+def write_panel(df, path, block_col='tract_bloc', date_col='Date'):
+    """Writes a block-month panel into a store
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Panel with the dtypes of panel.PANEL_DTYPES (see
+        panel.compact_panel). Object columns are not supported.
+
+    path : str or pathlib.Path
+        Folder of the store. An existing store in this folder is replaced.
+
+    block_col, date_col : str, optional (default='tract_bloc' and 'Date')
+        Names of the columns with the blocks and the dates
+
+    Returns
+    -------
+    Nothing
+
+    Raises
+    ------
+    ValueError
+        If df has an object column or path is a folder which is
+        not a store
+    """
+    validate_panel(df)
+    object_cols = [col for col in df.columns if df[col].dtype == 'object']
+    if object_cols:
+        raise ValueError('Object columns can not be stored: {}'.format(
+            ', '.join(object_cols)))
+    path = Path(path)
+    if path.exists():
+        if not (path / METADATA_FILE).is_file():
+            raise ValueError('{} exists and is not a panel store'.format(path))
+        shutil.rmtree(str(path))
+    path.mkdir(parents=True)
+
+    df = df.sort_values([block_col, date_col], kind='mergesort')
+    blocks = df[block_col].values
+    block_start = np.flatnonzero(np.append(True, blocks[1:] != blocks[:-1]))
+    np.save(str(path / 'index_blocks.npy'), blocks[block_start])
+    np.save(str(path / 'index_offsets.npy'),
+            np.append(block_start, blocks.shape[0]))
+
+    columns = []
+    for col in df.columns:
+        values = df[col]
+        column = {'name': col, 'categories': None}
+        if values.dtype.name == 'category':
+            column['categories'] = values.cat.categories.tolist()
+            values = values.cat.codes
+        np.save(str(path / 'column_{}.npy'.format(col)), values.values)
+        columns.append(column)
+    metadata = {
+        'version': STORE_VERSION,
+        'n_rows': df.shape[0],
+        'block_col': block_col,
+        'date_col': date_col,
+        'columns': columns
+    }
+    with (path / METADATA_FILE).open('w') as f:
+        json.dump(metadata, f, indent=1)
+    return
+
+
+class PanelStore:
+    """Read access to a store written by write_panel
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Folder of the store
+
+    Attributes
+    ----------
+    columns : list of str
+        Names of all stored columns
+
+    n_rows : int
+
+    blocks : np.ndarray
+        Sorted identifiers of all blocks
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with (self.path / METADATA_FILE).open() as f:
+            metadata = json.load(f)
+        if metadata['version'] != STORE_VERSION:
+            raise ValueError(
+                'Store {} has version {}, expected {}. Write it again with '
+                'write_panel.'.format(path, metadata['version'],
+                                      STORE_VERSION))
+        self.n_rows = metadata['n_rows']
+        self.block_col = metadata['block_col']
+        self.date_col = metadata['date_col']
+        self.categories = {
+            c['name']: c['categories']
+            for c in metadata['columns']
+        }
+        self.columns = [c['name'] for c in metadata['columns']]
+        self.blocks = self.load_array('index_blocks.npy')
+        self.offsets = self.load_array('index_offsets.npy')
+
+    def load_array(self, file_name):
+        """Opens a file of the store as read-only memory-mapped array"""
+        return np.load(str(self.path / file_name), mmap_mode='r')
+
+    def column(self, col):
+        """Raw values of a column without copying them
+
+        Parameters
+        ----------
+        col : str
+
+        Returns
+        -------
+        np.memmap
+            Values of the column, codes for categorical columns
+        """
+        return self.load_array('column_{}.npy'.format(col))
+
+    def block_rows(self, blocks):
+        """Positions of the rows of a set of blocks
+
+        Parameters
+        ----------
+        blocks : array-like
+            Identifiers of the blocks. Blocks which are not in the store
+            are ignored. Converted to the dtype of the stored
+            identifiers (int64).
+
+        Returns
+        -------
+        np.ndarray of ints
+            Sorted positions
+        """
+        blocks = np.unique(np.asarray(blocks, dtype=self.blocks.dtype))
+        pos = np.searchsorted(self.blocks, blocks)
+        found = pos < self.blocks.shape[0]
+        found[found] = self.blocks[pos[found]] == blocks[found]
+        pos = pos[found]
+        starts = np.asarray(self.offsets[pos])
+        counts = np.asarray(self.offsets[pos + 1]) - starts
+        return expand_ranges(starts, counts)[1]
+
+    def rows(self, blocks=None, school_years=None, start=None, end=None):
+        """Positions of all rows which match the given conditions
+
+        Parameters
+        ----------
+        blocks : array-like, optional (default=None)
+            Identifiers of the blocks
+
+        school_years : list of str, optional (default=None)
+            E.g. ['SY1314', 'SY1415']
+
+        start, end : str, format = "YYYY-MM-DD", optional (default=None)
+            First and last date (both inclusive)
+
+        Returns
+        -------
+        np.ndarray of ints or slice
+            Sorted positions, a slice over all rows if no condition
+            is given
+        """
+        if blocks is None:
+            if school_years is None and start is None and end is None:
+                return slice(None)
+            rows = np.arange(self.n_rows)
+        else:
+            rows = self.block_rows(blocks)
+        keep = np.ones(rows.shape[0], dtype=bool)
+        if school_years is not None:
+            codes = [
+                self.categories['school_year'].index(sy)
+                for sy in school_years
+                if sy in self.categories['school_year']
+            ]
+            keep &= np.isin(self.column('school_year')[rows], codes)
+        if start is not None or end is not None:
+            dates = self.column(self.date_col)[rows]
+            if start is not None:
+                keep &= dates >= np.datetime64(start)
+            if end is not None:
+                keep &= dates <= np.datetime64(end)
+        return rows[keep]
+
+    def load(self, columns=None, blocks=None, school_years=None, start=None,
+             end=None):
+        """Loads the rows which match the given conditions
+
+        Parameters
+        ----------
+        columns : list of str, optional (default=None)
+            Columns to load, defaults to all
+
+        blocks, school_years, start, end
+            See rows
+
+        Returns
+        -------
+        pd.DataFrame
+            Rows sorted by block and date with the dtypes of the
+            written panel. Only the selected rows and columns are read
+            into memory.
+        """
+        rows = self.rows(
+            blocks=blocks, school_years=school_years, start=start, end=end)
+        df = pd.DataFrame()
+        for col in columns or self.columns:
+            # Copy, such that the dataframe can be modified
+            values = np.array(self.column(col)[rows])
+            if self.categories[col] is not None:
+                values = pd.Categorical.from_codes(values,
+                                                   self.categories[col])
+            df[col] = values
+        return df
@@ -1,6 +1,8 @@
 """Contains functions for preparation of data on Safe Passage routes"""
 import geopandas as gpd
-import pandas as pd
+
+from ..instrument import instrument
+from .school_names import harmonize_names, load_name_index
 
 
 def read_routes_file(shapefile_path, school_year):
@@ -77,53 +79,7 @@ def check_school_name_id_unique(df):
     return
 
 
-def harmonize_name(name, name_lookup):
-    """Looks up harmonized school name
-
-    Parameters
-    ----------
-    name : str
-        The school name to harmonize.
-
-    name_lookup : iterable of two-value array-likes
-        School names where the first value of each item is
-        harmonized name and second value is list of
-        different version of that name.
-
-    Returns
-    -------
-    str
-        Harmonized name
-    """
-    name_harmonized = [k for k, v in name_lookup if name.upper() in v]
-    try:
-        assert len(name_harmonized) == 1
-    except AssertionError:
-        raise Exception("Could not harmonize school {}".format(name))
-    # Return unpacked harmonized name
-    return (name_harmonized[0])
-
-
-def include_harmonized_name(row):
-    """Includes harmonized name in variations list
-
-    Parameters
-    ----------
-    row : pd.Series
-        Needs to contain 'variations' and 'harmonized_name'
-
-    Returns
-    -------
-    pd.Series
-    """
-    if not pd.isnull(row['variations']):
-        row['variations'] = ([row['harmonized_name'].upper()] + list(
-            map(str.upper, row['variations'].split('; '))))
-    else:
-        row['variations'] = [row['harmonized_name'].upper()]
-    return row
-
-
+@instrument
 def harmonize_all_names(df, col, school_name_path):
     """Harmonizes all school names for a given dataframe and column
 
@@ -144,25 +100,8 @@ def harmonize_all_names(df, col, school_name_path):
     pd.DataFrame
         Original dataframe with given column harmonized.
     """
-    # Load list of different school name versions
-    harmonized_names = pd.read_excel(school_name_path)
-
-    # Make sure that there are no missing values in certain columns
-    assert (not harmonized_names[['SY_added', 'school_id', 'harmonized_name']]
-            .isnull().any().any())
-
-    # Adds harmonized_name to variations and makes all names upper case
-    # Upper case allows for "case-insensitive" comparison later on
-    harmonized_names = harmonized_names.apply(
-        include_harmonized_name, axis='columns')
-
-    # Convert to list of tuples
-    name_lookup = list(
-        zip(harmonized_names['harmonized_name'],
-            harmonized_names['variations']))
-
-    # Harmonize school names of routes dataset
-    # using the above created name_lookup
-    df.loc[:, col] = df['school_name'].apply(
-        harmonize_name, args=(name_lookup, ))
+    # Index from upper case variations to harmonized names. Upper case
+    # allows for "case-insensitive" comparison.
+    name_index = load_name_index(school_name_path)
+    df.loc[:, col] = harmonize_names(df[col], name_index)
     return df
@@ -6,7 +6,37 @@ import pandas as pd
 from pandas.api.types import is_numeric_dtype, is_string_dtype
 
 
-def split_school(group, moved_schools):
+def group_first_last(df, group_col, col, last=False):
+    """Broadcasts the value of the first or last row of each group
+    to all rows of the group
+
+    Unlike groupby().transform('first') or transform('last'), missing
+    values are not skipped.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    group_col : str
+        Name of column to group by
+
+    col : str
+        Name of column whose values are broadcasted
+
+    last : boolean, optional (default=False)
+        If True, takes the value of the last row, else of the first row
+
+    Returns
+    -------
+    pd.Series
+        Same index as df
+    """
+    is_end = df.groupby(group_col).cumcount(ascending=not last) == 0
+    values = df.loc[is_end, [group_col, col]].set_index(group_col)[col]
+    return df[group_col].map(values)
+
+
+def split_moved_schools(df, moved_schools, group_col='school_name'):
     """Splits schools by changing name and id
 
     Adds 'OLD ' tag in front of school names for all years
@@ -15,58 +45,81 @@ def split_school(group, moved_schools):
     changes school id for old part by changing first number with a 9
     (no original school number, all 6 digits, starts with 9,
     therefore there should be no conflict and school_id stays unique).
+    The school id of the old part is derived from the id of the first
+    observation of the school.
 
     Parameters
     ----------
-    group : pandas groupby object
+    df : pd.DataFrame
+        Contains the columns 'school_name' and 'school_id'. Observations
+        of a school have to be sorted by school year.
 
     moved_schools : dict
         Contains names of moved schools as keys
         and observation number of first school year at new
         location as value.
 
+    group_col : str, optional (default='school_name')
+        Name of column which identifies a school
+
     Returns
     -------
-    pandas groupby object
-        Modified group
+    pd.DataFrame
+        Modified copy of df
     """
-    school_names = group['school_name'].values
-    school_name_original = school_names[0]
-    # Only do it for schools which actually moved
-    if school_name_original in moved_schools.keys():
-        # Observation number where new location starts
-        pos_change = moved_schools[school_name_original]
-        # Change all school name entries up to that observation
-        school_names[:pos_change] = 'OLD ' + school_name_original
-        group['school_name'] = school_names
-        # Change all school id entries up to that observation
-        ids = group['school_id'].values
-        id_original = ids[0]
-        ids[:pos_change] = int('9' + str(id_original)[1:])
-        group['school_id'] = ids
-    return group
-
-
-def take_last_values(group):
+    df = df.copy()
+    # Observation number of each school and of the move
+    obs_number = df.groupby(group_col).cumcount()
+    pos_change = df[group_col].map(moved_schools)
+    is_old = (obs_number < pos_change).values
+
+    old_names = 'OLD ' + df.loc[is_old, 'school_name']
+    first_ids = group_first_last(df, group_col, 'school_id')[is_old]
+    old_ids = ('9' + first_ids.astype(str).str[1:]).astype(
+        df['school_id'].dtype)
+    df.loc[is_old, 'school_name'] = old_names
+    df.loc[is_old, 'school_id'] = old_ids
+    return df
+
+
+def take_last_values(df,
+                     cols=('lat', 'lon', 'address'),
+                     group_col='school_name'):
     """Overwrite all coordinates and addresses with most recent ones
     for all schools.
 
     Parameters
     ----------
-    group : pandas groupby object
+    df : pd.DataFrame
+        Observations of a school have to be sorted by school year.
+
+    cols : iterable of str, optional (default=('lat', 'lon', 'address'))
+        Columns which should be overwritten
+
+    group_col : str, optional (default='school_name')
+        Name of column which identifies a school
 
     Returns
     -------
-    pandas groupby object
-        Modified group
+    pd.DataFrame
+        Modified copy of df
     """
-    group['lat'] = group['lat'].values[-1]
-    group['lon'] = group['lon'].values[-1]
-    group['address'] = group['address'].values[-1]
-    return group
+    df = df.copy()
+    for col in cols:
+        df[col] = group_first_last(df, group_col, col, last=True)
+    return df
+
+
+# Conventions for school names as (compiled pattern, replacement)
+SCHOOL_CATEGORY_PATTERNS = [
+    (re.compile(r'\sHs(?![A-Za-z0-9])'), ' HS'),
+    (re.compile(r'\sEs(?![A-Za-z0-9])'), ' ES'),
+    (re.compile(r'^Cics\s'), 'CICS '),
+    (re.compile(r'^Yccs\s'), 'YCCS '),
+]
 
 
-def uppercase_school_categories(name):
+def uppercase_school_categories(names):
     """Adjusts school names by certain conventions
 
     Changes Hs -> HS and Es -> ES in school name
@@ -74,19 +127,20 @@ def uppercase_school_categories(name):
 
     Parameters
     ----------
-    name : str
-        School name which should be harmonized.
+    names : str or pd.Series of str
+        School name(s) which should be harmonized.
 
     Returns
     -------
-    str
-        Modified school name
+    str or pd.Series
+        Modified school name(s)
     """
-    name = re.sub('\sHs(?![A-Za-z0-9])', ' HS', name)
-    name = re.sub('\sEs(?![A-Za-z0-9])', ' ES', name)
-    name = re.sub('^Cics\s', 'CICS ', name)
-    name = re.sub('^Yccs\s', 'YCCS ', name)
-    return name
+    for pattern, replacement in SCHOOL_CATEGORY_PATTERNS:
+        if isinstance(names, pd.Series):
+            names = names.str.replace(pattern, replacement, regex=True)
+        else:
+            names = pattern.sub(replacement, names)
+    return names
 
 
 def check_dtypes(df):
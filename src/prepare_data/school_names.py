@@ -0,0 +1,101 @@
+"""Contains functions to harmonize school names according to the
+conventions of this project (see data/raw/school_names.xlsx).
+
+The file lists for each school its harmonized name and the variations
+of the name which occur in the different datasets. From these, a reverse
+index from each variation (upper case) to the harmonized name is built
+once. Whole columns of school names are then harmonized with a single
+lookup in this index."""
+import pandas as pd
+
+
+def build_name_index(harmonized_names):
+    """Builds index from variations of school names to harmonized names
+
+    Parameters
+    ----------
+    harmonized_names : pd.DataFrame
+        Contains the columns 'harmonized_name' and 'variations'. Variations
+        are separated by '; ' and can be missing. The harmonized name
+        itself is a variation as well.
+
+    Returns
+    -------
+    dict
+        Upper case variations as keys and harmonized names as values
+
+    Raises
+    ------
+    Exception
+        If a variation belongs to more than one entry of harmonized_names
+    """
+    name_index = {}
+    ambiguous = set()
+    for harmonized_name, variations in zip(harmonized_names['harmonized_name'],
+                                           harmonized_names['variations']):
+        all_variations = {harmonized_name.upper()}
+        if not pd.isnull(variations):
+            all_variations.update(v.upper() for v in variations.split('; '))
+        for variation in all_variations:
+            if variation in name_index:
+                ambiguous.add(variation)
+            name_index[variation] = harmonized_name
+    if ambiguous:
+        raise Exception('School name variations belong to multiple '
+                        'schools: {}'.format(', '.join(sorted(ambiguous))))
+    return name_index
+
+
+def load_name_index(school_name_path):
+    """Loads file with school name variations and builds index
+
+    Parameters
+    ----------
+    school_name_path : str or pathlib.Path
+        Path to file which contains different school name versions.
+
+    Returns
+    -------
+    dict
+        See build_name_index
+    """
+    harmonized_names = pd.read_excel(school_name_path)
+
+    # Make sure that there are no missing values in certain columns
+    assert (not harmonized_names[['SY_added', 'school_id', 'harmonized_name']]
+            .isnull().any().any())
+    return build_name_index(harmonized_names)
+
+
+def harmonize_names(names, name_index, errors='raise'):
+    """Looks up harmonized names of many school names at once
+
+    The comparison is case-insensitive.
+
+    Parameters
+    ----------
+    names : pd.Series of str
+
+    name_index : dict
+        See build_name_index
+
+    errors : str, optional (default='raise')
+        What to do with names which are not in the index.
+        'raise' raises an exception, 'coerce' sets them to NaN and
+        'ignore' keeps the original name.
+
+    Returns
+    -------
+    pd.Series
+        Harmonized names
+    """
+    assert errors in ['raise', 'coerce', 'ignore']
+    harmonized = names.str.upper().map(name_index)
+    not_found = harmonized.isnull()
+    if not_found.any():
+        if errors == 'raise':
+            raise Exception('Could not harmonize schools {}'.format(', '.join(
+                names[not_found].astype(str).unique())))
+        elif errors == 'ignore':
+            harmonized[not_found] = names[not_found]
+    return harmonized
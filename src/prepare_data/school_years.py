@@ -0,0 +1,163 @@
+"""Contains the school years of the analysis and functions
+to assign dates to them
+
+Dates are tagged in a single vectorized pass over their int64
+representation (nanoseconds since the epoch): the school year is
+found with np.searchsorted over the sorted boundaries of all school
+years, the time of day and the weekday with integer arithmetic."""
+import numpy as np
+import pandas as pd
+
+# School years for which crimes are matched to blocks
+SCHOOL_YEARS = [
+    'SY0506', 'SY0607', 'SY0708', 'SY0809', 'SY0910', 'SY1011', 'SY1112',
+    'SY1213', 'SY1314', 'SY1415', 'SY1516'
+]
+
+# First and last time of day (both inclusive, 'HH:MM:SS') of the
+# school hours, when Safe Passage guards are present
+SCHOOL_HOURS = ('06:30:00', '17:30:00')
+
+# Nanoseconds per day
+DAY_NS = 24 * 60 * 60 * 10**9
+
+
+def school_year_range(school_years=None):
+    """First and last day of school years
+
+    A school year 'SYXXYY' starts on September 1st of 20XX
+    and ends on June 30th of 20YY.
+
+    Parameters
+    ----------
+    school_years : list of str, optional (default=None)
+        School years in the format of 'SYXXYY'. Defaults to SCHOOL_YEARS.
+
+    Returns
+    -------
+    dict
+        School years as keys and tuples of first and last day
+        ('YYYY-MM-DD') as values
+    """
+    if school_years is None:
+        school_years = SCHOOL_YEARS
+    return {
+        sy: ('20{}-09-01'.format(sy[2:4]), '20{}-06-30'.format(sy[4:]))
+        for sy in school_years
+    }
+
+
+def to_nanoseconds(dates):
+    """Converts dates to nanoseconds since the epoch
+
+    Parameters
+    ----------
+    dates : pd.Series of datetimes
+
+    Returns
+    -------
+    tuple of np.ndarray
+        Nanoseconds (int64) and a mask of the missing dates
+    """
+    values = np.asarray(dates, dtype='datetime64[ns]')
+    return values.view('int64'), np.isnat(values)
+
+
+def school_year_edges(sy_range):
+    """Sorted boundaries of all school years
+
+    Parameters
+    ----------
+    sy_range : dict
+        See school_year_range
+
+    Returns
+    -------
+    tuple of np.ndarray
+        Boundaries in nanoseconds, alternating the first nanosecond of a
+        school year and the first nanosecond after it, and the names of
+        the school years in the same order
+
+    Raises
+    ------
+    ValueError
+        If school years overlap
+    """
+    school_years = sorted(sy_range, key=lambda sy: sy_range[sy][0])
+    edges = np.empty(2 * len(school_years), dtype='int64')
+    edges[0::2] = [pd.Timestamp(sy_range[sy][0]).value for sy in school_years]
+    # The last day is compared at midnight (see assign_school_years)
+    edges[1::2] = [
+        pd.Timestamp(sy_range[sy][1]).value + 1 for sy in school_years
+    ]
+    if (np.diff(edges) < 0).any():
+        raise ValueError('School years must not overlap')
+    return edges, np.array(school_years, dtype='object')
+
+
+def assign_school_years(dates, sy_range=None):
+    """Assigns dates to the school year they fall into
+
+    A date belongs to a school year if it is between the first day and the
+    last day (midnight, i.e. the comparison is done with pd.Timestamp of
+    the last day as in the crimes-blocks notebook).
+
+    Parameters
+    ----------
+    dates : pd.Series of datetimes
+
+    sy_range : dict, optional (default=None)
+        See school_year_range. Defaults to school_year_range().
+
+    Returns
+    -------
+    pd.Series
+        School year of each date, NaN for dates outside of all school years
+    """
+    if sy_range is None:
+        sy_range = school_year_range()
+    ns, missing = to_nanoseconds(dates)
+    edges, school_years = school_year_edges(sy_range)
+    # Even positions are within a school year, odd ones between two
+    pos = np.searchsorted(edges, ns, side='right') - 1
+    inside = (pos >= 0) & (pos % 2 == 0) & ~missing
+    # Dates outside of all school years get the appended NaN
+    labels = np.append(school_years, np.nan)
+    return pd.Series(
+        labels[np.where(inside, pos // 2, -1)], index=dates.index)
+
+
+def tag_school_times(dates, sy_range=None, school_hours=SCHOOL_HOURS):
+    """Tags dates with their school year, whether they are within the
+    school hours and whether they are on a weekday
+
+    Parameters
+    ----------
+    dates : pd.Series of datetimes
+
+    sy_range : dict, optional (default=None)
+        See assign_school_years
+
+    school_hours : tuple of str, optional (default=SCHOOL_HOURS)
+        First and last time of day ('HH:MM:SS'), both inclusive as in
+        pd.DataFrame.between_time
+
+    Returns
+    -------
+    pd.DataFrame
+        Same index as dates with the columns 'school_year' (see
+        assign_school_years), 'school_hours' and 'weekday' (Monday
+        to Friday). Missing dates are neither in the school hours nor
+        on a weekday.
+    """
+    ns, missing = to_nanoseconds(dates)
+    time_of_day = ns % DAY_NS
+    first, last = [pd.Timedelta(t).value for t in school_hours]
+    # The epoch (1970-01-01) was a Thursday, i.e. day 3 of the week
+    day_of_week = (ns // DAY_NS + 3) % 7
+    return pd.DataFrame({
+        'school_year': assign_school_years(dates, sy_range=sy_range),
+        'school_hours': (time_of_day >= first) & (time_of_day <= last) &
+        ~missing,
+        'weekday': (day_of_week <= 4) & ~missing
+    }, index=dates.index, columns=['school_year', 'school_hours', 'weekday'])